@@ -0,0 +1,131 @@
+import asyncio
+import functools
+import importlib.util
+import inspect
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+__author__ = 'Darryl Oatridge'
+
+
+class AsyncHandlerMixin(object):
+    """ Adds load_canonical_async and persist_canonical_async to a handler, so an asyncio service can fan out to
+    many sources on one event loop.
+
+    A handler with a native asyncio driver implements _load_canonical_native, a coroutine that returns the
+    canonical, or NotImplemented if the driver is not installed or the contract uses an option the native path
+    does not cover. Everything else runs the blocking method on a shared, bounded thread pool, so hundreds of
+    concurrent calls queue for a worker rather than each taking a thread. Native clients are created once per
+    event loop, see loop_client().
+    """
+
+    _executor = None
+    _max_workers = None
+    _lock = threading.Lock()
+    _drivers = {}
+
+    @classmethod
+    def configure(cls, max_workers: int=None):
+        """ sets the number of worker threads used by the blocking fallback, replacing the current pool
+
+        :param max_workers: the worker threads. Default the HADRON_ASYNC_WORKERS environment variable, or
+                    min(32, cpu count + 4)
+        """
+        with cls._lock:
+            cls._max_workers = max_workers if isinstance(max_workers, int) and max_workers > 0 else None
+            executor, cls._executor = cls._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    async def load_canonical_async(self, **kwargs):
+        """ returns the canonical as load_canonical does, with the native asyncio driver if there is one, else
+        with load_canonical on the bounded thread pool """
+        rtn_data = await self._load_canonical_native(**kwargs)
+        if rtn_data is NotImplemented:
+            rtn_data = await self.run_blocking(self.load_canonical, **kwargs)
+        return rtn_data
+
+    async def persist_canonical_async(self, canonical, **kwargs) -> bool:
+        """ persists the canonical as persist_canonical does, on the bounded thread pool """
+        if not hasattr(self, 'persist_canonical'):
+            raise NotImplementedError(f"{type(self).__name__} is a source handler and can not persist")
+        return await self.run_blocking(self.persist_canonical, canonical, **kwargs)
+
+    async def _load_canonical_native(self, **kwargs):
+        """ the native asyncio load. Returns NotImplemented to fall back to the thread pool """
+        return NotImplemented
+
+    @classmethod
+    async def run_blocking(cls, func, *args, **kwargs):
+        """ runs the blocking callable on the shared bounded thread pool and returns its result """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(cls._get_executor(), functools.partial(func, *args, **kwargs))
+
+    @classmethod
+    def driver_available(cls, name: str) -> bool:
+        """ returns True if the named module can be imported, without importing it """
+        if name not in cls._drivers:
+            try:
+                cls._drivers[name] = importlib.util.find_spec(name) is not None
+            except (ImportError, ValueError):
+                cls._drivers[name] = False
+        return cls._drivers[name]
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        with cls._lock:
+            if cls._executor is None:
+                max_workers = cls._max_workers
+                if max_workers is None and str(os.environ.get('HADRON_ASYNC_WORKERS', '')).isdigit():
+                    max_workers = int(os.environ['HADRON_ASYNC_WORKERS']) or None
+                max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+                cls._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hadron-async')
+            return cls._executor
+
+
+_loop_clients = {}
+
+
+async def loop_client(key: tuple, factory, close=None):
+    """ returns the native asyncio client or pool for key on the running event loop, awaiting factory to create
+    it on first use. Asyncio clients are bound to the loop that created them, so unlike the ConnectionRegistry
+    there is one per loop. The clients of loops that have since closed are dropped
+
+    :param key: the connection identity, see ConnectionRegistry.key()
+    :param factory: a zero argument coroutine function, or callable returning an awaitable, creating the client
+    :param close: (optional) a callable passed the client, returning an awaitable, to close it
+    :return: the client
+    """
+    loop = asyncio.get_running_loop()
+    for closed in [other for other in _loop_clients if other.is_closed()]:
+        _loop_clients.pop(closed, None)
+    clients = _loop_clients.setdefault(loop, {})
+    entry = clients.get(key)
+    if entry is None:
+        entry = clients[key] = (asyncio.ensure_future(_create(factory)), close)
+    try:
+        return await asyncio.shield(entry[0])
+    except Exception:
+        if clients.get(key) is entry:
+            del clients[key]
+        raise
+
+
+async def _create(factory):
+    client = factory()
+    return await client if inspect.isawaitable(client) else client
+
+
+async def close_loop_clients():
+    """ closes the native clients created on the running event loop. Call before the loop is closed """
+    clients = _loop_clients.pop(asyncio.get_running_loop(), {})
+    for future, close in clients.values():
+        if close is None or not future.done() or future.cancelled() or future.exception() is not None:
+            continue
+        try:
+            result = close(future.result())
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            pass
@@ -0,0 +1,278 @@
+import getpass
+import hashlib
+import json
+import os
+import tempfile
+import time
+from aistac.handlers.abstract_handlers import AbstractSourceHandler, ConnectorContract, HandlerFactory
+import pandas as pd
+from ds_connectors.handlers.instrument_helpers import Instrumentation
+from ds_connectors.handlers.async_helpers import AsyncHandlerMixin
+
+__author__ = 'Darryl Oatridge'
+
+
+class CachedSourceHandler(AsyncHandlerMixin, AbstractSourceHandler):
+    """ A caching wrapper around any source handler. The canonical returned by the wrapped handler is kept on local
+    disk as an Arrow IPC file keyed by a sha256 of the handler, contract uri, contract kwargs and load kwargs, so a
+    repeated load within the time to live is read back from a memory map rather than the database.
+
+    The cache directory is bounded in size, evicting the least recently used results first. With revalidate set the
+    wrapped handler's has_changed() is asked before a cached result is served, and a change reloads it. A handler
+    has no baseline to compare with on its first check, so revalidation pays off with a long-lived handler.
+    Results Arrow can not represent, such as a column of mixed types, are returned without being cached.
+
+    The cache directory is created readable only by the current user. A directory owned by another user, or that
+    others can write to, is never read from or written to, and every load goes to the wrapped handler.
+
+        Example
+            handler = CachedSourceHandler.wrap(MysqlSourceHandler(connector_contract), ttl=600)
+            df = handler.load_canonical()
+
+        or through the connector contract
+            ConnectorContract(uri, module_name='ds_connectors.handlers.cache_handlers', handler='CachedSourceHandler',
+                              cache_module='ds_connectors.handlers.mysql_handlers',
+                              cache_handler='MysqlSourceHandler', cache_ttl=600)
+
+        params:
+            cache_module: the module of the wrapped handler, when built from the connector contract
+            cache_handler: the class name of the wrapped handler, when built from the connector contract
+            cache_ttl: (optional) the seconds a result is served for, 0 for no expiry. Default the HADRON_CACHE_TTL
+                        environment variable, else 3600
+            cache_max_bytes: (optional) the size the cache directory is evicted down to. Default the
+                        HADRON_CACHE_MAX_BYTES environment variable, else 1 GiB
+            cache_revalidate: (optional) if true, the wrapped handler's has_changed is checked before a cached
+                        result is served. Default False
+            cache_path: (optional) the cache directory. Default the HADRON_CACHE_PATH environment variable, else
+                        'hadron_cache-<uid>' in the system temp directory
+    """
+
+    _SUFFIX = '.arrow'
+
+    def __init__(self, connector_contract: ConnectorContract, handler: AbstractSourceHandler=None):
+        """ initialise the Handler passing the Connector Contract, and optionally the handler to wrap """
+        # required module import
+        self.pa = HandlerFactory.get_module('pyarrow')
+        super().__init__(connector_contract)
+        _kwargs = self.connector_contract.kwargs
+        self._cache_params = {k: _kwargs.pop(k) for k in list(_kwargs.keys()) if k.startswith('cache_')}
+        if handler is None:
+            module_name = self._cache_params.get('cache_module')
+            handler_name = self._cache_params.get('cache_handler')
+            if not module_name or not handler_name:
+                raise ValueError("The CachedSourceHandler requires a 'cache_module' and 'cache_handler' naming the "
+                                 "handler to wrap")
+            handler_class = getattr(HandlerFactory.get_module(module_name), handler_name)
+            handler = handler_class(ConnectorContract(self.connector_contract.raw_uri, module_name=module_name,
+                                                      handler=handler_name, **_kwargs))
+        if not isinstance(handler, AbstractSourceHandler):
+            raise ValueError("The CachedSourceHandler can only wrap a source handler")
+        self._handler = handler
+        self._ttl = self._number('cache_ttl', 'HADRON_CACHE_TTL', 3600)
+        self._max_bytes = self._number('cache_max_bytes', 'HADRON_CACHE_MAX_BYTES', 1 << 30)
+        self._revalidate = str(self._cache_params.get('cache_revalidate', False)).lower() == 'true'
+        self._cache_path = str(self._cache_params.get('cache_path') or os.environ.get('HADRON_CACHE_PATH') or
+                               self.default_cache_path())
+        self._contract_kwargs = _kwargs
+
+    @classmethod
+    def wrap(cls, handler: AbstractSourceHandler, ttl: int=None, max_bytes: int=None, revalidate: bool=None,
+             cache_path: str=None):
+        """ returns a CachedSourceHandler around an existing handler
+
+        :param handler: the source handler to wrap
+        :param ttl: (optional) the seconds a result is served for, 0 for no expiry
+        :param max_bytes: (optional) the size the cache directory is evicted down to
+        :param revalidate: (optional) if the handler's has_changed is checked before a cached result is served
+        :param cache_path: (optional) the cache directory
+        :return: the cached handler
+        """
+        _cc = handler.connector_contract
+        options = {k: v for k, v in {'cache_ttl': ttl, 'cache_max_bytes': max_bytes, 'cache_revalidate': revalidate,
+                                     'cache_path': cache_path}.items() if v is not None}
+        return cls(ConnectorContract(_cc.raw_uri, module_name=cls.__module__, handler=cls.__name__,
+                                     **{**_cc.kwargs, **options}), handler=handler)
+
+    @staticmethod
+    def default_cache_path() -> str:
+        """ the per user cache directory in the system temp directory """
+        user = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+        return os.path.join(tempfile.gettempdir(), f'hadron_cache-{user}')
+
+    @property
+    def handler(self) -> AbstractSourceHandler:
+        """ the wrapped handler """
+        return self._handler
+
+    def supported_types(self) -> list:
+        """ The source types supported with this module"""
+        return self._handler.supported_types()
+
+    def exists(self) -> bool:
+        return self._handler.exists()
+
+    def has_changed(self) -> bool:
+        return self._handler.has_changed()
+
+    def reset_changed(self, changed: bool = False):
+        self._handler.reset_changed(changed)
+
+    def load_canonical(self, **kwargs) -> [dict, pd.DataFrame]:
+        """ returns the cached canonical for the load kwargs if there is one, else loads it with the wrapped
+        handler and caches it """
+        file = self.cache_file(**kwargs)
+        checked = False
+        with Instrumentation.operation(self, 'load_canonical', handler_class=type(self._handler).__name__) as op:
+            with op.phase('read'):
+                table = self._read(file)
+            if table is not None and self._revalidate:
+                with op.phase('revalidate'):
+                    checked = True
+                    if self._changed():
+                        table = None
+            if table is not None:
+                op.tag(cache='hit')
+                op.add(rows=table.num_rows, bytes=table.nbytes)
+                with op.phase('build'):
+                    return self._to_canonical(table)
+            op.tag(cache='miss')
+            if self._revalidate and not checked:
+                # sets the handler's baseline so the next revalidation compares against this load
+                self._changed()
+            rtn_data = self._handler.load_canonical(**kwargs)
+            if self._revalidate:
+                self._handler.reset_changed()
+            with op.phase('write'):
+                self._write(file, rtn_data)
+        return rtn_data
+
+    def cache_file(self, **kwargs) -> str:
+        """ the cache file for the load kwargs """
+        identity = [type(self._handler).__module__, type(self._handler).__name__, self.connector_contract.uri,
+                    self._contract_kwargs, kwargs]
+        digest = hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode()).hexdigest()
+        return os.path.join(self._cache_path, f"{digest}{self._SUFFIX}")
+
+    def invalidate(self, **kwargs) -> bool:
+        """ removes the cached result for the load kwargs, returning True if there was one """
+        try:
+            os.remove(self.cache_file(**kwargs))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clear(self):
+        """ removes every cached result in the cache directory """
+        for file in self._entries():
+            self._remove(file.path)
+
+    def _changed(self) -> bool:
+        """ the wrapped handler's has_changed. A failing check is taken as a change """
+        try:
+            return bool(self._handler.has_changed())
+        except Exception:
+            return True
+
+    def _read(self, file: str):
+        """ returns the cached table, or None if there is none or it has expired """
+        if not self._secure_dir():
+            return None
+        try:
+            with self.pa.memory_map(file, 'r') as source:
+                table = self.pa.ipc.open_file(source).read_all()
+        except (FileNotFoundError, OSError, self.pa.ArrowInvalid):
+            return None
+        metadata = table.schema.metadata or {}
+        created = float(metadata.get(b'hadron_cache_created', 0))
+        if self._ttl > 0 and time.time() - created > self._ttl:
+            self._remove(file)
+            return None
+        try:
+            # the modified time orders the least recently used
+            os.utime(file)
+        except OSError:
+            pass
+        return table
+
+    def _write(self, file: str, canonical: [dict, pd.DataFrame]):
+        """ writes the canonical to a temporary file that replaces the cache file, then evicts down to max bytes """
+        try:
+            if isinstance(canonical, pd.DataFrame):
+                table = self.pa.Table.from_pandas(canonical)
+                kind = 'frame'
+            elif isinstance(canonical, dict):
+                table = self.pa.Table.from_pydict(canonical)
+                kind = 'dict'
+            else:
+                return
+        except (self.pa.ArrowInvalid, self.pa.ArrowTypeError, ValueError, TypeError):
+            return
+        metadata = {**(table.schema.metadata or {}), b'hadron_cache_kind': kind.encode(),
+                    b'hadron_cache_created': str(time.time()).encode()}
+        table = table.replace_schema_metadata(metadata)
+        if not self._secure_dir():
+            return
+        fd, tmp_file = tempfile.mkstemp(dir=self._cache_path, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as sink, self.pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp_file, file)
+        except OSError:
+            self._remove(tmp_file)
+            return
+        self._evict()
+
+    def _to_canonical(self, table) -> [dict, pd.DataFrame]:
+        metadata = table.schema.metadata or {}
+        if metadata.get(b'hadron_cache_kind') == b'dict':
+            return table.to_pydict()
+        return table.to_pandas()
+
+    def _evict(self):
+        """ removes the least recently used results until the cache is within max bytes """
+        entries = []
+        for file in self._entries():
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _secure_dir(self) -> bool:
+        """ creates the cache directory, readable only by this user, if it does not exist and returns if it is safe
+        to use. A directory owned by another user, or writable by others, could hold planted results """
+        try:
+            os.makedirs(self._cache_path, mode=0o700, exist_ok=True)
+            stat = os.stat(self._cache_path)
+        except OSError:
+            return False
+        if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+            return False
+        return os.name == 'nt' or stat.st_mode & 0o022 == 0
+
+    def _entries(self) -> list:
+        try:
+            with os.scandir(self._cache_path) as it:
+                return [entry for entry in it if entry.name.endswith(self._SUFFIX) and entry.is_file()]
+        except FileNotFoundError:
+            return []
+
+    def _number(self, key: str, env: str, default: int) -> float:
+        value = self._cache_params.get(key, os.environ.get(env))
+        try:
+            return float(value) if value is not None else default
+        except ValueError:
+            raise ValueError(f"The {key} '{value}' must be a number")
+
+    @staticmethod
+    def _remove(file: str):
+        try:
+            os.remove(file)
+        except OSError:
+            pass
@@ -1,18 +1,350 @@
+import asyncio
+import math
+import operator
+import threading
+import time
+from collections import deque
+from itertools import chain
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import unquote
+
 import pandas as pd
 from aistac.handlers.abstract_handlers import AbstractSourceHandler, ConnectorContract, HandlerFactory
+from ds_connectors.handlers.registry_helpers import ConnectionRegistry
+from ds_connectors.handlers.instrument_helpers import Instrumentation
+from ds_connectors.handlers.async_helpers import AsyncHandlerMixin
 
 __author__ = 'Darryl Oatridge, Neil Pasricha'
 
 
-class HiveSourceHandler(AbstractSourceHandler):
-    """ A Hive source handler"""
+class HiveSessionPool(object):
+    """ A small pool of HiveServer2 Thrift sessions keyed by host, port, user, database and auth. Sessions
+    are reused across load calls, checked for liveness before reuse and, as the pools are held in the
+    ConnectionRegistry, closed on interpreter shutdown.
+    """
+
+    def __init__(self, connect, max_size: int=None, liveness_query: str=None, key: tuple=None):
+        """ initialise the pool
+
+        :param connect: a zero argument callable that returns a new pyhive Connection
+        :param max_size: the maximum number of idle sessions kept for reuse. Default 4
+        :param liveness_query: a lightweight query run before a session is reused. Default 'SELECT 1'
+        :param key: (optional) the ConnectionRegistry key of the pool, which is checked out while a session is
+                    acquired so idle eviction leaves the pool alone
+        """
+        self._connect = connect
+        self._key = key
+        self._max_size = max_size if isinstance(max_size, int) and max_size > 0 else 4
+        self._liveness_query = liveness_query if isinstance(liveness_query, str) else 'SELECT 1'
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls, key: tuple, connect, max_size: int=None, liveness_query: str=None):
+        """ returns the shared pool for the session key, creating it if it does not exist """
+        return ConnectionRegistry.get(key, lambda: cls(connect=connect, max_size=max_size,
+                                                       liveness_query=liveness_query, key=key),
+                                      close=lambda pool: pool.close())
+
+    @contextmanager
+    def session(self):
+        """ a context manager that acquires a session and returns it to the pool on exit. If the block raises
+        the session is discarded rather than returned, as its state is unknown"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.discard(conn)
+            raise
+        self.release(conn)
+
+    def acquire(self):
+        """ returns a live session, reusing an idle one if possible. The time taken is recorded as the connect
+        phase of the current instrumented operation, and each dead session discarded as a retry """
+        op = Instrumentation.current()
+        if self._key is not None:
+            ConnectionRegistry.checkout(self._key)
+        try:
+            with op.phase('connect', counter='pool_wait'):
+                while True:
+                    with self._lock:
+                        conn = self._idle.pop() if self._idle else None
+                    if conn is None:
+                        return self._connect()
+                    if self._is_alive(conn):
+                        return conn
+                    self._close_conn(conn)
+                    op.add(retries=1)
+        except BaseException:
+            self._checkin()
+            raise
+
+    def release(self, conn):
+        """ returns an acquired session to the pool, closing it if the pool is full """
+        try:
+            with self._lock:
+                if len(self._idle) < self._max_size:
+                    self._idle.append(conn)
+                    return
+            self._close_conn(conn)
+        finally:
+            self._checkin()
+
+    def discard(self, conn):
+        """ closes an acquired session whose state is unknown rather than returning it to the pool """
+        try:
+            self._close_conn(conn)
+        finally:
+            self._checkin()
+
+    def _checkin(self):
+        if self._key is not None:
+            ConnectionRegistry.checkin(self._key)
+
+    def close(self):
+        """ closes all the idle sessions in this pool """
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn in idle:
+            self._close_conn(conn)
+
+    def _is_alive(self, conn) -> bool:
+        """ checks the transport is open and the session still answers a trivial query """
+        transport = getattr(conn, '_transport', None)
+        if transport is not None and hasattr(transport, 'isOpen') and not transport.isOpen():
+            return False
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(self._liveness_query)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def _close_conn(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class HiveQueryHandle(Future):
+    """ A handle on a Hive query submitted with PyHive's ``async_=True``. The handle is a
+    ``concurrent.futures.Future`` so it can be used with ``wait`` and ``as_completed``, and adds progress,
+    log retrieval, a timeout and a server side ``cancel()``. The handle is polled by the shared
+    ``HiveQueryPoller`` thread and its result is the canonical the synchronous load would have returned.
+    """
+
+    def __init__(self, pool: HiveSessionPool, conn, cursor, canonical: str, timeout: float=None,
+                 poll_interval: float=None):
+        super().__init__()
+        self._pool = pool
+        self._conn = conn
+        self._cursor = cursor
+        self._canonical = canonical
+        self._timeout = timeout if isinstance(timeout, (int, float)) and timeout > 0 else None
+        self.poll_interval = poll_interval if isinstance(poll_interval, (int, float)) and poll_interval > 0 else 1.0
+        self._cursor_lock = threading.Lock()
+        self._started = time.monotonic()
+        self._next_poll = self._started
+        self._progress = None
+        self._status = 'RUNNING'
+        self._completing = False
+
+    @property
+    def status(self) -> str:
+        """ the last polled operation state, for example RUNNING, FINISHED, ERROR or CANCELED """
+        return self._status
+
+    def progress(self) -> [float, None]:
+        """ the last polled progress as a percentage between 0 and 100, or None if Hive did not report it """
+        return self._progress
+
+    def elapsed(self) -> float:
+        """ the seconds since the query was submitted """
+        return time.monotonic() - self._started
+
+    def fetch_logs(self) -> list:
+        """ returns the query log lines reported by HiveServer2 so far """
+        with self._cursor_lock:
+            if self._cursor is None:
+                return []
+            return self._cursor.fetch_logs()
+
+    def running(self) -> bool:
+        """ returns True while the query is still in flight """
+        return not self.done()
+
+    def cancel(self) -> bool:
+        """ cancels the query on HiveServer2 and the handle """
+        if not super().cancel():
+            return False
+        self._cancel_operation()
+        self._discard()
+        self._status = 'CANCELED'
+        return True
+
+    def poll(self) -> str:
+        """ polls HiveServer2 once for the operation status, updating progress, and completes the handle if the
+        operation has ended. This is called by the poller thread but can be called directly. """
+        if self.done() or self._completing:
+            return self._status
+        state_type = HandlerFactory.get_module('TCLIService.ttypes').TOperationState
+        with self._cursor_lock:
+            if self._cursor is None:
+                return self._status
+            response = self._cursor.poll(get_progress_update=True)
+        state = response.operationState
+        self._status = state_type._VALUES_TO_NAMES.get(state, str(state)).replace('_STATE', '')
+        progress = getattr(response, 'progressUpdateResponse', None)
+        if progress is not None and progress.progressedPercentage is not None:
+            self._progress = round(progress.progressedPercentage * 100, 2)
+        if state == state_type.FINISHED_STATE:
+            self._completing = True
+            HiveQueryPoller.executor().submit(self._complete)
+        elif state in (state_type.ERROR_STATE, state_type.CANCELED_STATE, state_type.CLOSED_STATE,
+                       state_type.TIMEDOUT_STATE, state_type.UKNOWN_STATE):
+            message = getattr(response, 'errorMessage', None) or self._status
+            self._fail(ConnectionError(f"The Hive query ended with state {self._status}: {message}"))
+        elif self._timeout is not None and self.elapsed() > self._timeout:
+            self._cancel_operation()
+            self._status = 'TIMEDOUT'
+            self._fail(TimeoutError(f"The Hive query was cancelled after exceeding the {self._timeout}s timeout"))
+        return self._status
+
+    def _complete(self):
+        """ fetches the result set and sets it as the result of the handle """
+        try:
+            with self._cursor_lock:
+                if self._cursor is None:
+                    return
+                columns = [i[0] for i in self._cursor.description]
+                rows = self._cursor.fetchall()
+                self._cursor.close()
+                # the session is taken under the lock so a concurrent cancel can not discard it as well
+                self._cursor = None
+                conn, self._conn = self._conn, None
+            if conn is not None:
+                self._pool.release(conn)
+            self._progress = 100.0
+            if not self.cancelled():
+                self.set_result(HiveSourceHandler.build_canonical(columns, rows, self._canonical))
+        except Exception as error:
+            self._fail(error)
+
+    def _cancel_operation(self):
+        """ asks HiveServer2 to cancel the running operation """
+        with self._cursor_lock:
+            if self._cursor is not None:
+                try:
+                    self._cursor.cancel()
+                except Exception:
+                    pass
+
+    def _fail(self, error: Exception):
+        self._discard()
+        if not self.done():
+            self.set_exception(error)
+
+    def _discard(self):
+        """ closes the session rather than returning it to the pool as its state is unknown """
+        with self._cursor_lock:
+            cursor, self._cursor = self._cursor, None
+            conn, self._conn = self._conn, None
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        if conn is not None:
+            self._pool.discard(conn)
+
+
+class HiveQueryPoller(object):
+    """ A single daemon thread per process that polls every in-flight ``HiveQueryHandle``, so one scheduler can
+    keep many Hive extracts in flight without a thread per query. Result sets are fetched on a small shared
+    executor so a large fetch does not delay the polling of the other handles. """
+
+    max_fetch_workers = 4
+
+    _handles = []
+    _lock = threading.Condition()
+    _thread = None
+    _executor = None
+
+    @classmethod
+    def register(cls, handle: HiveQueryHandle):
+        """ adds a handle to be polled, starting the poller thread if it is not running """
+        with cls._lock:
+            cls._handles.append(handle)
+            if cls._thread is None or not cls._thread.is_alive():
+                cls._thread = threading.Thread(target=cls._run, name='hive-query-poller', daemon=True)
+                cls._thread.start()
+            cls._lock.notify()
+
+    @classmethod
+    def executor(cls) -> ThreadPoolExecutor:
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=cls.max_fetch_workers,
+                                                   thread_name_prefix='hive-query-fetch')
+            return cls._executor
+
+    @classmethod
+    def _run(cls):
+        while True:
+            with cls._lock:
+                cls._handles = [h for h in cls._handles if not h.done()]
+                if not cls._handles:
+                    cls._thread = None
+                    return
+                now = time.monotonic()
+                due = [h for h in cls._handles if h._next_poll <= now]
+                wait = min(h._next_poll for h in cls._handles) - now
+            for handle in due:
+                try:
+                    handle.poll()
+                except Exception as error:
+                    handle._fail(error)
+                handle._next_poll = time.monotonic() + handle.poll_interval
+            if not due:
+                with cls._lock:
+                    cls._lock.wait(timeout=max(wait, 0.01))
+
+
+class HiveSourceHandler(AsyncHandlerMixin, AbstractSourceHandler):
+    """ A Hive source handler
+
+        params:
+            auth, configuration, kerberos_service_name, thrift_transport: (optional) passed to the pyhive Connection
+            canonical: (optional) 'dict' or 'pandas'. Default dict
+            pool_size: (optional) the number of idle sessions kept for reuse per connection identity. Default 4
+            table: (optional) the table used for partitioned extraction and change detection
+            partitioned: (optional) if true the table is extracted partition by partition. Default False
+            partition_filter: (optional) comma separated partition conditions, for example 'dt>=2024-01-01,region=eu'
+            describe_recent: (optional) the number of the latest selected partitions described again on each change
+                    check, besides any new partitions. Default 3
+            columns: (optional) the select list for partitioned extraction. Default '*'
+            max_sessions: (optional) the number of partitions extracted concurrently. Default pool_size
+    """
+
+    _FILTER_OPS = [('>=', operator.ge), ('<=', operator.le), ('!=', operator.ne), ('>', operator.gt),
+                   ('<', operator.lt), ('=', operator.eq)]
 
     def __init__(self, connector_contract: ConnectorContract):
         """ initialise the Handler passing the source_contract dictionary """
         self.pyhive = HandlerFactory.get_module('pyhive.hive')
         super().__init__(connector_contract)
+        self._sql_query = {**self.connector_contract.kwargs, **self.connector_contract.query}.get('query', '')
         self._file_state = 0
         self._changed_flag = True
+        self._partition_times = {}
 
     def supported_types(self) -> list:
         """ The source types supported with this module"""
@@ -25,46 +357,112 @@ class HiveSourceHandler(AbstractSourceHandler):
         """
         if not isinstance(self.connector_contract, ConnectorContract):
             raise ValueError("The Connector Contract is not valid")
-        database = self.connector_contract.path
-        host = self.connector_contract.hostname
-        user = self.connector_contract.username
-        password = self.connector_contract.password
-        auth = self.connector_contract.get_key_value('auth', '')
-        configuration = self.connector_contract.get_key_value('configuration', '')
-        kerberos_service_name = self.connector_contract.get_key_value('kerberos_service_name', '')
-        thrift_transport = self.connector_contract.get_key_value('thrift_transport', '')
         canonical = self.connector_contract.get_key_value('canonical', 'dict')
-        query = self.connector_contract.query
-        host_name, port = host.rsplit(sep=':')
-        conn = self.pyhive.hive.Connection(host=host_name, port=port, username=user, password=password,
-                                           database=database, configuration=configuration, auth=auth,
-                                           kerberos_service_name=kerberos_service_name,
-                                           thrift_transport=thrift_transport, **kwargs)
-        # return a pandas DataFrame
-        if canonical.lower().endswith('pandas'):
-            return pd.read_sql(query, conn)
-        # default return a dictionary
-        cursor = conn.cursor()
-        cursor.execute(query)
+        partitioned = str(self.connector_contract.get_key_value('partitioned', False)).lower() == 'true'
+        with Instrumentation.operation(self, 'load_canonical', canonical=canonical, partitioned=partitioned) as op:
+            if partitioned:
+                rtn_data = self._load_partitioned(canonical=canonical, **kwargs)
+            else:
+                rtn_data = self._load_query(canonical=canonical, **kwargs)
+            if isinstance(rtn_data, pd.DataFrame):
+                op.add(rows=rtn_data.shape[0])
+            else:
+                op.add(rows=len(next(iter(rtn_data.values()), [])))
+        return rtn_data
+
+    def _load_query(self, canonical: str, **kwargs) -> [dict, pd.DataFrame]:
+        """ runs the connector contract query on a pooled session """
+        op = Instrumentation.current()
+        query = self._sql_query
+        with self._session_pool(**kwargs).session() as conn:
+            # return a pandas DataFrame
+            if canonical.lower().endswith('pandas'):
+                with op.phase('query'):
+                    return pd.read_sql(query, conn)
+            # default return a dictionary
+            cursor = conn.cursor()
+            try:
+                with op.phase('query'):
+                    cursor.execute(query)
+                columns = [i[0] for i in cursor.description]
+                with op.phase('fetch'):
+                    rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        with op.phase('build'):
+            return self.build_canonical(columns, rows, canonical)
+
+    async def _load_canonical_native(self, **kwargs):
+        """ submits the query with execute_async on the thread pool and awaits its HiveQueryHandle, so the query
+        is polled by the shared HiveQueryPoller rather than holding a thread. Partitioned loads fall back to the
+        thread pool """
+        if not isinstance(self.connector_contract, ConnectorContract) or \
+                str(self.connector_contract.get_key_value('partitioned', False)).lower() == 'true':
+            return NotImplemented
+        with Instrumentation.operation(self, 'load_canonical', mode='async') as op:
+            with op.phase('connect', counter='pool_wait'):
+                handle = await self.run_blocking(self.execute_async, **kwargs)
+            with op.phase('query'):
+                rtn_data = await asyncio.wrap_future(handle)
+            if isinstance(rtn_data, pd.DataFrame):
+                op.add(rows=rtn_data.shape[0])
+            else:
+                op.add(rows=len(next(iter(rtn_data.values()), [])))
+        return rtn_data
 
-        columns = [i[0] for i in cursor.description]
-        rows = cursor.fetchall()
+    def execute_async(self, query: str=None, timeout: float=None, poll_interval: float=None,
+                      **kwargs) -> HiveQueryHandle:
+        """ submits the query with PyHive's async execution and returns immediately with a HiveQueryHandle. The
+        handle is a concurrent.futures Future whose result is the canonical, with progress(), fetch_logs(),
+        cancel() and an optional timeout.
+
+        :param query: (optional) the query to run. Default the connector contract query
+        :param timeout: (optional) seconds after which the query is cancelled and the handle fails
+        :param poll_interval: (optional) seconds between status polls. Default 1.0
+        :param kwargs: extra parameters passed to the pyhive Connection
+        :return: a HiveQueryHandle
+        """
+        if not isinstance(self.connector_contract, ConnectorContract):
+            raise ValueError("The Connector Contract is not valid")
+        canonical = self.connector_contract.get_key_value('canonical', 'dict')
+        query = query if isinstance(query, str) else self._sql_query
+        pool = self._session_pool(**kwargs)
+        conn = pool.acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, async_=True)
+        except Exception:
+            pool.discard(conn)
+            raise
+        handle = HiveQueryHandle(pool=pool, conn=conn, cursor=cursor, canonical=canonical, timeout=timeout,
+                                 poll_interval=poll_interval)
+        HiveQueryPoller.register(handle)
+        return handle
+
+    @staticmethod
+    def build_canonical(columns: list, rows: list, canonical: str) -> [dict, pd.DataFrame]:
+        """ builds the canonical from a fetched result set, either a pandas DataFrame or a dictionary with the
+        headers as the key and the ordered list of values for that header """
+        if canonical.lower().endswith('pandas'):
+            return pd.DataFrame.from_records(rows, columns=columns)
         rtn_dict = {}
         for row in rows:
             for index in range(len(row)):
                 if columns[index] not in rtn_dict:
                     rtn_dict[columns[index]] = []
                 rtn_dict.get(columns[index]).append(row[index])
-        cursor.close()
         return rtn_dict
 
     def exists(self) -> bool:
         return True
 
     def has_changed(self) -> bool:
-        """ returns if the file has been modified"""
-        # TODO: Add in change logic here
-        state = None
+        """ returns if the table has been modified. If a 'table' is given the state is taken from the table
+        partitions and the transient_lastDdlTime of the table and the latest of its selected partitions. New
+        partitions and the describe_recent latest are described on each check, and the times of the others kept
+        from when they were last described, so a rewrite of an older partition is not seen"""
+        table = self.connector_contract.get_key_value('table', None)
+        state = self._table_state(table) if isinstance(table, str) and len(table) > 0 else None
         if state != self._file_state:
             self._changed_flag = True
             self._file_state = state
@@ -74,3 +472,179 @@ class HiveSourceHandler(AbstractSourceHandler):
         """ manual reset to say the file has been seen. This is automatically called if the file is loaded"""
         changed = changed if isinstance(changed, bool) else False
         self._changed_flag = changed
+
+    def _load_partitioned(self, canonical: str, **kwargs) -> [dict, pd.DataFrame]:
+        """ enumerates the table partitions, applies the partition filter and extracts each partition on its own
+        session, a bounded number at a time. The results are merged in partition order """
+        _cc = self.connector_contract
+        table = _cc.get_key_value('table', None)
+        if not isinstance(table, str) or len(table) == 0:
+            raise ValueError("Partitioned extraction requires the 'table' to be set in the Connector Contract")
+        columns = _cc.get_key_value('columns', '*')
+        pool = self._session_pool(**kwargs)
+        max_sessions = int(_cc.get_key_value('max_sessions', _cc.get_key_value('pool_size', 4)))
+        with pool.session() as conn:
+            partitions = self._show_partitions(conn, table)
+        partitions = self._filter_partitions(partitions, _cc.get_key_value('partition_filter', None))
+
+        def extract(spec: list):
+            where = ' AND '.join(f"{self._identifier(key)}={self._literal(value)}" for key, value in spec)
+            with pool.session() as session:
+                cursor = session.cursor()
+                try:
+                    cursor.execute(f"SELECT {columns} FROM {table} WHERE {where}")
+                    return [i[0] for i in cursor.description], cursor.fetchall()
+                finally:
+                    cursor.close()
+
+        if len(partitions) == 0:
+            return self.build_canonical([], [], canonical)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_sessions, len(partitions)))) as executor:
+            results = list(executor.map(extract, partitions))
+        headers = results[0][0]
+        return self.build_canonical(headers, list(chain.from_iterable(rows for _, rows in results)), canonical)
+
+    def _table_state(self, table: str) -> tuple:
+        """ returns the partitions, the transient_lastDdlTime of the table and the latest transient_lastDdlTime of
+        the partitions selected by the partition filter, as far as the describe_recent checks see it """
+        with self._session_pool().session() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"SHOW TBLPROPERTIES {table}('transient_lastDdlTime')")
+                rows = cursor.fetchall()
+                table_time = rows[0][-1] if rows else None
+            finally:
+                cursor.close()
+            try:
+                partitions = self._show_partitions(conn, table)
+            except Exception:
+                # not a partitioned table
+                return table_time,
+            _cc = self.connector_contract
+            partitions = self._filter_partitions(partitions, _cc.get_key_value('partition_filter'))
+            specs = [tuple(spec) for spec in partitions]
+            recent = max(0, int(_cc.get_key_value('describe_recent', 3)))
+            latest = sorted(specs, key=lambda spec: [self._sort_key(value) for _, value in spec])
+            describe = set(latest[-recent:] if recent > 0 else [])
+            # only the new and latest partitions are described, the others keep the time they were last described at
+            self._partition_times = {spec: self._partition_times[spec] for spec in specs
+                                     if spec in self._partition_times and spec not in describe}
+            for spec in specs:
+                if spec not in self._partition_times:
+                    self._partition_times[spec] = self._partition_ddl_time(conn, table, list(spec))
+            times = [value for value in self._partition_times.values() if value is not None]
+            partition_time = max(times, key=self._sort_key) if times else None
+        return table_time, tuple(specs), partition_time
+
+    @staticmethod
+    def _show_partitions(conn, table: str) -> list:
+        """ returns the table partitions, in the order Hive lists them, as lists of (key, value) pairs """
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SHOW PARTITIONS {table}")
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        partitions = []
+        for row in rows:
+            spec = []
+            for element in row[0].split('/'):
+                key, _, value = element.partition('=')
+                spec.append((unquote(key), unquote(value)))
+            partitions.append(spec)
+        return partitions
+
+    @classmethod
+    def _partition_ddl_time(cls, conn, table: str, spec: list):
+        """ returns the transient_lastDdlTime parameter of a partition from DESCRIBE FORMATTED """
+        partition = ', '.join(f"{cls._identifier(key)}={cls._literal(value)}" for key, value in spec)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"DESCRIBE FORMATTED {table} PARTITION ({partition})")
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        for row in rows:
+            fields = [str(field).strip() if field is not None else '' for field in row]
+            if 'transient_lastDdlTime' in fields:
+                return fields[fields.index('transient_lastDdlTime') + 1]
+        return None
+
+    @classmethod
+    def _filter_partitions(cls, partitions: list, partition_filter: str) -> list:
+        """ applies comma separated partition conditions such as 'dt>=2024-01-01,region=eu'. Values that both parse
+        as numbers are compared as numbers, so hour=9 is before hour=10, and otherwise as strings, which orders ISO
+        dates correctly """
+        if not isinstance(partition_filter, str) or len(partition_filter.strip()) == 0:
+            return partitions
+        conditions = []
+        for condition in partition_filter.split(','):
+            for symbol, func in cls._FILTER_OPS:
+                if symbol in condition:
+                    key, _, value = condition.partition(symbol)
+                    conditions.append((key.strip(), func, value.strip().strip("'\"")))
+                    break
+            else:
+                raise ValueError(f"The partition filter condition '{condition}' is not recognised")
+        rtn_list = []
+        for spec in partitions:
+            values = dict(spec)
+            if all(key in values and func(*cls._comparable(values[key], value)) for key, func, value in conditions):
+                rtn_list.append(spec)
+        return rtn_list
+
+    @staticmethod
+    def _number(value: str):
+        """ returns the value as a float if it parses as a finite number, else None """
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return None
+        return number if math.isfinite(number) else None
+
+    @classmethod
+    def _comparable(cls, left: str, right: str) -> tuple:
+        """ returns the pair as numbers if both parse as numbers, else as they are """
+        numbers = cls._number(left), cls._number(right)
+        return numbers if None not in numbers else (left, right)
+
+    @classmethod
+    def _sort_key(cls, value: str) -> tuple:
+        """ orders numbers numerically and before other values """
+        number = cls._number(value)
+        return (0, number, '') if number is not None else (1, 0, str(value))
+
+    @staticmethod
+    def _literal(value: str) -> str:
+        """ returns the value as a quoted HiveQL string literal """
+        return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+    @staticmethod
+    def _identifier(name: str) -> str:
+        """ returns the name as a backquoted HiveQL identifier """
+        return '`' + str(name).replace('`', '``') + '`'
+
+    def _session_pool(self, **kwargs) -> HiveSessionPool:
+        """ returns the shared session pool for this connector contract and any extra connection kwargs """
+        _cc = self.connector_contract
+        database = _cc.path
+        host = _cc.hostname
+        user = _cc.username
+        password = _cc.password
+        auth = _cc.get_key_value('auth', '')
+        configuration = _cc.get_key_value('configuration', '')
+        kerberos_service_name = _cc.get_key_value('kerberos_service_name', '')
+        thrift_transport = _cc.get_key_value('thrift_transport', '')
+        pool_size = ConnectionRegistry.pool_size(_cc.get_key_value('pool_size'), default=4)
+        host_name, port = host.rsplit(sep=':')
+
+        def connect():
+            return self.pyhive.hive.Connection(host=host_name, port=port, username=user, password=password,
+                                               database=database, configuration=configuration, auth=auth,
+                                               kerberos_service_name=kerberos_service_name,
+                                               thrift_transport=thrift_transport, **kwargs)
+
+        key = ConnectionRegistry.key('hive', host=host_name, port=port, user=user, password=password,
+                                     database=database, auth=auth, kerberos_service_name=kerberos_service_name,
+                                     configuration=configuration, thrift_transport=thrift_transport, **kwargs)
+        return HiveSessionPool.get_pool(key, connect=connect, max_size=pool_size)
@@ -0,0 +1,235 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+__author__ = 'Darryl Oatridge'
+
+
+class _NullOperation(object):
+    """ the operation returned when instrumentation is disabled. Every method is a no-op, so an instrumented
+    handler costs a few attribute lookups and nothing is timed, counted or emitted """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def phase(self, name: str, counter: str=None):
+        return self
+
+    def add(self, **counters):
+        pass
+
+    def tag(self, **tags):
+        pass
+
+
+_NULL_OPERATION = _NullOperation()
+
+
+class _Operation(object):
+    """ records one handler operation. Phases are timed with phase() and counters, such as rows or bytes, are
+    accumulated with add(). The event is emitted to the sinks when the operation exits """
+
+    __slots__ = ('event', '_start', '_token')
+
+    def __init__(self, handler, name: str, **tags):
+        _cc = getattr(handler, 'connector_contract', None)
+        self.event = {'handler': type(handler).__name__, 'operation': name,
+                      'schema': getattr(_cc, 'schema', None), 'host': getattr(_cc, 'hostname', None),
+                      'started': time.time(), 'duration': 0.0, 'phases': {},
+                      'rows': 0, 'bytes': 0, 'retries': 0, 'pool_wait': 0.0, 'error': None, **tags}
+        self._start = None
+        self._token = None
+
+    def __enter__(self):
+        self._token = Instrumentation._current.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.event['duration'] = time.perf_counter() - self._start
+        if exc_type is not None:
+            self.event['error'] = f"{exc_type.__name__}: {exc_val}"
+        Instrumentation._current.reset(self._token)
+        Instrumentation.emit(self.event)
+        return False
+
+    @contextmanager
+    def phase(self, name: str, counter: str=None):
+        """ times the enclosed block as the named phase, adding to any time already recorded for it
+
+        :param name: the phase name, typically 'connect', 'query', 'download', 'decode', 'build' or 'write'
+        :param counter: (optional) a counter, such as 'pool_wait', the elapsed seconds are also added to
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            phases = self.event['phases']
+            phases[name] = phases.get(name, 0.0) + elapsed
+            if counter is not None:
+                self.event[counter] = self.event.get(counter, 0) + elapsed
+
+    def add(self, **counters):
+        """ adds to the named counters, for example add(rows=1_000, bytes=65_536) """
+        for name, value in counters.items():
+            if value is not None:
+                self.event[name] = self.event.get(name, 0) + value
+
+    def tag(self, **tags):
+        """ sets descriptive values on the event, for example the canonical format """
+        self.event.update(tags)
+
+
+class Instrumentation(object):
+    """ Per-operation performance events for the handlers. Each instrumented load or persist emits one event, a
+    dictionary with the handler, operation, schema and host, the total duration, the duration of each phase
+    (connect, query or download, decode, build, write), the rows and bytes moved, retries and the pool wait.
+
+    Events are passed to the registered sinks, any callable taking the event dictionary, such as a
+    MemoryCollector or LoggingSink. With no sinks registered instrumentation is disabled and operation() returns a
+    shared no-op, so the overhead on the handlers is negligible.
+
+        Example
+            collector = MemoryCollector()
+            Instrumentation.add_sink(collector)
+            handler.load_canonical()
+            collector.summary()
+    """
+
+    _sinks = ()
+    _lock = threading.Lock()
+    # a context variable rather than a thread local, so concurrent asyncio tasks each see their own operation
+    _current = contextvars.ContextVar('hadron_instrumentation_operation', default=None)
+
+    @classmethod
+    def add_sink(cls, sink):
+        """ registers a callable that is passed each event """
+        if not callable(sink):
+            raise ValueError("An instrumentation sink must be callable with the event dictionary")
+        with cls._lock:
+            if sink not in cls._sinks:
+                cls._sinks = cls._sinks + (sink,)
+
+    @classmethod
+    def remove_sink(cls, sink) -> bool:
+        """ removes a registered sink, returning True if it was registered """
+        with cls._lock:
+            if sink not in cls._sinks:
+                return False
+            cls._sinks = tuple(s for s in cls._sinks if s is not sink)
+            return True
+
+    @classmethod
+    def clear_sinks(cls):
+        """ removes every sink, disabling instrumentation """
+        with cls._lock:
+            cls._sinks = ()
+
+    @classmethod
+    def enabled(cls) -> bool:
+        """ returns True if there are sinks to emit events to """
+        return len(cls._sinks) > 0
+
+    @classmethod
+    def operation(cls, handler, name: str, **tags):
+        """ returns a context manager that records the named operation of the handler, or a no-op if disabled
+
+        :param handler: the handler instance, its class name and connector contract identify the event
+        :param name: the operation name, such as 'load_canonical'
+        :param tags: (optional) additional values set on the event
+        """
+        if not cls._sinks:
+            return _NULL_OPERATION
+        return _Operation(handler, name, **tags)
+
+    @classmethod
+    def current(cls):
+        """ returns the operation being recorded in this thread or asyncio task, or a no-op, so helpers called by a
+        handler such as a session pool can add retries or waits to it """
+        if not cls._sinks:
+            return _NULL_OPERATION
+        return cls._current.get() or _NULL_OPERATION
+
+    @classmethod
+    def emit(cls, event: dict):
+        """ passes the event to each sink. A failing sink never fails the handler operation """
+        for sink in cls._sinks:
+            try:
+                sink(event)
+            except Exception:
+                pass
+
+
+class MemoryCollector(object):
+    """ An instrumentation sink that keeps the most recent events in memory """
+
+    def __init__(self, max_events: int=None):
+        """ initialise the collector
+
+        :param max_events: (optional) the number of most recent events kept. Default 10,000
+        """
+        max_events = max_events if isinstance(max_events, int) and max_events > 0 else 10_000
+        self._events = deque(maxlen=max_events)
+
+    def __call__(self, event: dict):
+        self._events.append(event)
+
+    @property
+    def events(self) -> list:
+        """ the collected events, oldest first """
+        return list(self._events)
+
+    def clear(self):
+        self._events.clear()
+
+    def to_frame(self) -> pd.DataFrame:
+        """ returns the events as a DataFrame with a 'phase.<name>' column per phase """
+        if len(self._events) == 0:
+            return pd.DataFrame()
+        return pd.json_normalize(self.events, sep='.').rename(columns=lambda c: c.replace('phases.', 'phase.'))
+
+    def summary(self) -> pd.DataFrame:
+        """ returns the count, total rows and bytes, and the mean and percentile durations of each handler
+        operation, with the mean duration of each phase """
+        df = self.to_frame()
+        if df.shape[0] == 0:
+            return df
+        grouped = df.groupby(['handler', 'operation'])
+        rtn_df = grouped.agg(count=('duration', 'size'), errors=('error', 'count'), rows=('rows', 'sum'),
+                             bytes=('bytes', 'sum'), retries=('retries', 'sum'), pool_wait=('pool_wait', 'sum'),
+                             mean=('duration', 'mean'), p50=('duration', 'median'),
+                             p95=('duration', lambda d: d.quantile(0.95)), max=('duration', 'max'))
+        phases = [c for c in df.columns if c.startswith('phase.')]
+        if phases:
+            rtn_df = rtn_df.join(grouped[phases].mean())
+        return rtn_df
+
+
+class LoggingSink(object):
+    """ An instrumentation sink that logs each event as a JSON line """
+
+    def __init__(self, logger: logging.Logger=None, level: int=None):
+        """ initialise the sink
+
+        :param logger: (optional) the logger to use. Default the 'ds_connectors.instrumentation' logger
+        :param level: (optional) the log level. Default logging.INFO
+        """
+        self._logger = logger if isinstance(logger, logging.Logger) else logging.getLogger(
+            'ds_connectors.instrumentation')
+        self._level = level if isinstance(level, int) else logging.INFO
+
+    def __call__(self, event: dict):
+        if self._logger.isEnabledFor(self._level):
+            self._logger.log(self._level, json.dumps(event, default=str))
@@ -1,6 +1,8 @@
 from gzip import GzipFile
+import csv
 import io
 import os
+import tempfile
 import yaml
 import threading
 from contextlib import closing
@@ -8,6 +10,10 @@ import json
 from typing import Optional, List, Union
 import pandas as pd
 from .cortex_helpers import load_token, load_api_endpoint
+from ds_connectors.handlers.registry_helpers import ConnectionRegistry
+from ds_connectors.handlers.instrument_helpers import Instrumentation
+from ds_connectors.handlers.async_helpers import AsyncHandlerMixin
+from ds_connectors.parsers.dsv import DelimitedParser
 from aistac.handlers.abstract_handlers import AbstractSourceHandler, ConnectorContract, AbstractPersistHandler, HandlerFactory
 
 try:
@@ -19,7 +25,7 @@ except ImportError:
 __author__ = 'Bikash Pandey'
 
 
-class McSourceHandler(AbstractSourceHandler):
+class McSourceHandler(AsyncHandlerMixin, AbstractSourceHandler):
     """ A Managed Content Source handler"""
 
     def __init__(self, connector_contract: ConnectorContract):
@@ -29,7 +35,10 @@ class McSourceHandler(AbstractSourceHandler):
         self.token = self._load_token()
         self.api_endpoint = self._load_api_endpoint()
         self.project = self._load_project_name()
-        self.cortex_mc_client = self.cortex_content.ManagedContentClient(url=self.api_endpoint, token=self.token)
+        # one client per endpoint and token, shared through the ConnectionRegistry
+        key = ConnectionRegistry.key('managed_content', self.api_endpoint, token=self.token)
+        self.cortex_mc_client = ConnectionRegistry.get(
+            key, lambda: self.cortex_content.ManagedContentClient(url=self.api_endpoint, token=self.token))
         self._etag = 0
         self._changed_flag = True
 
@@ -56,26 +65,37 @@ class McSourceHandler(AbstractSourceHandler):
     def _download_key_from_mc(self, key):
         return self.cortex_mc_client.download(key, retries=2, project=self.project)
 
+    def _download_bytes(self, key) -> bytes:
+        """ downloads and reads the content of the key, recorded as the download phase of the current operation """
+        op = Instrumentation.current()
+        with op.phase('download'):
+            content = self._download_key_from_mc(key).read()
+        op.add(bytes=len(content))
+        return content
+
     def _load_dict_from_json_in_mc(self, mc_key: str, load_as_df=None, **json_options) -> pd.DataFrame:
         if not self.exists():
             return pd.DataFrame()
-        content = self._download_key_from_mc(mc_key).read()
-        data = json.load(io.StringIO(content.decode('utf-8')), **json_options)
-        if load_as_df:
-            data = pd.DataFrame(data)
+        content = self._download_bytes(mc_key)
+        with Instrumentation.current().phase('decode'):
+            data = json.load(io.StringIO(content.decode('utf-8')), **json_options)
+            if load_as_df:
+                data = pd.DataFrame(data)
         return data
 
     def _load_dict_from_yaml_in_mc(self, mc_key: str) -> pd.DataFrame:
         if not self.exists():
             return pd.DataFrame()
-        content = self._download_key_from_mc(mc_key).read()
-        return yaml.safe_load(io.StringIO(content.decode('utf-8')))
+        content = self._download_bytes(mc_key)
+        with Instrumentation.current().phase('decode'):
+            return yaml.safe_load(io.StringIO(content.decode('utf-8')))
 
     def _load_df_from_csv_in_mc(self, mc_key: str, **pandas_options) -> pd.DataFrame:
         if not self.exists():
             return pd.DataFrame()
-        content = self._download_key_from_mc(mc_key).read()
-        return pd.read_csv(io.StringIO(content.decode('utf-8')), **pandas_options)
+        content = self._download_bytes(mc_key)
+        with Instrumentation.current().phase('decode'):
+            return pd.read_csv(io.StringIO(content.decode('utf-8')), **pandas_options)
 
     def _load_df_from_pickle_in_mc(self, mc_key: str, **kwargs) -> pd.DataFrame:
         """ loads a pickle file """
@@ -85,7 +105,7 @@ class McSourceHandler(AbstractSourceHandler):
         encoding = kwargs.pop('encoding', 'ASCII')
         errors = kwargs.pop('errors', 'strict')
         with threading.Lock():
-            with closing(io.BytesIO(self._download_key_from_mc(mc_key).read())) as f:
+            with closing(io.BytesIO(self._download_bytes(mc_key))) as f, Instrumentation.current().phase('decode'):
                 return pickle.load(f, fix_imports=fix_imports, encoding=encoding, errors=errors)
 
     def _load_gz_from_mc(self, mc_key: str) -> Union[GzipFile, None]:
@@ -96,8 +116,9 @@ class McSourceHandler(AbstractSourceHandler):
     def _load_df_from_parquet_in_mc(self, mc_key: str, **pandas_options) -> pd.DataFrame:
         if not self.exists():
             return pd.DataFrame()
-        content = self._download_key_from_mc(mc_key).read()
-        return pd.read_parquet(io.BytesIO(content), **pandas_options)
+        content = self._download_bytes(mc_key)
+        with Instrumentation.current().phase('decode'):
+            return pd.read_parquet(io.BytesIO(content), **pandas_options)
 
     def load_canonical(self) -> Union[pd.DataFrame, dict, GzipFile]:
         """ returns the canonical dataset based on the connector contract. This method utilises the pandas
@@ -124,24 +145,27 @@ class McSourceHandler(AbstractSourceHandler):
         # session
         if _cc.schema not in ['mc']:
             raise ValueError("The Connector Contract Schema has not been set correctly.")
-        with threading.Lock():
-            if file_type.lower() in ['csv']:
-                rtn_data = self._load_df_from_csv_in_mc(mc_key=self.mc_key(), **load_params)
-            elif file_type.lower() in ['pkl ', 'pickle']:
-                rtn_data = self._load_df_from_pickle_in_mc(mc_key=self.mc_key(), **load_params)
-            # elif file_type.lower() in ['tsv']:
-            #     rtn_data = self._load_df_from_csv_in_mc(self.mc_key(, delimiter='\t', **load_params)
-            elif file_type.lower() in ['json']:
-                rtn_data = self._load_dict_from_json_in_mc(self.mc_key(), **load_params)
-            elif file_type.lower() in ['yaml']:
-                rtn_data = self._load_dict_from_yaml_in_mc(self.mc_key())
-            elif file_type.lower() in ["gz"]:
-                rtn_data = self._load_gz_from_mc(self.mc_key())
-            elif file_type.lower() in ['parquet']:
-                rtn_data = self._load_df_from_parquet_in_mc(mc_key=self.mc_key(),
-                **load_params)
-            else:
-                raise LookupError('The source format {} is not currently supported'.format(file_type))
+        with Instrumentation.operation(self, 'load_canonical', file_type=file_type.lower()) as op:
+            with threading.Lock():
+                if file_type.lower() in ['csv']:
+                    rtn_data = self._load_df_from_csv_in_mc(mc_key=self.mc_key(), **load_params)
+                elif file_type.lower() in ['pkl ', 'pickle']:
+                    rtn_data = self._load_df_from_pickle_in_mc(mc_key=self.mc_key(), **load_params)
+                # elif file_type.lower() in ['tsv']:
+                #     rtn_data = self._load_df_from_csv_in_mc(self.mc_key(, delimiter='\t', **load_params)
+                elif file_type.lower() in ['json']:
+                    rtn_data = self._load_dict_from_json_in_mc(self.mc_key(), **load_params)
+                elif file_type.lower() in ['yaml']:
+                    rtn_data = self._load_dict_from_yaml_in_mc(self.mc_key())
+                elif file_type.lower() in ["gz"]:
+                    rtn_data = self._load_gz_from_mc(self.mc_key())
+                elif file_type.lower() in ['parquet']:
+                    rtn_data = self._load_df_from_parquet_in_mc(mc_key=self.mc_key(),
+                    **load_params)
+                else:
+                    raise LookupError('The source format {} is not currently supported'.format(file_type))
+            if isinstance(rtn_data, pd.DataFrame):
+                op.add(rows=rtn_data.shape[0])
         self.reset_changed()
         return rtn_data
 
@@ -187,33 +211,47 @@ class McPersistHandler(McSourceHandler, AbstractPersistHandler):
         """dumps a pickle file"""
         protocol = kwargs.pop('protocol', pickle.HIGHEST_PROTOCOL)
         fix_imports = kwargs.pop('fix_imports', True)
+        op = Instrumentation.current()
         with threading.Lock():
             # https://stackoverflow.com/questions/13223855/what-is-the-http-content-type-to-use-for-a-blob-of-bytes
-            pickle_byte_stream = pickle.dumps(canonical, protocol=protocol, fix_imports=fix_imports)
-            self.cortex_mc_client.upload_streaming(key=mc_key, project=self.project, stream=pickle_byte_stream, content_type="application/python-pickle", retries=2)
+            with op.phase('encode'):
+                pickle_byte_stream = pickle.dumps(canonical, protocol=protocol, fix_imports=fix_imports)
+            op.add(bytes=len(pickle_byte_stream))
+            with op.phase('upload'):
+                self.cortex_mc_client.upload_streaming(key=mc_key, project=self.project, stream=pickle_byte_stream, content_type="application/python-pickle", retries=2)
 
     def _persist_df_as_csv(self, canonical: pd.DataFrame, mc_key: str, **kwargs):
-        file_name = os.path.basename(mc_key)
-        canonical.to_csv(file_name)
-        with open(file_name, mode="rb") as f_obj:
-            res = self.cortex_mc_client.upload_streaming(key=mc_key, project=self.project, stream=f_obj, content_type="application/octet-stream", retries=2)
+        # spools in memory up to 64MB then to a temporary file, rather than leaving a copy in the working directory
+        op = Instrumentation.current()
+        with tempfile.SpooledTemporaryFile(max_size=64 * 2**20) as f_obj:
+            with op.phase('encode'):
+                DelimitedParser.write_dsv(canonical, f_obj, index=True, quoting=csv.QUOTE_MINIMAL)
+            op.add(bytes=f_obj.tell())
+            f_obj.seek(0)
+            with op.phase('upload'):
+                res = self.cortex_mc_client.upload_streaming(key=mc_key, project=self.project, stream=f_obj, content_type="application/octet-stream", retries=2)
         return res
     
     def _persist_df_as_parquet(self, canonical: pd.DataFrame, mc_key: str, **kwargs):
+        op = Instrumentation.current()
         file_name = os.path.basename(mc_key)
-        canonical.to_parquet(file_name)
-        with open(file_name, mode="rb") as f_obj:
+        with op.phase('encode'):
+            canonical.to_parquet(file_name)
+        op.add(bytes=os.path.getsize(file_name))
+        with open(file_name, mode="rb") as f_obj, op.phase('upload'):
             res = self.cortex_mc_client.upload_streaming(key=mc_key, project=self.project, stream=f_obj, content_type="application/octet-stream", retries=2)
         return res
 
     def _persist_dict_as_json(self, canonical: dict, mc_key: str):
         if isinstance(canonical, pd.DataFrame):
             canonical = canonical.to_json()
-        res = self.cortex_mc_client.upload_streaming(mc_key, project=self.project, stream=json.dumps(canonical), content_type="application/json", retries=2)
+        with Instrumentation.current().phase('upload'):
+            res = self.cortex_mc_client.upload_streaming(mc_key, project=self.project, stream=json.dumps(canonical), content_type="application/json", retries=2)
         return res
 
     def _persist_dict_as_yaml(self, canonical: dict, mc_key: str):
-        res = self.cortex_mc_client.upload_streaming(mc_key, yaml.dump(canonical), "application/yaml", retries=2)
+        with Instrumentation.current().phase('upload'):
+            res = self.cortex_mc_client.upload_streaming(mc_key, yaml.dump(canonical), "application/yaml", retries=2)
         return res
 
     def persist_canonical(self, canonical: pd.DataFrame, **kwargs) -> bool:
@@ -242,21 +280,24 @@ class McPersistHandler(McSourceHandler, AbstractPersistHandler):
         load_params.pop('project', None)
         mc_key = self.mc_key()
         file_type = load_params.get('file_type', _ext if len(_ext) > 0 else 'csv')
-        with threading.Lock():
-            if file_type.lower() in ['csv']:
-                self._persist_df_as_csv(canonical, mc_key=mc_key, **load_params)
-            elif file_type.lower() in ['pkl', 'pickle']:
-                self._persist_df_as_pickle(canonical, mc_key=mc_key, **load_params)
-            # elif file_type.lower() in ['tsv']:
-            #     rtn_data = self._load_df_from_csv_in_mc(mc_key, delimiter='\t', **load_params)
-            elif file_type.lower() in ['json']:
-                self._persist_dict_as_json(canonical=canonical, mc_key=mc_key)
-            elif file_type.lower() in ['yaml']:
-                self._persist_dict_as_yaml(canonical=canonical, mc_key=mc_key)
-            elif file_type.lower() in ['parquet']:
-                self._persist_df_as_parquet(canonical=canonical, mc_key=mc_key)
-            else:
-                raise LookupError('The source format {} is not currently supported'.format(file_type))
+        with Instrumentation.operation(self, 'persist_canonical', file_type=file_type.lower()) as op:
+            with threading.Lock():
+                if file_type.lower() in ['csv']:
+                    self._persist_df_as_csv(canonical, mc_key=mc_key, **load_params)
+                elif file_type.lower() in ['pkl', 'pickle']:
+                    self._persist_df_as_pickle(canonical, mc_key=mc_key, **load_params)
+                # elif file_type.lower() in ['tsv']:
+                #     rtn_data = self._load_df_from_csv_in_mc(mc_key, delimiter='\t', **load_params)
+                elif file_type.lower() in ['json']:
+                    self._persist_dict_as_json(canonical=canonical, mc_key=mc_key)
+                elif file_type.lower() in ['yaml']:
+                    self._persist_dict_as_yaml(canonical=canonical, mc_key=mc_key)
+                elif file_type.lower() in ['parquet']:
+                    self._persist_df_as_parquet(canonical=canonical, mc_key=mc_key)
+                else:
+                    raise LookupError('The source format {} is not currently supported'.format(file_type))
+            if isinstance(canonical, pd.DataFrame):
+                op.add(rows=canonical.shape[0])
 
         return True
 
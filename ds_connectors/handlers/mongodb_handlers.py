@@ -1,15 +1,64 @@
 # Developing Mongo Persist Handler
+import importlib.util
+import inspect
 import json
+import re
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import chain, islice
 
+import numpy as np
 import pandas as pd
 from aistac.handlers.abstract_handlers import AbstractSourceHandler, AbstractPersistHandler
 from aistac.handlers.abstract_handlers import HandlerFactory, ConnectorContract
+from ds_connectors.handlers.registry_helpers import ConnectionRegistry
+from ds_connectors.handlers.instrument_helpers import Instrumentation
+from ds_connectors.handlers.async_helpers import AsyncHandlerMixin, loop_client
 
 __author__ = 'Darryl Oatridge, Omar Eid, Sekhar Pasem'
 
 
-class MongodbSourceHandler(AbstractSourceHandler):
-    """ A mongoDB source handler"""
+class MongodbSourceHandler(AsyncHandlerMixin, AbstractSourceHandler):
+    """ A mongoDB source handler
+
+        URI example
+            uri = "mongodb://host:port/database?collection=name&&find={}&&project={'cat':1}"
+
+        params:
+            collection: (optional) the collection name. By default 'hadron_default' is used
+            find, aggregate, project, limit, skip, sort: (optional) the query passed to the collection
+            decode: (optional) 'columnar' decodes raw BSON batches straight into typed column buffers, using
+                    pymongoarrow if it is installed
+            schema: (optional) with columnar decode, the fields and their types, for example
+                    {'cat': 'str', 'num': 'float', 'int': 'int', 'flag': 'bool', 'date': 'datetime'}
+                    If not given the schema is sampled from the first documents
+            sample_size: (optional) the number of documents sampled to infer the schema. Default 1000
+            if_exists: (optional) on persist 'replace', 'append', 'upsert' or 'fail'. Default append
+            key_fields: (optional) the comma separated fields that identify a document when upserting
+            max_in_flight: (optional) the number of persist batches written concurrently. Default 4
+            change_detection: (optional) how has_changed detects change. 'change_stream' uses a change stream and its
+                    resume token, 'metadata' compares the max _id, the max updated_field and the collStats count and
+                    size, 'count' counts the find documents and 'auto' uses a change stream where the deployment
+                    supports one, otherwise metadata. Default auto
+            updated_field: (optional) an indexed last updated field compared by the metadata change detection. Without
+                    one, metadata detection does not see in-place updates that leave the collection size unchanged
+            parallel: (optional) the number of ranges a find is split into and scanned concurrently. Default 1
+            split_field: (optional) the indexed field the parallel ranges are split on. Default '_id'
+            split_sample: (optional) the number of documents sampled to find the range boundaries. Default 10000
+            read_preference: (optional) the read preference for loads, for example 'secondaryPreferred'
+            incremental: (optional) 'delta' returns only the documents past the last watermark, 'snapshot' merges them
+                    into a locally kept snapshot and returns that. Only with a find, not an aggregate
+            watermark_field: (optional) the increasing field the incremental watermark is kept on. Default '_id'
+            batch_size: (optional) the cursor batch size, and the default chunk size of load_canonical_chunks
+            async_native: (optional) if false, load_canonical_async runs load_canonical on the thread pool rather
+                    than using pymongo's AsyncMongoClient, or motor. Default True
+    """
+
+    _SCHEMA_TYPES = {'int': np.int64, 'float': np.float64, 'bool': np.bool_, 'datetime': 'datetime64[ms]',
+                     'str': object, 'object': object}
+    _ARROW_TYPES = {'int': int, 'float': float, 'bool': bool, 'datetime': datetime, 'str': str}
 
     def __init__(self, connector_contract: ConnectorContract):
         """ initialise the Handler passing the source_contract dictionary """
@@ -27,13 +76,51 @@ class MongodbSourceHandler(AbstractSourceHandler):
         self._mongo_limit = json.loads(_kwargs.pop('limit')) if _kwargs.get('limit') else None
         self._mongo_skip = json.loads(_kwargs.pop('skip')) if _kwargs.get('skip') else None
         self._mongo_sort = eval(_kwargs.pop('sort').replace("'", '"')) if _kwargs.get('sort') else None
+        self._mongo_batch_size = int(_kwargs.pop('batch_size')) if _kwargs.get('batch_size') else None
+        self._mongo_decode = str(_kwargs.pop('decode', 'records')).lower()
+        self._mongo_schema = json.loads(_kwargs.pop('schema').replace("'", '"')) if _kwargs.get('schema') else None
+        self._mongo_sample = int(_kwargs.pop('sample_size', 1000))
+        self._async_native = str(_kwargs.pop('async_native', True)).lower() != 'false'
 
-        self._if_exists = _kwargs.pop('if_exists', 'replace')
+        self._if_exists = _kwargs.pop('if_exists', 'append')
+        self._key_fields = _kwargs.pop('key_fields', None)
+        self._max_in_flight = int(_kwargs.pop('max_in_flight', 4))
+        self._mongo_parallel = int(_kwargs.pop('parallel', 1))
+        self._split_field = _kwargs.pop('split_field', '_id')
+        self._split_sample = int(_kwargs.pop('split_sample', 10_000))
+        self._read_preference = _kwargs.pop('read_preference', None)
+        self._incremental = _kwargs.pop('incremental', None)
+        self._watermark_field = _kwargs.pop('watermark_field', '_id')
+        self._watermark = None
+        self._snapshot = None
+        if self._incremental in ['delta', 'snapshot'] and self._mongo_aggregate is not None:
+            raise ValueError("Incremental loads can not be used with an aggregate, as the watermark is taken from the "
+                             "output documents but would be matched against the input. Use a find")
+        self._change_detection = str(_kwargs.pop('change_detection', 'auto')).lower()
+        self._updated_field = _kwargs.pop('updated_field', None)
+        self._change_stream = None
+        self._change_events = 0
+        self._resume_token = None
         self._file_state = 0
         self._changed_flag = True
 
-        self._mongo_database = self.mongo.MongoClient(self.connector_contract.address)[database]
-        self._mongo_collection = self._mongo_database[self.collection_name]
+        self._database_name = database
+        self._mongo_client_key = ConnectionRegistry.key('mongodb', self.connector_contract.address)
+
+    @property
+    def _mongo_client(self):
+        """ the MongoClient shared through the ConnectionRegistry by every handler with the same address """
+        return ConnectionRegistry.get(self._mongo_client_key,
+                                      lambda: self.mongo.MongoClient(self.connector_contract.address),
+                                      close=lambda client: client.close())
+
+    @property
+    def _mongo_database(self):
+        return self._mongo_client[self._database_name]
+
+    @property
+    def _mongo_collection(self):
+        return self._mongo_database[self.collection_name]
 
     def supported_types(self) -> list:
         """ The source types supported with this module"""
@@ -46,36 +133,468 @@ class MongodbSourceHandler(AbstractSourceHandler):
         """
         if not isinstance(self.connector_contract, ConnectorContract):
             raise ValueError("The PandasSource Connector Contract has not been set")
+        with ConnectionRegistry.in_use(self._mongo_client_key), \
+                Instrumentation.operation(self, 'load_canonical', collection=self.collection_name,
+                                          decode=self._mongo_decode) as op:
+            if self._incremental in ['delta', 'snapshot']:
+                rtn_df = self._load_incremental()
+            else:
+                rtn_df = self._load_query()
+            op.add(rows=rtn_df.shape[0])
+        return rtn_df
+
+    def load_canonical_chunks(self, chunk_size: int=None, **kwargs):
+        """ a generator that yields the canonical as DataFrames of chunk_size documents, so peak memory depends on
+        the chunk size rather than the result size. The cursor batch size is set to the chunk size and aggregates
+        are run with allowDiskUse. With an incremental contract the watermark moves to the largest value delivered
+        so far with each chunk, and chunks are yielded as deltas. In snapshot mode they are also merged into the
+        snapshot the next load_canonical returns
 
+        :param chunk_size: (optional) the documents per DataFrame. Default the batch_size param or 10,000
+        :return: a generator of pandas DataFrames
+        """
+        if not isinstance(self.connector_contract, ConnectorContract):
+            raise ValueError("The PandasSource Connector Contract has not been set")
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            chunk_size = self._mongo_batch_size if self._mongo_batch_size is not None else 10_000
+        with ConnectionRegistry.in_use(self._mongo_client_key):
+            collection = self._load_collection()
+            columnar = self._mongo_decode == 'columnar'
+            if self._mongo_aggregate is not None:
+                if columnar:
+                    cursor = collection.aggregate_raw_batches(self._mongo_aggregate, allowDiskUse=True,
+                                                              batchSize=chunk_size)
+                else:
+                    cursor = collection.aggregate(self._mongo_aggregate, allowDiskUse=True, batchSize=chunk_size)
+            else:
+                if columnar:
+                    cursor = collection.find_raw_batches(self._query_filter(), self._mongo_project)
+                else:
+                    cursor = collection.find(self._query_filter(), self._mongo_project)
+                cursor.batch_size(chunk_size)
+                if self._mongo_limit is not None:
+                    cursor.limit(self._mongo_limit)
+                if self._mongo_skip is not None:
+                    cursor.skip(self._mongo_skip)
+                if self._mongo_sort is not None:
+                    cursor.sort(self._mongo_sort)
+            try:
+                while True:
+                    with Instrumentation.operation(self, 'load_canonical_chunks', collection=self.collection_name,
+                                                   decode=self._mongo_decode) as op:
+                        if columnar:
+                            # each raw batch holds at most one cursor batch of documents
+                            with op.phase('query'):
+                                batch = next(cursor, None)
+                            if batch is None:
+                                break
+                            chunk = self._decode_raw_batches([batch])
+                        else:
+                            with op.phase('query'):
+                                docs = list(islice(cursor, chunk_size))
+                            if len(docs) == 0:
+                                break
+                            with op.phase('build'):
+                                chunk = pd.DataFrame(docs)
+                        op.add(rows=chunk.shape[0])
+                    if self._incremental in ['delta', 'snapshot'] and self._watermark_field in chunk.columns:
+                        self._watermark = self._watermark_value(chunk[self._watermark_field])
+                    if self._incremental == 'snapshot':
+                        self._snapshot = chunk if self._snapshot is None else pd.concat([self._snapshot, chunk],
+                                                                                        ignore_index=True)
+                    yield chunk
+            finally:
+                cursor.close()
+
+    def reset_watermark(self):
+        """ forgets the incremental watermark and snapshot so the next load reads the full result again """
+        self._watermark = None
+        self._snapshot = None
+
+    def _load_incremental(self) -> pd.DataFrame:
+        """ loads the documents past the watermark and moves the watermark to the largest value seen """
+        delta = self._load_query()
+        field = self._watermark_field
+        if delta.shape[0] > 0:
+            if field not in delta.columns:
+                raise ValueError(f"Incremental loads require the watermark field '{field}' in the result")
+            self._watermark = self._watermark_value(delta[field])
+        if self._incremental == 'delta':
+            return delta
+        self._snapshot = delta if self._snapshot is None else pd.concat([self._snapshot, delta], ignore_index=True)
+        return self._snapshot.copy()
+
+    def _watermark_value(self, values: pd.Series):
+        """ the larger of the current watermark and the largest value, as a python value bson can encode, numpy
+        integers and pandas Timestamps included. Chunks arrive in cursor order, not watermark order, so a later
+        chunk can hold only smaller values """
+        values = values.dropna()
+        if values.shape[0] == 0:
+            return self._watermark
+        value = values.max()
+        if isinstance(value, pd.Timestamp):
+            value = value.to_pydatetime()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        if self._watermark is None:
+            return value
+        try:
+            return max(self._watermark, value)
+        except TypeError:
+            return value
+
+    def _query_filter(self) -> dict:
+        """ the find filter, with the incremental watermark condition if there is one """
+        if self._incremental not in ['delta', 'snapshot'] or self._watermark is None:
+            return self._mongo_find
+        condition = {self._watermark_field: {'$gt': self._watermark}}
+        return {'$and': [self._mongo_find, condition]} if self._mongo_find else condition
+
+    def _load_query(self) -> pd.DataFrame:
+        """ runs the find or aggregate query and returns the result """
+        if self._mongo_parallel > 1 and self._mongo_aggregate is None and self._mongo_limit is None \
+                and self._mongo_skip is None and self._mongo_sort is None:
+            return self._load_parallel()
+        if self._mongo_decode == 'columnar':
+            return self._load_columnar()
+        op = Instrumentation.current()
+        collection = self._load_collection()
         if self._mongo_aggregate is not None:
-            return pd.DataFrame(list(self._mongo_collection.aggregate(self._mongo_aggregate)))
+            with op.phase('query'):
+                if self._mongo_batch_size is not None:
+                    docs = list(collection.aggregate(self._mongo_aggregate, batchSize=self._mongo_batch_size))
+                else:
+                    docs = list(collection.aggregate(self._mongo_aggregate))
         elif self._mongo_find is not None:
-            cursor = self._mongo_collection.find(self._mongo_find, self._mongo_project)
+            cursor = collection.find(self._query_filter(), self._mongo_project)
+            if self._mongo_batch_size is not None:
+                cursor.batch_size(self._mongo_batch_size)
             if self._mongo_limit is not None:
                 cursor.limit(self._mongo_limit)
             if self._mongo_skip is not None:
                 cursor.skip(self._mongo_skip)
             if self._mongo_sort is not None:
                 cursor.sort(self._mongo_sort)
-            return pd.DataFrame(list(cursor))
-        return pd.DataFrame()
+            with op.phase('query'):
+                docs = list(cursor)
+        else:
+            return pd.DataFrame()
+        with op.phase('build'):
+            return pd.DataFrame(docs)
+
+    def _load_parallel(self) -> pd.DataFrame:
+        """ splits the split_field into ranges using $bucketAuto over a $sample, combines each range with the find
+        filter and scans the ranges concurrently, each on its own cursor, concatenating the frames in range order. A
+        final range picks up documents where the split_field is missing or of another BSON type than the boundaries,
+        which range comparisons do not match.
+
+        A leading $sample uses MongoDB's random cursor, which a $match in front of it disables, turning the sample
+        into a scan of every matching document. The sample is therefore taken over the whole collection, and the
+        filter applied by each range, unless the filter is indexed and matches fewer documents than split_sample,
+        when matching first is cheap and gives boundaries that split the matching documents evenly. Sampled over the
+        collection, the ranges are even in collection documents rather than in matching ones, so a filter that
+        correlates with the split_field can leave the ranges unbalanced """
+        collection = self._load_collection()
+        field = self._split_field
+        find = self._query_filter()
+        match = [{'$match': find}] if find and self._selective(collection, find) else []
+        pipeline = match + [
+            {'$sample': {'size': self._split_sample}},
+            {'$bucketAuto': {'groupBy': f'${field}', 'buckets': self._mongo_parallel}}]
+        bounds = [bucket['_id']['min'] for bucket in collection.aggregate(pipeline)][1:]
+        ranges = []
+        for lower, upper in zip([None] + bounds, bounds + [None]):
+            condition = {}
+            if lower is not None:
+                condition['$gte'] = lower
+            if upper is not None:
+                condition['$lt'] = upper
+            ranges.append({field: condition} if condition else {})
+        if len(bounds) > 0:
+            ranges.append({'$nor': ranges.copy()})
+        queries = [{'$and': [find, r]} if find and r else r or find for r in ranges]
+
+        def scan(query: dict) -> pd.DataFrame:
+            if self._mongo_decode == 'columnar':
+                return self._load_columnar(collection=collection, query=query)
+            return pd.DataFrame(list(collection.find(query, self._mongo_project)))
+
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            frames = list(executor.map(scan, queries))
+        return pd.concat(frames, ignore_index=True)
+
+    def _selective(self, collection, find: dict) -> bool:
+        """ returns True if an index leads with a top level field of find and find matches fewer documents than
+        split_sample, counted through that index """
+        fields = {name for name in find.keys() if not name.startswith('$')}
+        indexed = any(index['key'][0][0] in fields for index in collection.index_information().values())
+        return indexed and collection.count_documents(find, limit=self._split_sample) < self._split_sample
+
+    def _load_collection(self, collection=None):
+        """ returns the collection, by default the contract collection, with the contract read preference applied """
+        collection = collection if collection is not None else self._mongo_collection
+        if not isinstance(self._read_preference, str):
+            return collection
+        mode = re.sub('([a-z])([A-Z])', r'\1_\2', self._read_preference).upper()
+        return collection.with_options(read_preference=getattr(self.mongo.ReadPreference, mode))
+
+    async def _load_canonical_native(self, **kwargs):
+        """ runs the find or aggregate with pymongo's AsyncMongoClient, or motor if that is installed instead.
+        Incremental, columnar and parallel loads fall back to the thread pool """
+        if not self._async_native or self._incremental in ['delta', 'snapshot'] or self._mongo_decode == 'columnar' \
+                or self._mongo_parallel > 1 or not isinstance(self.connector_contract, ConnectorContract):
+            return NotImplemented
+        if self.driver_available('pymongo.asynchronous'):
+            client_class = self.mongo.AsyncMongoClient
+        elif self.driver_available('motor'):
+            client_class = HandlerFactory.get_module('motor.motor_asyncio').AsyncIOMotorClient
+        else:
+            return NotImplemented
+        client = await loop_client(self._mongo_client_key, lambda: client_class(self.connector_contract.address),
+                                   close=lambda async_client: async_client.close())
+        collection = self._load_collection(client[self._database_name][self.collection_name])
+        with Instrumentation.operation(self, 'load_canonical', collection=self.collection_name,
+                                       decode='async') as op:
+            if self._mongo_aggregate is not None:
+                options = {'batchSize': self._mongo_batch_size} if self._mongo_batch_size is not None else {}
+                cursor = collection.aggregate(self._mongo_aggregate, **options)
+                # pymongo's async aggregate is a coroutine returning the cursor, motor's returns the cursor
+                cursor = await cursor if inspect.isawaitable(cursor) else cursor
+            elif self._mongo_find is not None:
+                cursor = collection.find(self._query_filter(), self._mongo_project)
+                if self._mongo_batch_size is not None:
+                    cursor.batch_size(self._mongo_batch_size)
+                if self._mongo_limit is not None:
+                    cursor.limit(self._mongo_limit)
+                if self._mongo_skip is not None:
+                    cursor.skip(self._mongo_skip)
+                if self._mongo_sort is not None:
+                    cursor.sort(self._mongo_sort)
+            else:
+                return pd.DataFrame()
+            with op.phase('query'):
+                docs = await cursor.to_list(None)
+            with op.phase('build'):
+                rtn_df = pd.DataFrame(docs)
+            op.add(rows=rtn_df.shape[0])
+        return rtn_df
+
+    def _load_columnar(self, collection=None, query: dict=None) -> pd.DataFrame:
+        """ loads the query result through raw BSON batches. If pymongoarrow is installed, and any declared schema
+        only uses types it supports, it decodes the batches natively into Arrow columns. Otherwise the batches are
+        decoded here into typed column buffers """
+        collection = collection if collection is not None else self._load_collection()
+        query = query if isinstance(query, dict) else self._query_filter()
+        declared = isinstance(self._mongo_schema, dict)
+        kinds = set(self._mongo_schema.values()) if declared else set()
+        if importlib.util.find_spec('pymongoarrow') is not None and kinds.issubset(self._ARROW_TYPES.keys()):
+            api = HandlerFactory.get_module('pymongoarrow.api')
+            schema = None
+            if declared:
+                schema = api.Schema({field: self._ARROW_TYPES[kind] for field, kind in self._mongo_schema.items()})
+            if self._mongo_aggregate is not None:
+                table = api.aggregate_arrow_all(collection, self._mongo_aggregate, schema=schema)
+            else:
+                find_kwargs = {'projection': self._mongo_project, 'limit': self._mongo_limit,
+                               'skip': self._mongo_skip, 'sort': self._mongo_sort}
+                find_kwargs = {k: v for k, v in find_kwargs.items() if v is not None}
+                table = api.find_arrow_all(collection, query, schema=schema, **find_kwargs)
+            return table.to_pandas()
+        if self._mongo_aggregate is not None:
+            return self._decode_raw_batches(collection.aggregate_raw_batches(self._mongo_aggregate))
+        cursor = collection.find_raw_batches(query, self._mongo_project)
+        if self._mongo_limit is not None:
+            cursor.limit(self._mongo_limit)
+        if self._mongo_skip is not None:
+            cursor.skip(self._mongo_skip)
+        if self._mongo_sort is not None:
+            cursor.sort(self._mongo_sort)
+        return self._decode_raw_batches(cursor)
+
+    def _decode_raw_batches(self, batches) -> pd.DataFrame:
+        """ decodes raw BSON batches into per-field typed column buffers and builds the DataFrame from them, rather
+        than building it from a list of documents. With a declared schema only those fields are kept, otherwise
+        the types are sampled from the first documents and fields are added in the order they are first seen """
+        bson = HandlerFactory.get_module('bson')
+        op = Instrumentation.current()
+        declared = isinstance(self._mongo_schema, dict)
+        schema = dict(self._mongo_schema) if declared else None
+        buffers = {field: [] for field in schema} if declared else {}
+        rows = 0
+        for batch in batches:
+            op.add(bytes=len(batch))
+            with op.phase('decode'):
+                docs = bson.decode_all(batch)
+            if len(docs) == 0:
+                continue
+            if schema is None:
+                schema = self._infer_schema(docs[:self._mongo_sample])
+            if not declared:
+                for field in dict.fromkeys(chain.from_iterable(docs)):
+                    if field not in buffers:
+                        buffers[field] = [np.full(rows, None, dtype=object)] if rows > 0 else []
+            for field, chunks in buffers.items():
+                chunks.append(self._typed_chunk([doc.get(field) for doc in docs], schema.get(field, 'object')))
+            rows += len(docs)
+        with op.phase('build'):
+            columns = {}
+            for field, chunks in buffers.items():
+                values = np.concatenate(chunks) if len(chunks) > 0 else np.array([], dtype=object)
+                if values.dtype.kind == 'M':
+                    values = values.astype('datetime64[ns]')
+                columns[field] = values
+            return pd.DataFrame(columns, copy=False)
+
+    @staticmethod
+    def _infer_schema(docs: list) -> dict:
+        """ infers the field types from a sample of documents. Mixed types are kept as objects """
+        schema = {}
+        for doc in docs:
+            for field, value in doc.items():
+                if value is None:
+                    continue
+                if isinstance(value, bool):
+                    kind = 'bool'
+                elif isinstance(value, int):
+                    kind = 'int'
+                elif isinstance(value, float):
+                    kind = 'float'
+                elif isinstance(value, str):
+                    kind = 'str'
+                elif isinstance(value, datetime):
+                    kind = 'datetime'
+                else:
+                    kind = 'object'
+                current = schema.get(field, kind)
+                if current != kind:
+                    kind = 'float' if {current, kind} == {'int', 'float'} else 'object'
+                schema[field] = kind
+        return schema
+
+    @classmethod
+    def _typed_chunk(cls, values: list, kind: str) -> np.ndarray:
+        """ converts one batch of field values to a typed array, following pandas in promoting integers with
+        missing values to float and falling back to objects if the values do not match the type """
+        dtype = cls._SCHEMA_TYPES.get(kind, object)
+        if dtype is object:
+            return cls._object_array(values)
+        try:
+            if None in values:
+                if kind == 'int':
+                    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+                if kind == 'bool':
+                    return cls._object_array(values)
+            if kind == 'float':
+                return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            if kind == 'bool' and not all(isinstance(v, bool) for v in values):
+                raise TypeError("non boolean value")
+            return np.array(values, dtype=dtype)
+        except (TypeError, ValueError, OverflowError):
+            return cls._object_array(values)
+
+    @staticmethod
+    def _object_array(values: list) -> np.ndarray:
+        """ a one dimensional object array, without numpy expanding nested lists into extra dimensions """
+        try:
+            rtn_array = np.array(values, dtype=object)
+            if rtn_array.ndim == 1:
+                return rtn_array
+        except ValueError:
+            pass
+        rtn_array = np.empty(len(values), dtype=object)
+        for index, value in enumerate(values):
+            rtn_array[index] = value
+        return rtn_array
 
     def exists(self) -> bool:
         """ returns True if the collection exists """
-        return self.collection_name in self._mongo_database.list_collection_names()
+        with ConnectionRegistry.in_use(self._mongo_client_key):
+            return self.collection_name in self._mongo_database.list_collection_names()
 
     def has_changed(self) -> bool:
-        """ returns the amount of documents in the collection
-            ... if the counts change ... then the collection was probably modified ...
-            ... this assumes that records are never edited/updated ... nor deleted ...
+        """ returns if the collection has changed since it was last seen. By default a change stream is polled, with
+        its resume token kept between calls, where the deployment supports one. Otherwise the max _id, and the max
+        updated_field if one is set, are read with indexed sort-limit-1 queries and compared with the collStats count
+        and size. Without an updated_field, an in-place update that leaves the collection size unchanged is not seen.
+        See the 'change_detection' param
         """
-        _cc = self.connector_contract
-        state = self._mongo_collection.count_documents(self._mongo_find)
+        if self._change_detection == 'count':
+            state = self._mongo_collection.count_documents(self._mongo_find)
+        elif self._change_detection in ['auto', 'change_stream']:
+            state = self._change_stream_state()
+        else:
+            state = self._metadata_state()
         if state != self._file_state:
             self._changed_flag = True
             self._file_state = state
         return self._changed_flag
 
+    def _change_stream_state(self):
+        """ drains the change stream without blocking and returns the count of change events seen. If the
+        deployment does not support change streams 'auto' falls back to the metadata state """
+        errors = self.mongo.errors
+        try:
+            if self._change_stream is None or not self._change_stream.alive:
+                self._change_stream = self._mongo_collection.watch(self._change_pipeline(),
+                                                                   resume_after=self._resume_token,
+                                                                   full_document='updateLookup')
+            while self._change_stream.try_next() is not None:
+                self._change_events += 1
+            self._resume_token = self._change_stream.resume_token
+        except errors.OperationFailure:
+            if self._change_detection != 'auto':
+                raise
+            # standalone servers do not support change streams
+            self._change_detection = 'metadata'
+            self._change_stream = None
+            return self._metadata_state()
+        return 'change_stream', self._change_events
+
+    def _change_pipeline(self) -> list:
+        """ the change stream pipeline matching the find filter against the fullDocument of inserts, updates and
+        replaces. Deletes and collection events carry no document, so they always count as a change. An update that
+        moves a document out of the filter is not seen. A filter with operators other than $and, $or and $nor at the
+        top level is not translated and every change counts """
+        if not self._mongo_find:
+            return []
+        query = self._full_document_filter(self._mongo_find)
+        if query is None:
+            return []
+        return [{'$match': {'$or': [{'operationType': {'$nin': ['insert', 'update', 'replace']}}, query]}}]
+
+    @classmethod
+    def _full_document_filter(cls, query: dict):
+        """ the find filter with each field path under 'fullDocument', or None if it can not be translated """
+        rtn_query = {}
+        for key, value in query.items():
+            if key in ['$and', '$or', '$nor']:
+                clauses = [cls._full_document_filter(clause) for clause in value]
+                if any(clause is None for clause in clauses):
+                    return None
+                rtn_query[key] = clauses
+            elif key.startswith('$'):
+                return None
+            else:
+                rtn_query[f'fullDocument.{key}'] = value
+        return rtn_query
+
+    def _metadata_state(self) -> tuple:
+        """ returns the max _id and updated_field, each an indexed sort-limit-1, with the collStats count and size """
+        errors = self.mongo.errors
+        state = []
+        for field in ['_id', self._updated_field]:
+            if not isinstance(field, str):
+                continue
+            doc = self._mongo_collection.find_one(self._mongo_find, {field: 1}, sort=[(field, -1)])
+            state.append(doc.get(field) if doc is not None else None)
+        try:
+            stats = next(self._mongo_collection.aggregate([{'$collStats': {'storageStats': {}}}]), {})
+            storage = stats.get('storageStats', {})
+            state += [storage.get('count'), storage.get('size')]
+        except errors.OperationFailure:
+            pass
+        return tuple(state)
+
     def reset_changed(self, changed: bool = False):
         """ manual reset to say the file has been seen. This is automatically called if the file is loaded"""
         changed = changed if isinstance(changed, bool) else False
@@ -94,14 +613,118 @@ class MongodbPersistHandler(MongodbSourceHandler, AbstractPersistHandler):
         return self.backup_canonical(canonical=canonical, table=self.collection_name, **kwargs)
 
     def backup_canonical(self, canonical: pd.DataFrame, table: str, **kwargs) -> bool:
-        """  creates a backup of the canonical to an alternative table """
+        """  creates a backup of the canonical to an alternative table. The canonical is converted to documents a
+        chunk at a time and written as unordered batches, several in flight at once.
+
+        :param canonical: the DataFrame to persist
+        :param table: the collection name
+        :param if_exists: (optional) 'replace' through a temporary collection, created with the options and indexes
+                    of the existing collection, and a rename, 'append', 'upsert' on the key_fields, or 'fail' if the
+                    collection exists. Default from the Connector Contract, else append
+        :param key_fields: (optional) a list or comma separated string of the fields that identify a document
+        :param chunk_size: (optional) the number of documents per batch. Default sized to the 16MB/100k-op limits
+        :param max_in_flight: (optional) the number of batches written concurrently
+        :return: True if every document was written
+        """
         if not isinstance(self.connector_contract, ConnectorContract):
             return False
+        _params = kwargs
+        if_exists = str(_params.pop('if_exists', self._if_exists)).lower()
+        key_fields = _params.pop('key_fields', self._key_fields)
+        chunk_size = _params.pop('chunk_size', None)
+        max_in_flight = int(_params.pop('max_in_flight', self._max_in_flight))
+        if if_exists not in ['replace', 'append', 'upsert', 'fail']:
+            raise ValueError(f"The if_exists value '{if_exists}' must be one of replace, append, upsert or fail")
+        if isinstance(key_fields, str):
+            key_fields = [field.strip() for field in key_fields.split(',') if len(field.strip()) > 0]
+        if if_exists == 'upsert' and not key_fields:
+            raise ValueError("Upserting the canonical requires the 'key_fields' that identify a document")
+        with ConnectionRegistry.in_use(self._mongo_client_key):
+            exists = table in self._mongo_database.list_collection_names()
+            if if_exists == 'fail' and exists:
+                raise ValueError(f"The collection '{table}' already exists")
+            if if_exists == 'replace':
+                target = self._mongo_database[f"{table}_tmp_{uuid.uuid4().hex}"]
+            else:
+                target = self._mongo_database[table]
+            try:
+                with Instrumentation.operation(self, 'persist_canonical', collection=table, if_exists=if_exists) as op:
+                    if if_exists == 'replace' and exists:
+                        # the validator, collation and other options can only be set when the collection is created
+                        self._mongo_database.create_collection(target.name, **self._mongo_database[table].options())
+                    with op.phase('write'):
+                        written = self._write_batches(target, canonical, chunk_size=chunk_size,
+                                                      key_fields=key_fields if if_exists == 'upsert' else None,
+                                                      max_in_flight=max_in_flight)
+                    op.add(rows=written)
+                    if if_exists == 'replace':
+                        with op.phase('swap'):
+                            if canonical.shape[0] > 0:
+                                if exists:
+                                    self._copy_indexes(self._mongo_database[table], target)
+                                target.rename(table, dropTarget=True)
+                            else:
+                                self._mongo_database.drop_collection(target.name)
+                                if exists:
+                                    self._mongo_database[table].delete_many({})
+            except Exception:
+                if if_exists == 'replace':
+                    self._mongo_database.drop_collection(target.name)
+                raise
+            return written == canonical.shape[0]
+
+    def _copy_indexes(self, source, target):
+        """ creates the indexes of the source collection, other than _id, on the target """
+        indexes = []
+        for index in source.list_indexes():
+            index = dict(index)
+            if index.get('name') == '_id_':
+                continue
+            keys = list(index.pop('key').items())
+            for option in ['v', 'ns']:
+                index.pop(option, None)
+            indexes.append(self.mongo.IndexModel(keys, **index))
+        if len(indexes) > 0:
+            target.create_indexes(indexes)
+
+    def _write_batches(self, collection, canonical: pd.DataFrame, key_fields: list=None, chunk_size: int=None,
+                       max_in_flight: int=None) -> int:
+        """ converts the canonical to documents a batch at a time and writes each as an unordered insert_many, or as
+        an unordered bulk_write of ReplaceOne upserts if key fields are given. At most max_in_flight batches are
+        held in memory and written at once. Returns the number of documents written """
+        bson = HandlerFactory.get_module('bson')
+        pymongo = self.mongo
+        size = canonical.shape[0]
+        if size == 0:
+            return 0
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            sample = canonical.iloc[:100].to_dict(orient="records")
+            doc_size = max(1, sum(len(bson.encode(doc)) for doc in sample) // len(sample))
+            # stay well inside the 16MB message and 100,000 write operation limits
+            chunk_size = max(1, min(100_000, (12 * 1024 * 1024) // doc_size))
+        max_in_flight = max_in_flight if isinstance(max_in_flight, int) and max_in_flight > 0 else 1
+
+        def write(start: int) -> int:
+            docs = canonical.iloc[start:start + chunk_size].to_dict(orient="records")
+            if key_fields:
+                requests = [pymongo.ReplaceOne({k: doc.get(k) for k in key_fields}, doc, upsert=True) for doc in docs]
+                result = collection.bulk_write(requests, ordered=False)
+                return result.matched_count + result.upserted_count
+            return len(collection.insert_many(docs, ordered=False).inserted_ids)
 
-        resp = self._mongo_collection.insert_many(canonical.to_dict(orient="records"))
-        return len(resp.inserted_ids) == canonical.shape[0]
+        written = 0
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for start in range(0, size, chunk_size):
+                if len(in_flight) >= max_in_flight:
+                    written += in_flight.popleft().result()
+                in_flight.append(executor.submit(write, start))
+            while in_flight:
+                written += in_flight.popleft().result()
+        return written
 
     def remove_canonical(self) -> bool:
         if not isinstance(self.connector_contract, ConnectorContract):
             return False
-        resp = self._mongo_database.drop_collection(self.collection_name)
+        with ConnectionRegistry.in_use(self._mongo_client_key):
+            resp = self._mongo_database.drop_collection(self.collection_name)
@@ -1,11 +1,14 @@
 from aistac.handlers.abstract_handlers import AbstractSourceHandler, ConnectorContract
 from aistac.handlers.abstract_handlers import HandlerFactory, AbstractPersistHandler
 import pandas as pd
+from ds_connectors.handlers.registry_helpers import ConnectionRegistry
+from ds_connectors.handlers.instrument_helpers import Instrumentation
+from ds_connectors.handlers.async_helpers import AsyncHandlerMixin, loop_client
 
 __author__ = 'Darryl and Sekhar'
 
 
-class MysqlSourceHandler(AbstractSourceHandler):
+class MysqlSourceHandler(AsyncHandlerMixin, AbstractSourceHandler):
     """ This handler class uses both SQLAlchemy and pymysql. Together, SQLAlchemy and pymysql provide a powerful
     toolset for working with databases and faster connectivity. SQLAlchemy allows developers to interact with MySQL
     using Python code, while MySQL provides the database functionality needed to store and retrieve data efficiently.
@@ -17,6 +20,10 @@ class MysqlSourceHandler(AbstractSourceHandler):
             query: (optional) a source query added as a parameter or kward
             table: (optional) the sql table assuming full dataframe persist. By default 'hadron_default' is used
             if_exists: (optional) How to behave if the table already exists.‘fail’, ‘replace’, ‘append’. Default replace
+            pool_size: (optional) the SQLAlchemy engine pool size. The engine is shared by every handler with the
+                        same address and engine kwargs
+
+        load_canonical_async uses an aiomysql pool if aiomysql is installed
 
     """
 
@@ -33,11 +40,22 @@ class MysqlSourceHandler(AbstractSourceHandler):
         self._sql_table = _kwargs.pop('table', "hadron_default")
         self._if_exists = _kwargs.pop('if_exists', 'replace')
         # add dialect
-        address = self.connector_contract.address.replace('mysql:', 'mysql+pymysql:')
-        self._engine = self.sqlalchemy.create_engine(address, **_kwargs)
+        self._address = self.connector_contract.address.replace('mysql:', 'mysql+pymysql:')
+        pool_size = ConnectionRegistry.pool_size(_kwargs.pop('pool_size', None))
+        if pool_size is not None:
+            _kwargs['pool_size'] = pool_size
+        self._engine_kwargs = _kwargs
+        self._engine_key = ConnectionRegistry.key('mysql', self._address, **_kwargs)
         self._update_time = pd.Timestamp("1970-01-01")
         self._changed_flag = True
 
+    @property
+    def _engine(self):
+        """ the SQLAlchemy engine shared through the ConnectionRegistry """
+        return ConnectionRegistry.get(self._engine_key,
+                                      lambda: self.sqlalchemy.create_engine(self._address, **self._engine_kwargs),
+                                      close=lambda engine: engine.dispose())
+
     def supported_types(self) -> list:
         """ The source types supported with this module"""
         return ['mysql']
@@ -46,7 +64,8 @@ class MysqlSourceHandler(AbstractSourceHandler):
         """If the table exists"""
         try:
             meta = self.sqlalchemy_schema.MetaData()
-            meta.reflect(bind=self._engine)
+            with ConnectionRegistry.in_use(self._engine_key):
+                meta.reflect(bind=self._engine)
             if self._sql_table in meta.tables.keys():
                 return True
             return False
@@ -61,7 +80,7 @@ class MysqlSourceHandler(AbstractSourceHandler):
         query = f"SELECT UPDATE_TIME " \
                 f"FROM information_schema.tables " \
                 f"WHERE TABLE_SCHEMA = '{database}' AND TABLE_NAME = '{table}';"
-        with self._engine.connect() as con:
+        with ConnectionRegistry.in_use(self._engine_key), self._engine.connect() as con:
             result = con.execute(query)
         last_update = pd.to_datetime((next(result))[0])
         if last_update is None or self._update_time < last_update:
@@ -80,10 +99,51 @@ class MysqlSourceHandler(AbstractSourceHandler):
         if not isinstance(self.connector_contract, ConnectorContract):
             raise ValueError("The Connector Contract is not valid")
         try:
-            connect = self._engine.connect()
-            query = self._sql_query if len(self._sql_query) > 0 else f"SELECT * FROM {self._sql_table}"
-            rtn_df = pd.read_sql(query, con=connect, **kwargs)
-            connect.close()
+            with ConnectionRegistry.in_use(self._engine_key), Instrumentation.operation(self, 'load_canonical') as op:
+                with op.phase('connect', counter='pool_wait'):
+                    connect = self._engine.connect()
+                query = self._sql_query if len(self._sql_query) > 0 else f"SELECT * FROM {self._sql_table}"
+                with op.phase('query'):
+                    rtn_df = pd.read_sql(query, con=connect, **kwargs)
+                connect.close()
+                op.add(rows=rtn_df.shape[0])
+            return rtn_df
+        except self.pymysql.Error as error:
+            raise ConnectionError(f"Failed to load the canonical to MySQL because {error}")
+
+    async def _load_canonical_native(self, **kwargs):
+        """ runs the query on a per event loop aiomysql pool. Calls with pandas read_sql kwargs fall back to the
+        thread pool """
+        if not isinstance(self.connector_contract, ConnectorContract) or len(kwargs) > 0 \
+                or not self.driver_available('aiomysql'):
+            return NotImplemented
+        aiomysql = HandlerFactory.get_module('aiomysql')
+        _cc = self.connector_contract
+        options = dict(host=_cc.hostname, port=int(_cc.port or 3306), user=_cc.username, password=_cc.password,
+                       db=_cc.path[1:], maxsize=self._engine_kwargs.get('pool_size', 10))
+
+        async def close(pool):
+            pool.close()
+            await pool.wait_closed()
+
+        pool = await loop_client(ConnectionRegistry.key('mysql_async', **options),
+                                 lambda: aiomysql.create_pool(**options), close=close)
+        query = self._sql_query if len(self._sql_query) > 0 else f"SELECT * FROM {self._sql_table}"
+        try:
+            with Instrumentation.operation(self, 'load_canonical', mode='async') as op:
+                with op.phase('connect', counter='pool_wait'):
+                    conn = await pool.acquire()
+                try:
+                    async with conn.cursor() as cursor:
+                        with op.phase('query'):
+                            await cursor.execute(query)
+                            rows = await cursor.fetchall()
+                        columns = [column[0] for column in cursor.description]
+                finally:
+                    pool.release(conn)
+                with op.phase('build'):
+                    rtn_df = pd.DataFrame.from_records(list(rows), columns=columns, coerce_float=True)
+                op.add(rows=rtn_df.shape[0])
             return rtn_df
         except self.pymysql.Error as error:
             raise ConnectionError(f"Failed to load the canonical to MySQL because {error}")
@@ -104,9 +164,14 @@ class MysqlPersistHandler(MysqlSourceHandler, AbstractPersistHandler):
             _if_exists = self._if_exists
             _params = kwargs
             _if_exists = _params.pop('if_exists', self._if_exists)
-            connect = self._engine.connect()
-            canonical.to_sql(con=connect, name=table, if_exists=_if_exists, index=False, **_params)
-            connect.close()
+            with ConnectionRegistry.in_use(self._engine_key), \
+                    Instrumentation.operation(self, 'persist_canonical', table=table) as op:
+                with op.phase('connect', counter='pool_wait'):
+                    connect = self._engine.connect()
+                with op.phase('write'):
+                    canonical.to_sql(con=connect, name=table, if_exists=_if_exists, index=False, **_params)
+                connect.close()
+                op.add(rows=canonical.shape[0])
             return True
         except self.pymysql.Error as error:
             raise ConnectionError(f"Failed to save the canonical to MySQL because {error}")
@@ -118,7 +183,7 @@ class MysqlPersistHandler(MysqlSourceHandler, AbstractPersistHandler):
         _cc = self.connector_contract
         try:
             query = f"DROP TABLE IF EXISTS {self._sql_table};"
-            with self._engine.connect() as con:
+            with ConnectionRegistry.in_use(self._engine_key), self._engine.connect() as con:
                 con.execute(query)
         except self.pymysql.Error:
             return False
@@ -10,11 +10,14 @@ from sqlalchemy.orm import declarative_base
 from sqlalchemy.types import Integer, Float
 from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
+from ds_connectors.handlers.registry_helpers import ConnectionRegistry
+from ds_connectors.handlers.instrument_helpers import Instrumentation
+from ds_connectors.handlers.async_helpers import AsyncHandlerMixin
 
 __author__ = 'Darryl and Sekhar'
 
 
-class OracleSourceHandler(AbstractSourceHandler):
+class OracleSourceHandler(AsyncHandlerMixin, AbstractSourceHandler):
     """ This handler class uses both SQLAlchemy and oracledb. Together, SQLAlchemy and oracledb provide a powerful
     toolset for working with databases and faster connectivity. SQLAlchemy allows developers to interact with Oracle
     using Python code, while Oracle provides the database functionality needed to store and retrieve data efficiently.
@@ -26,6 +29,8 @@ class OracleSourceHandler(AbstractSourceHandler):
             query: (optional) a source query added as a parameter or kward
             table: (optional) the sql table assuming full dataframe persist. By default 'hadron_default' is used
             if_exists: (optional) How to behave if the table already exists.‘fail’, ‘replace’, ‘append’. Default replace
+            pool_size: (optional) the maximum sessions in the oracledb pool. The pool and engine are shared by every
+                        handler with the same connection. Default 4
 
     """
 
@@ -42,21 +47,30 @@ class OracleSourceHandler(AbstractSourceHandler):
         self._sql_table = _kwargs.pop('table', "hadron_default")
         self._if_exists = _kwargs.pop('if_exists', 'replace')
         # add dialect
-        address = self.connector_contract.address.replace('oracle://', '')
-        user = self.connector_contract.username
-        pwd = self.connector_contract.password
-        port = self.connector_contract.port
-        hostname = self.connector_contract.hostname
-        service_name = self.connector_contract.path.split("/")[-1]
-        pool = oracledb.create_pool(user=user, password=pwd,
-                                    host=hostname, port=port, service_name=service_name,
-                                    min=1, max=4, increment=1)
-
-        self._engine = create_engine("oracle+oracledb://", creator=pool.acquire, poolclass=NullPool)
-
+        self._pool_params = dict(user=self.connector_contract.username, password=self.connector_contract.password,
+                                 host=self.connector_contract.hostname, port=self.connector_contract.port,
+                                 service_name=self.connector_contract.path.split("/")[-1], min=1,
+                                 max=ConnectionRegistry.pool_size(_kwargs.pop('pool_size', None), default=4),
+                                 increment=1)
+        self._engine_key = ConnectionRegistry.key('oracle', **self._pool_params)
         self._update_time = pd.Timestamp("1970-01-01")
         self._changed_flag = True
 
+    @property
+    def _engine(self):
+        """ the SQLAlchemy engine over the oracledb pool, both shared through the ConnectionRegistry """
+        return ConnectionRegistry.get(self._engine_key, self._create_engine, close=self._dispose_engine)[0]
+
+    def _create_engine(self) -> tuple:
+        pool = oracledb.create_pool(**self._pool_params)
+        return create_engine("oracle+oracledb://", creator=pool.acquire, poolclass=NullPool), pool
+
+    @staticmethod
+    def _dispose_engine(resource: tuple):
+        engine, pool = resource
+        engine.dispose()
+        pool.close(force=True)
+
     def supported_types(self) -> list:
         """ The source types supported with this module"""
         return ['oracle']
@@ -65,7 +79,8 @@ class OracleSourceHandler(AbstractSourceHandler):
         """If the table exists"""
         try:
             meta = self.sqlalchemy_schema.MetaData()
-            meta.reflect(bind=self._engine)
+            with ConnectionRegistry.in_use(self._engine_key):
+                meta.reflect(bind=self._engine)
             if self._sql_table in meta.tables.keys():
                 return True
             return False
@@ -80,7 +95,7 @@ class OracleSourceHandler(AbstractSourceHandler):
         query = f"SELECT UPDATE_TIME " \
                 f"FROM information_schema.tables " \
                 f"WHERE TABLE_SCHEMA = '{database}' AND TABLE_NAME = '{table}';"
-        with self._engine.connect() as con:
+        with ConnectionRegistry.in_use(self._engine_key), self._engine.connect() as con:
             result = con.execute(query)
         last_update = pd.to_datetime((next(result))[0])
         if last_update is None or self._update_time < last_update:
@@ -99,10 +114,14 @@ class OracleSourceHandler(AbstractSourceHandler):
         if not isinstance(self.connector_contract, ConnectorContract):
             raise ValueError("The Connector Contract is not valid")
         try:
-            with self._engine.connect() as con:
-                query = self._sql_query if len(self._sql_query) > 0 else f"SELECT * FROM {self._sql_table}"
-
-                rtn_df = pd.read_sql(text(query), con=con, **kwargs)
+            with ConnectionRegistry.in_use(self._engine_key), Instrumentation.operation(self, 'load_canonical') as op:
+                with op.phase('connect', counter='pool_wait'):
+                    con = self._engine.connect()
+                with con:
+                    query = self._sql_query if len(self._sql_query) > 0 else f"SELECT * FROM {self._sql_table}"
+                    with op.phase('query'):
+                        rtn_df = pd.read_sql(text(query), con=con, **kwargs)
+                op.add(rows=rtn_df.shape[0])
             return rtn_df
         except oracledb.Error as error:
             raise ConnectionError(f"Failed to load the canonical to Oracle because {error}")
@@ -123,7 +142,8 @@ class OraclePersistHandler(OracleSourceHandler, AbstractPersistHandler):
             _if_exists = self._if_exists
             _params = kwargs
             _if_exists = _params.pop('if_exists', self._if_exists)
-            with self._engine.connect() as con:
+            with ConnectionRegistry.in_use(self._engine_key), \
+                    Instrumentation.operation(self, 'persist_canonical', table=table) as op:
                 dtypes_dict = canonical.dtypes.apply(lambda x: x.name).to_dict()
                 new_types = {}
                 for col, type in dtypes_dict.items():
@@ -132,7 +152,9 @@ class OraclePersistHandler(OracleSourceHandler, AbstractPersistHandler):
                     if "int64" == type:
                         new_types[col] = Integer
 
-                canonical.to_sql(con=self._engine, name=table, if_exists=_if_exists, dtype=new_types, index=False, **_params)
+                with op.phase('write'):
+                    canonical.to_sql(con=self._engine, name=table, if_exists=_if_exists, dtype=new_types, index=False, **_params)
+                op.add(rows=canonical.shape[0])
             return True
         except oracledb.Error as error:
             traceback.print_exc()
@@ -146,11 +168,12 @@ class OraclePersistHandler(OracleSourceHandler, AbstractPersistHandler):
         try:
             Base = declarative_base()
             metadata = MetaData()
-            metadata.reflect(bind=self._engine)
-            if self._sql_table in metadata.tables:
-                table = metadata.tables[self._sql_table]
-                if table is not None:
-                    Base.metadata.drop_all(self._engine, [table], checkfirst=True)
+            with ConnectionRegistry.in_use(self._engine_key):
+                metadata.reflect(bind=self._engine)
+                if self._sql_table in metadata.tables:
+                    table = metadata.tables[self._sql_table]
+                    if table is not None:
+                        Base.metadata.drop_all(self._engine, [table], checkfirst=True)
         except oracledb.Error:
             return False
         return True
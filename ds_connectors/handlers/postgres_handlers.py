@@ -1,15 +1,20 @@
+import threading
 from aistac.handlers.abstract_handlers import AbstractSourceHandler, ConnectorContract, HandlerFactory
+from ds_connectors.handlers.registry_helpers import ConnectionRegistry
+from ds_connectors.handlers.instrument_helpers import Instrumentation
+from ds_connectors.handlers.async_helpers import AsyncHandlerMixin, loop_client
 
 __author__ = 'Johan Gielstra'
 
 
-class PostgresSourceHandler(AbstractSourceHandler):
-    """ A Postgres Source Handler"""
+class PostgresSourceHandler(AsyncHandlerMixin, AbstractSourceHandler):
+    """ A Postgres Source Handler. load_canonical_async uses an asyncpg pool if asyncpg is installed"""
 
     def __init__(self, connector_contract: ConnectorContract):
         """ initialise the Hander passing the source_contract dictionary """
         # required module import
         self.psycopg2 = HandlerFactory.get_module('psycopg2')
+        self.psycopg2_pool = HandlerFactory.get_module('psycopg2.pool')
         super().__init__(connector_contract)
         self._file_state = 0
         self._changed_flag = True
@@ -40,7 +45,6 @@ class PostgresSourceHandler(AbstractSourceHandler):
             The canonical in this instance is a dictionary that has the headers as the key and then
             the ordered list of values for that header
         """
-        conn = None
         if not isinstance(self.connector_contract, ConnectorContract):
             raise ValueError("The Connector Contract is not valid")
         database = self.connector_contract.path[1:]
@@ -51,32 +55,93 @@ class PostgresSourceHandler(AbstractSourceHandler):
         user = self.connector_contract.username
         password = self.connector_contract.password
         port = self.connector_contract.port or '5432'
+        pool_size = ConnectionRegistry.pool_size(self.connector_contract.kwargs.get('pool_size'), default=4)
         if connector_type.lower() not in self.supported_types():
             raise ValueError("The source type '{}' is not supported. see supported_types()".format(connector_type))
+        key = ConnectionRegistry.key('postgres', host=host, port=port, database=database, user=user,
+                                     password=password, pool_size=pool_size)
+
+        def create_pool():
+            # ThreadedConnectionPool raises rather than waits when exhausted, so a semaphore sized to the pool
+            # queues the callers for a free connection
+            return (self.psycopg2_pool.ThreadedConnectionPool(1, pool_size, database=database, host=host, port=port,
+                                                              user=user, password=password),
+                    threading.BoundedSemaphore(pool_size))
+
         try:
-            conn = self.psycopg2.connect(database=database, host=host, port=port, user=user, password=password)
-            cur = conn.cursor()
-            cur.execute(query)
-            colnames = [desc[0] for desc in cur.description]
-            rtn_dict = {}
-            row = cur.fetchone()  # look into fetchMany versus 1-1
-            """
-            {
-                "col1" = [1,2,3],
-                "col2" = ["a","b","c"]
-            }
-            """
-            while row is not None:
-                for idx, col in enumerate(colnames):
-                    if col not in rtn_dict:
-                        rtn_dict[col] = []
-                    rtn_dict.get(col).append(row[idx])
-                row = cur.fetchone()
-            cur.close()
+            with ConnectionRegistry.in_use(key), Instrumentation.operation(self, 'load_canonical') as op:
+                with op.phase('connect', counter='pool_wait'):
+                    pool, slots = ConnectionRegistry.get(key, create_pool,
+                                                         close=lambda resource: resource[0].closeall())
+                    slots.acquire()
+                    try:
+                        conn = pool.getconn()
+                    except BaseException:
+                        slots.release()
+                        raise
+                try:
+                    cur = conn.cursor()
+                    with op.phase('query'):
+                        cur.execute(query)
+                    with op.phase('build'):
+                        colnames = [desc[0] for desc in cur.description]
+                        rtn_dict = {}
+                        row = cur.fetchone()  # look into fetchMany versus 1-1
+                        """
+                        {
+                            "col1" = [1,2,3],
+                            "col2" = ["a","b","c"]
+                        }
+                        """
+                        while row is not None:
+                            for idx, col in enumerate(colnames):
+                                if col not in rtn_dict:
+                                    rtn_dict[col] = []
+                                rtn_dict.get(col).append(row[idx])
+                            row = cur.fetchone()
+                    op.add(rows=cur.rowcount)
+                    cur.close()
+                finally:
+                    # the pool rolls back any open transaction and keeps the connection for reuse
+                    pool.putconn(conn)
+                    slots.release()
             return rtn_dict
-        except (Exception, self.psycopg2.DatabaseError) as error:
-            print(error)
-        finally:
-            if conn is not None:
-                conn.close()
-                print('Database connection closed.')
+        except (self.psycopg2.DatabaseError, self.psycopg2_pool.PoolError) as error:
+            raise ConnectionError(f"Failed to load the canonical from Postgres because {error}")
+
+    async def _load_canonical_native(self, **kwargs):
+        """ runs the query on a per event loop asyncpg pool, returning the same dictionary as load_canonical """
+        if not isinstance(self.connector_contract, ConnectorContract) or not self.driver_available('asyncpg'):
+            return NotImplemented
+        asyncpg = HandlerFactory.get_module('asyncpg')
+        _cc = self.connector_contract
+        if _cc.schema.lower() not in self.supported_types():
+            raise ValueError("The source type '{}' is not supported. see supported_types()".format(_cc.schema))
+        database = _cc.path[1:]
+        host = _cc.hostname
+        port = int(_cc.port or 5432)
+        user = _cc.username
+        password = _cc.password
+        query = _cc.kwargs.get('query')
+        pool_size = ConnectionRegistry.pool_size(_cc.kwargs.get('pool_size'), default=4)
+        key = ConnectionRegistry.key('postgres_async', host=host, port=port, database=database, user=user,
+                                     password=password, pool_size=pool_size)
+        pool = await loop_client(key, lambda: asyncpg.create_pool(database=database, host=host, port=port, user=user,
+                                                                   password=password, min_size=1,
+                                                                   max_size=pool_size),
+                                 close=lambda async_pool: async_pool.close())
+        with Instrumentation.operation(self, 'load_canonical', mode='async') as op:
+            with op.phase('connect', counter='pool_wait'):
+                conn = await pool.acquire()
+            try:
+                with op.phase('query'):
+                    records = await conn.fetch(query)
+            finally:
+                await pool.release(conn)
+            with op.phase('build'):
+                rtn_dict = {}
+                if len(records) > 0:
+                    for idx, col in enumerate(records[0].keys()):
+                        rtn_dict[col] = [record[idx] for record in records]
+            op.add(rows=len(records))
+        return rtn_dict
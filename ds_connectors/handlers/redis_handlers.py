@@ -1,11 +1,22 @@
+import asyncio
+import json
+import math
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
 import pandas as pd
 from aistac.handlers.abstract_handlers import AbstractSourceHandler, ConnectorContract, AbstractPersistHandler, \
     HandlerFactory
+from ds_connectors.handlers.registry_helpers import ConnectionRegistry
+from ds_connectors.handlers.instrument_helpers import Instrumentation
+from ds_connectors.handlers.async_helpers import AsyncHandlerMixin, loop_client, close_loop_clients
 
 __author__ = 'Johan Gielstra'
 
 
-class RedisSourceHandler(AbstractSourceHandler):
+class RedisSourceHandler(AsyncHandlerMixin, AbstractSourceHandler):
     """ A mongoDB source handler"""
 
     def __init__(self, connector_contract: ConnectorContract):
@@ -15,70 +26,345 @@ class RedisSourceHandler(AbstractSourceHandler):
         super().__init__(connector_contract)
         self._file_state = 0
         self._changed_flag = True
+        self._change_conn = None
+        self._notify_thread = None
+        self._notify_events = 0
+
+    def _connect(self, decode_responses: bool=False):
+        """ returns a client on the connection pool shared through the ConnectionRegistry by every handler with the
+        same uri. Closing the client returns its connection to the pool. The contract 'pool_size' caps the pool """
+        uri = self._redis_url()
+        max_connections = ConnectionRegistry.pool_size(self.connector_contract.kwargs.get('pool_size'))
+        key = self._pool_key(decode_responses)
+        options = {'max_connections': max_connections} if max_connections is not None else {}
+
+        def create_pool():
+            return self.redis.ConnectionPool.from_url(uri, decode_responses=decode_responses, **options)
+
+        pool = ConnectionRegistry.get(key, create_pool, close=lambda connection_pool: connection_pool.disconnect())
+        return self.redis.Redis(connection_pool=pool)
+
+    @contextmanager
+    def _connection(self, decode_responses: bool=False):
+        """ a context manager that yields a client from _connect, holding its pool as in use in the ConnectionRegistry
+        so idle eviction does not disconnect it mid command, and closes the client on exit """
+        with ConnectionRegistry.in_use(self._pool_key(decode_responses)):
+            conn = self._connect(decode_responses=decode_responses)
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+    def _pool_key(self, decode_responses: bool=False) -> tuple:
+        """ the ConnectionRegistry key of the connection pool """
+        max_connections = ConnectionRegistry.pool_size(self.connector_contract.kwargs.get('pool_size'))
+        return ConnectionRegistry.key('redis', self._redis_url(), decode_responses=decode_responses,
+                                      max_connections=max_connections)
+
+    def _params(self, uri: str=None, **kwargs) -> dict:
+        """ the handler params, the contract kwargs updated with the uri query and then any passed through the call.
+        Loads, persists and removes all read their params this way """
+        _cc = self.connector_contract
+        params = _cc.kwargs
+        params.update(_cc.parse_query(uri=uri or _cc.uri))
+        params.update(kwargs)
+        return params
+
+    def _redis_url(self) -> str:
+        """ the contract address with only the uri query options Redis understands. Handler params in the query,
+        such as 'prefix' or 'layout', are left out as the connection would reject them """
+        _cc = self.connector_contract
+        parsers = getattr(self.redis.connection, 'URL_QUERY_ARGUMENT_PARSERS', {})
+        options = {k: v for k, v in _cc.query.items() if k in parsers or k.startswith('ssl_') or k == 'client_name'}
+        return f"{_cc.address}?{urlencode(options)}" if options else _cc.address
 
     def supported_types(self) -> list:
         """ The source types supported with this module"""
         return ['redis']
 
-    def load_canonical(self, **kwargs) -> dict:
+    def load_canonical(self, **kwargs) -> [dict, pd.DataFrame]:
         """ returns the canonical dataset based on the source contract
             The canonical in this instance is a dictionary that has the headers as the key and then
-            the ordered list of values for that header
+            the ordered list of values for that header. With the columnar layout a pandas DataFrame is returned
+
+            params:
+                layout: (optional) 'hash' for a hash per row or 'columnar' for Arrow IPC row groups. Default hash
+                prefix: the key prefix of a columnar dataset
+                keys: the hash fields to return as columns. Optional with the columnar layout
+                match: (optional) the SCAN match pattern. Default '*'
+                count: (optional) the SCAN page size hint. Default 1000
+                pipeline_depth: (optional) the number of HMGET calls sent in one pipeline. Default 1000
+                scan_type: (optional) the SCAN TYPE filter, which needs Redis 6. Set to '' for older servers.
+                        Default 'HASH'
+                async_scan: (optional) if true, load with redis.asyncio, overlapping SCAN pages with concurrent
+                        pipelined fetches. Default False
+                cluster: (optional) if true, connect as a Redis Cluster and scan every primary concurrently. Implies
+                        async_scan. Default False
+                concurrency: (optional) the number of pipelined fetches in flight with async_scan. Default 4
         """
-        conn = None
         if not isinstance(self.connector_contract, ConnectorContract):
             raise ValueError("The Connector Contract is not valid")
         # this supports redis hmap only...
-        cc_params = self.connector_contract.kwargs
-        cc_params.update(kwargs)     # Update with any passed though the call
+        cc_params = self._params(**kwargs)
+        layout = str(cc_params.get('layout', 'hash')).lower()
+        with Instrumentation.operation(self, 'load_canonical', layout=layout) as op:
+            if layout == 'columnar':
+                rtn_data = self._load_columnar(prefix=cc_params.get('prefix'), keys=cc_params.get('keys'))
+                op.add(rows=rtn_data.shape[0])
+            else:
+                rtn_data = self._load_hashes(cc_params)
+                op.add(rows=len(rtn_data.get('id', [])) if isinstance(rtn_data, dict) else 0)
+        return rtn_data
+
+    async def _load_canonical_native(self, **kwargs):
+        """ loads the hashes with redis.asyncio, as async_scan does. The columnar layout falls back to the thread
+        pool """
+        if not isinstance(self.connector_contract, ConnectorContract) or not self.driver_available('redis.asyncio'):
+            return NotImplemented
+        cc_params = self._params(**kwargs)
+        if str(cc_params.get('layout', 'hash')).lower() == 'columnar':
+            return NotImplemented
+        with Instrumentation.operation(self, 'load_canonical', layout='hash', mode='async') as op:
+            rtn_dict = await self._scan_coroutine(cc_params)
+            op.add(rows=len(rtn_dict.get('id', [])))
+        return rtn_dict
+
+    def _scan_coroutine(self, cc_params: dict):
+        """ returns the _load_async coroutine for the load params, see load_canonical """
+        keys = cc_params.get('keys')
+        if not keys or len(keys) == 0:
+            raise ValueError("RedisConnector requires an array of 'keys'")
+        return self._load_async(keys=keys, match=cc_params.get('match', '*'), count=int(cc_params.get('count', 1000)),
+                                pipeline_depth=int(cc_params.get('pipeline_depth', 1000)),
+                                scan_type=cc_params.get('scan_type', 'HASH') or None,
+                                concurrency=int(cc_params.get('concurrency', 4)),
+                                cluster=str(cc_params.get('cluster', False)).lower() == 'true')
 
+    def _load_hashes(self, cc_params: dict) -> dict:
+        """ scans the hashes and fetches the 'keys' fields of each with pipelined HMGET calls, see load_canonical """
         match = cc_params.get('match', '*')
-        count = cc_params.get('count', 1000)
+        count = int(cc_params.get('count', 1000))
         keys = cc_params.get('keys')
+        pipeline_depth = int(cc_params.get('pipeline_depth', 1000))
+        scan_type = cc_params.get('scan_type', 'HASH') or None
         if not keys or len(keys) == 0:
             raise ValueError("RedisConnector requires an array of 'keys'")
-        try:
-            conn = self.redis.from_url(self.connector_contract.uri)
+        cluster = str(cc_params.get('cluster', False)).lower() == 'true'
+        if cluster or str(cc_params.get('async_scan', False)).lower() == 'true':
+            return self._run_coroutine(self._scan_coroutine(cc_params))
+        op = Instrumentation.current()
+        with self._connection(decode_responses=True) as conn:
+            """
+            {
+                "col1" = [1,2,3],
+                "col2" = ["a","b","c"]
+            }
+            """
             rtn_dict = {'id': []}
-            for rowkey in conn.scan_iter(match, count):
-                """
-                {
-                    "col1" = [1,2,3],
-                    "col2" = ["a","b","c"]
-                }
-                """
-                rowdata = conn.hgetall(rowkey)
-                rtn_dict.get('id').append(rowkey.decode())
-                for colkey in keys:
-                    if colkey not in rtn_dict:
-                        rtn_dict[colkey] = []
-                    raw_col_val = rowdata.get(str.encode(colkey))
-                    if raw_col_val:
-                        col_val = raw_col_val.decode()
-                    else:
-                        col_val = None
-                    rtn_dict.get(colkey).append(col_val)
-            conn.close()
+            for colkey in keys:
+                rtn_dict.setdefault(colkey, [])
+            batch = []
+            for rowkey in conn.scan_iter(match=match, count=count, _type=scan_type):
+                if scan_type is None and self._reserved_key(rowkey):
+                    continue
+                batch.append(rowkey)
+                if len(batch) >= pipeline_depth:
+                    with op.phase('fetch'):
+                        self._fetch_rows(conn, batch, keys, rtn_dict)
+                    batch = []
+            if len(batch) > 0:
+                with op.phase('fetch'):
+                    self._fetch_rows(conn, batch, keys, rtn_dict)
             return rtn_dict
-        except Exception as error:
-            print(error)
+
+    async def _load_async(self, keys: list, match: str, count: int, pipeline_depth: int, scan_type: str,
+                          concurrency: int, cluster: bool) -> dict:
+        """ scans every primary node, or the single server, concurrently, queueing the keys in batches of
+        pipeline_depth that a pool of concurrency fetchers read with pipelined HMGET calls as the scan continues.
+        If a scan or fetch fails the others are cancelled and the error raised """
+        aioredis = HandlerFactory.get_module('redis.asyncio')
+        uri = self._redis_url()
+
+        async def create_client():
+            if not cluster:
+                return aioredis.from_url(uri, decode_responses=True)
+            cluster_client = aioredis.RedisCluster.from_url(uri, decode_responses=True)
+            await cluster_client.initialize()
+            return cluster_client
+
+        async def close(async_client):
+            await (async_client.aclose() if hasattr(async_client, 'aclose') else async_client.close())
+
+        client = await loop_client(ConnectionRegistry.key('redis_async', uri, cluster=cluster), create_client,
+                                   close=close)
+        nodes = client.get_primaries() if cluster else [None]
+        concurrency = max(1, concurrency)
+        queue = asyncio.Queue(maxsize=concurrency * 2)
+        results = []
+
+        async def scan(node):
+            cursor = 0
+            batch = []
+            while True:
+                if node is None:
+                    cursor, page = await client.scan(cursor, match=match, count=count, _type=scan_type)
+                else:
+                    cursors, page = await client.scan(cursor, match=match, count=count, _type=scan_type,
+                                                      target_nodes=node)
+                    cursor = cursors[node.name]
+                batch.extend(page if scan_type is not None else [k for k in page if not self._reserved_key(k)])
+                while len(batch) >= pipeline_depth:
+                    await queue.put(batch[:pipeline_depth])
+                    batch = batch[pipeline_depth:]
+                if int(cursor) == 0:
+                    break
+            if len(batch) > 0:
+                await queue.put(batch)
+
+        async def fetch():
+            while True:
+                rowkeys = await queue.get()
+                if rowkeys is None:
+                    return
+                pipe = client.pipeline(transaction=False)
+                for rowkey in rowkeys:
+                    pipe.hmget(rowkey, keys)
+                results.append((rowkeys, await pipe.execute()))
+
+        async def finish():
+            await asyncio.gather(*scanners)
+            for _ in fetchers:
+                await queue.put(None)
+
+        scanners = [asyncio.ensure_future(scan(node)) for node in nodes]
+        fetchers = [asyncio.ensure_future(fetch()) for _ in range(concurrency)]
+        tasks = scanners + fetchers + [asyncio.ensure_future(finish())]
+        try:
+            # the first failure ends the load, as a scan blocked on the bounded queue would wait on dead fetchers
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            failed = [task for task in done if not task.cancelled() and task.exception() is not None]
+            if len(failed) > 0:
+                raise failed[0].exception()
         finally:
-            if conn is not None:
-                conn.close()
-                print('Database connection closed.')
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        rtn_dict = {'id': []}
+        for colkey in keys:
+            rtn_dict.setdefault(colkey, [])
+        for rowkeys, rows in results:
+            self._extend_columns(rowkeys, rows, keys, rtn_dict)
+        return rtn_dict
+
+    @staticmethod
+    def _run_coroutine(coroutine):
+        """ runs the coroutine to completion on a new event loop, on a separate thread if this thread already has a
+        running loop. The loop's native clients are closed before it is """
+        async def run():
+            try:
+                return await coroutine
+            finally:
+                await close_loop_clients()
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(run())
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, run()).result()
+
+    @staticmethod
+    def _reserved_key(key: str) -> bool:
+        """ if the key is a version, manifest or columnar row group key rather than a row hash. These are skipped by
+        the hash scan when the SCAN TYPE filter is off """
+        return key.endswith((':version', ':manifest')) or ':rg:' in key
+
+    @classmethod
+    def _fetch_rows(cls, conn, rowkeys: list, keys: list, rtn_dict: dict):
+        """ fetches the requested fields of a batch of hashes with one pipeline of HMGET calls and appends them to
+        the columns. Missing or empty values are returned as None """
+        pipe = conn.pipeline(transaction=False)
+        for rowkey in rowkeys:
+            pipe.hmget(rowkey, keys)
+        cls._extend_columns(rowkeys, pipe.execute(), keys, rtn_dict)
+
+    @staticmethod
+    def _extend_columns(rowkeys: list, rows: list, keys: list, rtn_dict: dict):
+        """ appends a batch of HMGET rows to the columns. Missing or empty values are returned as None """
+        rtn_dict.get('id').extend(rowkeys)
+        for index, colkey in enumerate(keys):
+            rtn_dict.get(colkey).extend([row[index] or None for row in rows])
+
+    def _load_columnar(self, prefix: str, keys: list=None) -> pd.DataFrame:
+        """ reads the manifest and fetches every row group with one MGET, building the DataFrame from the Arrow
+        IPC buffers with as few copies as possible """
+        if prefix is None:
+            raise ValueError("The columnar layout requires a `prefix` to be provided")
+        pa = HandlerFactory.get_module('pyarrow')
+        op = Instrumentation.current()
+        with self._connection() as conn:
+            with op.phase('fetch'):
+                manifest = conn.get(f'{prefix}:manifest')
+                if manifest is None:
+                    return pd.DataFrame()
+                manifest = json.loads(manifest)
+                blobs = conn.mget(self.columnar_keys(prefix, manifest))
+        if any(blob is None for blob in blobs):
+            raise ConnectionError(f"The columnar dataset '{prefix}' is incomplete, a row group has expired or been "
+                                  f"removed")
+        op.add(bytes=sum(len(blob) for blob in blobs))
+        with op.phase('decode'):
+            table = pa.concat_tables([pa.ipc.open_stream(pa.py_buffer(blob)).read_all() for blob in blobs])
+        if keys:
+            table = table.select(keys)
+        with op.phase('build'):
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+
+    @staticmethod
+    def columnar_keys(prefix: str, manifest: dict) -> list:
+        """ the row group keys of a columnar dataset manifest """
+        generation = manifest.get('generation')
+        return [f'{prefix}:rg:{generation}:{index}' for index in range(manifest.get('row_groups', 0))]
 
     def exists(self) -> bool:
         return True
 
     def has_changed(self) -> bool:
-        """ returns if the file has been modified"""
-        # TODO: Add in change logic here
-        state = None
+        """ returns if the dataset under the contract `prefix` has changed. RedisPersistHandler sets the
+        '<prefix>:version' key to a new token on every write, and removes it with the dataset, so this is answered
+        with a single GET. With the param
+        change_detection='notify' a keyspace notification subscription keeps a local count of events instead, and
+        no round trip is made. This needs 'notify-keyspace-events' to include 'K' and 'A' on the server"""
+        params = self._params()
+        prefix = params.get('prefix')
+        if prefix is None:
+            state = None
+        elif str(params.get('change_detection', 'version')).lower() == 'notify':
+            self._subscribe_notifications(prefix)
+            state = 'notify', self._notify_events
+        else:
+            if self._change_conn is None:
+                self._change_conn = self._connect()
+            state = self._change_conn.get(f'{prefix}:version')
         if state != self._file_state:
             self._changed_flag = True
             self._file_state = state
         return self._changed_flag
 
+    def _subscribe_notifications(self, prefix: str):
+        """ subscribes, on a background thread, to the keyspace events of the keys under the prefix """
+        if self._notify_thread is not None and self._notify_thread.is_alive():
+            return
+        conn = self._connect()
+        db = conn.connection_pool.connection_kwargs.get('db', 0)
+
+        def on_event(message):
+            self._notify_events += 1
+
+        pubsub = conn.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(**{f'__keyspace@{db}__:{prefix}[.:]*': on_event})
+        self._notify_thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
     def reset_changed(self, changed: bool = False):
         """ manual reset to say the file has been seen. This is automatically called if the file is loaded"""
         changed = changed if isinstance(changed, bool) else False
@@ -93,39 +379,161 @@ class RedisPersistHandler(RedisSourceHandler, AbstractPersistHandler):
         return self.backup_canonical(canonical=canonical, uri=self.connector_contract.uri, **kwargs)
 
     def remove_canonical(self) -> bool:
+        """ removes the hashes persisted under the contract `prefix`. See remove_prefix """
         if not isinstance(self.connector_contract, ConnectorContract):
             return False
-        _cc = self.connector_contract
-        raise NotImplementedError("remove_canonical for RedisPersistHandler not yet implemented.")
+        params = self._params()
+        hashprefix = params.get('prefix')
+        if hashprefix is None:
+            raise ValueError("RedisPersistHandler requires a `prefix` to be provided")
+        self.remove_prefix(prefix=hashprefix, count=params.get('count'), batch_size=params.get('batch_size'),
+                           pipeline_depth=params.get('pipeline_depth'))
+        return True
+
+    def remove_prefix(self, prefix: str, count: int=None, batch_size: int=None, pipeline_depth: int=None) -> int:
+        """ removes every '<prefix>.*' hash and any columnar dataset stored under the prefix. The keys are found
+        with SCAN in large COUNT pages and deleted with UNLINK, which frees the memory off the Redis main thread,
+        several UNLINK batches to a pipeline. The version key is removed too. Returns the number of dataset keys
+        removed
+
+        :param prefix: the key prefix
+        :param count: (optional) the SCAN page size hint. Default 10,000
+        :param batch_size: (optional) the number of keys per UNLINK. Default 1,000
+        :param pipeline_depth: (optional) the number of UNLINK calls sent in one pipeline. Default 10
+        :return: the number of dataset keys removed
+        """
+        count = int(count) if count else 10_000
+        batch_size = int(batch_size) if batch_size else 1_000
+        pipeline_depth = int(pipeline_depth) if pipeline_depth else 10
+        removed = 0
+        with self._connection() as conn:
+            pending = [f'{prefix}:manifest']
+            for match in [f'{prefix}.*', f'{prefix}:rg:*']:
+                for key in conn.scan_iter(match=match, count=count):
+                    pending.append(key)
+                    if len(pending) >= batch_size * pipeline_depth:
+                        removed += self._unlink(conn, pending, batch_size)
+                        pending = []
+            if len(pending) > 0:
+                removed += self._unlink(conn, pending, batch_size)
+            conn.unlink(f'{prefix}:version')
+        return removed
+
+    @staticmethod
+    def _unlink(conn, keys: list, batch_size: int) -> int:
+        """ unlinks the keys in batches sent as one pipeline, returning the number removed """
+        pipe = conn.pipeline(transaction=False)
+        for start in range(0, len(keys), batch_size):
+            pipe.unlink(*keys[start:start + batch_size])
+        return sum(pipe.execute())
 
     def backup_canonical(self, canonical: pd.DataFrame, uri: str, **kwargs) -> bool:
-        """ creates a backup of the canonical to an alternative URI  """
+        """ creates a backup of the canonical to an alternative URI. Each row is written as a hash with HSET, in
+        batches sent as non-transactional pipelines. The '<prefix>:version' token is renewed after every write
+
+            params:
+                prefix: the key prefix, each row being stored as the hash '<prefix>.<id>'
+                idFieldName: (optional) the column used as the id. Default the row position
+                batch_size: (optional) the number of rows written per pipeline. Default 10,000
+                ttl: (optional) the seconds before each hash expires, set in the same pipeline
+                layout: (optional) 'hash' or 'columnar'. The columnar layout stores the frame as Arrow IPC row
+                        groups under '<prefix>:rg:<generation>:<n>' with a '<prefix>:manifest' key. Default hash
+                row_group_size: (optional) the rows per columnar row group. Default 100,000
+                compression: (optional) the columnar Arrow IPC compression, 'lz4' or 'zstd'. Default none
+        """
         if not isinstance(self.connector_contract, ConnectorContract):
             return False
-        _cc = self.connector_contract
-        persist_params = kwargs if isinstance(kwargs, dict) else _cc.kwargs
-        persist_params.update(_cc.parse_query(uri=uri))
+        persist_params = self._params(uri=uri, **kwargs)
         hashprefix = persist_params.get('prefix')
         if hashprefix is None:
             raise ValueError("RedisPersistHandler requires a `prefix` to be provided")
         # use `ifFieldName` to upsert records otherwise assume id is the index of the record in the data frame
         id_field_name = persist_params.get('idFieldName')
-        use_index_for_id = False
-        to_dict_kwargs = {"orient": "records"}
+        batch_size = int(persist_params.get('batch_size', 10_000))
+        ttl = int(persist_params['ttl']) if persist_params.get('ttl') else None
+        layout = str(persist_params.get('layout', 'hash')).lower()
+        with Instrumentation.operation(self, 'persist_canonical', layout=layout) as op:
+            if layout == 'columnar':
+                rtn_value = self._persist_columnar(canonical, prefix=hashprefix, ttl=ttl,
+                                                   row_group_size=int(persist_params.get('row_group_size', 100_000)),
+                                                   compression=persist_params.get('compression'))
+            else:
+                rtn_value = self._persist_hashes(canonical, prefix=hashprefix, id_field_name=id_field_name,
+                                                 batch_size=batch_size, ttl=ttl)
+            op.add(rows=canonical.shape[0])
+        return rtn_value
+
+    def _persist_hashes(self, canonical: pd.DataFrame, prefix: str, id_field_name: str=None, batch_size: int=None,
+                        ttl: int=None) -> bool:
+        """ writes each row as the hash '<prefix>.<id>' in batch_size pipelines, then renews the version """
+        op = Instrumentation.current()
         if id_field_name is None:
-            use_index_for_id = True
-        if hashprefix is None:
-            raise ValueError("RedisPersistHandler requires a `prefix` to be provided")
-        conn = self.redis.from_url(self.connector_contract.uri)
-        # TODO if persist_params.get("ordered") is None:
-        # ` ordered=persist_params.get("ordered")` is this needed ?
+            ids = pd.Series(range(canonical.shape[0])).astype(str)
+        else:
+            ids = canonical[id_field_name].astype(str).reset_index(drop=True)
+        rowkeys = (f'{prefix}.' + ids).tolist()
         count = 0
-        records = canonical.to_dict(**to_dict_kwargs)
-        for rec in records:
-            if use_index_for_id:
-                idx = count
-            else:
-                idx = rec[id_field_name]
-            conn.hmset(f'{hashprefix}.{idx}', rec)
-            count = count+1
+        with self._connection() as conn:
+            for start in range(0, canonical.shape[0], batch_size):
+                with op.phase('encode'):
+                    records = canonical.iloc[start:start + batch_size].to_dict(orient='records')
+                    pipe = conn.pipeline(transaction=False)
+                    for rowkey, rec in zip(rowkeys[start:start + batch_size], records):
+                        mapping = self._hash_mapping(rec)
+                        if len(mapping) > 0:
+                            pipe.hset(rowkey, mapping=mapping)
+                        if ttl is not None:
+                            pipe.expire(rowkey, ttl)
+                with op.phase('write'):
+                    pipe.execute()
+                count += len(records)
+            conn.set(f'{prefix}:version', uuid.uuid4().hex)
         return count == canonical.shape[0]
+
+    def _persist_columnar(self, canonical: pd.DataFrame, prefix: str, ttl: int=None, row_group_size: int=None,
+                          compression: str=None) -> bool:
+        """ writes the canonical as Arrow IPC row groups under a new generation in one pipeline, then swaps the
+        manifest to the new generation and unlinks the previous one, so readers never see a partial dataset """
+        pa = HandlerFactory.get_module('pyarrow')
+        op = Instrumentation.current()
+        table = pa.Table.from_pandas(canonical, preserve_index=False)
+        options = pa.ipc.IpcWriteOptions(compression=compression) if compression else None
+        batches = table.to_batches(max_chunksize=row_group_size) or [None]
+        generation = uuid.uuid4().hex[:12]
+        manifest = {'format': 'arrow_ipc', 'generation': generation, 'row_groups': len(batches),
+                    'rows': table.num_rows, 'columns': table.column_names}
+        with self._connection() as conn:
+            pipe = conn.pipeline(transaction=False)
+            with op.phase('encode'):
+                for key, batch in zip(self.columnar_keys(prefix, manifest), batches):
+                    sink = pa.BufferOutputStream()
+                    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+                        if batch is not None:
+                            writer.write_batch(batch)
+                    blob = sink.getvalue().to_pybytes()
+                    op.add(bytes=len(blob))
+                    pipe.set(key, blob, ex=ttl)
+            with op.phase('write'):
+                pipe.execute()
+            previous = conn.getset(f'{prefix}:manifest', json.dumps(manifest))
+            if ttl is not None:
+                conn.expire(f'{prefix}:manifest', ttl)
+            conn.set(f'{prefix}:version', uuid.uuid4().hex)
+            if previous is not None:
+                stale = self.columnar_keys(prefix, json.loads(previous))
+                if len(stale) > 0:
+                    self._unlink(conn, stale, 1_000)
+        return True
+
+    @staticmethod
+    def _hash_mapping(record: dict) -> dict:
+        """ the hash fields of a record. Null values are left out, as they are read back as None, and values that
+        are not str, bytes, int or float are stored as their string """
+        mapping = {}
+        for key, value in record.items():
+            if value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and math.isnan(value)):
+                continue
+            if isinstance(value, bool) or not isinstance(value, (str, bytes, int, float)):
+                value = str(value)
+            mapping[key] = value
+        return mapping
@@ -0,0 +1,243 @@
+import atexit
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qsl
+
+__author__ = 'Darryl Oatridge'
+
+
+class _RegistryEntry(object):
+    __slots__ = ('resource', 'close', 'last_used')
+
+    def __init__(self, resource, close=None):
+        self.resource = resource
+        self.close = close
+        self.last_used = time.monotonic()
+
+
+class ConnectionRegistry(object):
+    """ A process wide registry of the shared, thread safe connection pools and clients used by the handlers, keyed
+    by the normalised identity of the connection. Handlers get their pool or client from the registry each time
+    they use it, so every contract against the same database shares one pool and connection setup happens once per
+    process rather than once per handler.
+
+    Entries idle for longer than max_idle seconds are closed when the registry is next used, or by evict_idle(),
+    and are created again on their next use. An entry is created outside the registry lock, so a slow connect only
+    holds up the threads getting the same key, which then share the one entry. An entry checked out with in_use() or
+    checkout() is never idle, so a pool held through a long load is not closed under it by another thread. A forked
+    child starts with an empty registry, leaving the parent's sockets to the parent, and every entry is closed on
+    interpreter shutdown.
+    """
+
+    _entries = {}
+    _in_use = {}
+    _creating = {}
+    _lock = threading.RLock()
+    _pid = os.getpid()
+    _max_idle = None
+    _pool_size = None
+    _SECRETS = ('password', 'token', 'secret')
+
+    @classmethod
+    def configure(cls, pool_size: int=None, max_idle: float=None):
+        """ sets the process wide defaults
+
+        :param pool_size: the pool size used where a contract does not set a 'pool_size'
+        :param max_idle: the seconds an entry can go unused before it is closed. 0 turns idle eviction off, the default
+        """
+        with cls._lock:
+            if isinstance(pool_size, int):
+                cls._pool_size = pool_size if pool_size > 0 else None
+            if isinstance(max_idle, (int, float)):
+                cls._max_idle = max_idle if max_idle > 0 else None
+
+    @classmethod
+    def pool_size(cls, value=None, default: int=None):
+        """ returns value, typically a contract 'pool_size', as an int if set, else the configured pool size, else
+        default """
+        if value is not None and str(value).isdigit():
+            return int(value)
+        return cls._pool_size if cls._pool_size is not None else default
+
+    @classmethod
+    def key(cls, kind: str, address: str=None, **options) -> tuple:
+        """ returns the normalised identity of a connection. The scheme and host are lower cased, query parameters
+        and options sorted, and passwords, tokens and secrets replaced by their sha256 digest so they are never
+        held in the key
+
+        :param kind: the kind of pool or client, such as 'mysql'
+        :param address: (optional) a connection URI
+        :param options: any other settings that distinguish the connection
+        :return: a hashable tuple
+        """
+        parts = urlsplit(address or '')
+        userinfo, _, host = parts.netloc.rpartition('@')
+        user, _, password = userinfo.partition(':')
+        query = tuple(sorted(parse_qsl(parts.query)))
+        settings = tuple(sorted((name, cls._digest(value) if name in cls._SECRETS else repr(value))
+                                for name, value in options.items()))
+        return (kind, parts.scheme.lower(), host.lower(), user, cls._digest(password), parts.path.rstrip('/'),
+                query, settings)
+
+    @classmethod
+    def get(cls, key: tuple, factory, close=None):
+        """ returns the registered resource for key, calling factory to create and register it if there is none
+
+        :param key: the connection identity, see key()
+        :param factory: a zero argument callable that returns a new pool or client
+        :param close: (optional) a callable passed the resource to close it when evicted
+        :return: the shared pool or client
+        """
+        while True:
+            with cls._lock:
+                cls._check_fork()
+                cls._evict_idle()
+                entry = cls._entries.get(key)
+                if entry is not None:
+                    entry.last_used = time.monotonic()
+                    return entry.resource
+                creating = cls._creating.get(key)
+                if creating is None:
+                    creating = cls._creating[key] = threading.Event()
+                    break
+            # another thread is creating the entry, so wait on it rather than connect twice
+            creating.wait()
+        # the factory runs outside the lock, as a slow connect would otherwise hold up every other key
+        try:
+            resource = factory()
+        except BaseException:
+            cls._created(key, creating)
+            raise
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is None:
+                entry = cls._entries[key] = _RegistryEntry(resource, close)
+            entry.last_used = time.monotonic()
+        cls._created(key, creating)
+        if entry.resource is not resource:
+            # an entry registered while the factory ran is kept, and this one closed
+            cls._close(_RegistryEntry(resource, close))
+        return entry.resource
+
+    @classmethod
+    @contextmanager
+    def in_use(cls, key: tuple):
+        """ a context manager that checks out the resource for key for the duration of the block, see checkout()
+
+        :param key: the connection identity, see key()
+        """
+        cls.checkout(key)
+        try:
+            yield
+        finally:
+            cls.checkin(key)
+
+    @classmethod
+    def checkout(cls, key: tuple):
+        """ marks the resource for key as in use, so idle eviction passes it over until a matching checkin(). Use
+        in_use() where the use fits in a block """
+        with cls._lock:
+            cls._check_fork()
+            cls._in_use[key] = cls._in_use.get(key, 0) + 1
+
+    @classmethod
+    def checkin(cls, key: tuple):
+        """ ends a checkout() of the resource for key, counting it as the resource's last use """
+        with cls._lock:
+            count = cls._in_use.pop(key, 0) - 1
+            if count > 0:
+                cls._in_use[key] = count
+            entry = cls._entries.get(key)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+
+    @classmethod
+    def register(cls, key: tuple, resource, close=None):
+        """ registers a resource for key, closing any resource it replaces """
+        with cls._lock:
+            cls._check_fork()
+            previous = cls._entries.pop(key, None)
+            cls._entries[key] = _RegistryEntry(resource, close)
+        if previous is not None and previous.resource is not resource:
+            cls._close(previous)
+
+    @classmethod
+    def evict(cls, key: tuple) -> bool:
+        """ closes and removes the resource for key, returning True if there was one """
+        with cls._lock:
+            entry = cls._entries.pop(key, None)
+        if entry is None:
+            return False
+        cls._close(entry)
+        return True
+
+    @classmethod
+    def evict_idle(cls, max_idle: float=None) -> int:
+        """ closes and removes the resources unused for max_idle seconds, by default the configured max_idle,
+        returning how many were closed """
+        with cls._lock:
+            return cls._evict_idle(max_idle)
+
+    @classmethod
+    def close_all(cls):
+        """ closes and removes every registered resource """
+        with cls._lock:
+            entries = list(cls._entries.values())
+            cls._entries.clear()
+        for entry in entries:
+            cls._close(entry)
+
+    @classmethod
+    def _evict_idle(cls, max_idle: float=None) -> int:
+        max_idle = max_idle if isinstance(max_idle, (int, float)) else cls._max_idle
+        if max_idle is None:
+            return 0
+        cutoff = time.monotonic() - max_idle
+        idle = [key for key, entry in cls._entries.items()
+                if entry.last_used < cutoff and not cls._in_use.get(key)]
+        for key in idle:
+            cls._close(cls._entries.pop(key))
+        return len(idle)
+
+    @classmethod
+    def _created(cls, key: tuple, creating: threading.Event):
+        """ ends the creation guarded by creating, waking the threads waiting on it """
+        with cls._lock:
+            if cls._creating.get(key) is creating:
+                del cls._creating[key]
+        creating.set()
+
+    @classmethod
+    def _check_fork(cls):
+        if cls._pid != os.getpid():
+            cls._reset_after_fork()
+
+    @classmethod
+    def _reset_after_fork(cls):
+        """ drops, without closing, the entries inherited from the parent, whose sockets the parent still uses """
+        cls._entries = {}
+        cls._in_use = {}
+        cls._creating = {}
+        cls._lock = threading.RLock()
+        cls._pid = os.getpid()
+
+    @staticmethod
+    def _close(entry: _RegistryEntry):
+        if entry.close is None:
+            return
+        try:
+            entry.close(entry.resource)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _digest(value) -> str:
+        return hashlib.sha256(str(value).encode()).hexdigest() if value else ''
+
+
+atexit.register(ConnectionRegistry.close_all)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=ConnectionRegistry._reset_after_fork)
@@ -1,5 +1,17 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from io import StringIO
+from itertools import islice
+from typing import Union, BinaryIO
+import bz2
 import csv
+import gzip
+import io
+import lzma
+import os
+import numpy as np
+import pandas as pd
+from ds_connectors.parsers import dsv_helpers
 
 __author__ = 'Darryl Oatridge'
 
@@ -7,12 +19,14 @@ __author__ = 'Darryl Oatridge'
 class DelimitedParser(object):
 
     @staticmethod
-    def read_dsv(file_stream: StringIO, fieldnames=None, restkey=None, restval=None, dialect=None, delimiter=None,
-                 quotechar=None, escapechar=None, doublequote=None, skipinitialspace=None, lineterminator=None,
-                 quoting=None) -> dict:
+    def read_dsv(file_stream: Union[StringIO, str, BinaryIO], fieldnames=None, restkey=None, restval=None,
+                 dialect=None, delimiter=None, quotechar=None, escapechar=None, doublequote=None,
+                 skipinitialspace=None, lineterminator=None, quoting=None, typed: bool=None, block_size: int=None,
+                 encoding: str=None, sample_size: int=None, category_ratio: float=None) -> dict:
         """ reads an StringIO stream and returns a dictionary of the delimited file. (see python csv documentation)
 
-        :param file_stream: a String IO file stream to parse
+        :param file_stream: a String IO file stream to parse, or a file path or binary stream. Files are read through
+                    mmap and decoded incrementally rather than loaded whole
         :param fieldnames: a set of field names for the dictionary if no header
         :param restkey: If row has more fields than fieldnames, remaining data is put in a list under restkey
         :param restval: If non-blank row has fewer fields than fieldnames, values are filled-in with restval
@@ -28,33 +42,267 @@ class DelimitedParser(object):
         :param skipinitialspace: When True, whitespace immediately following the delimiter is ignored. Default False
         :param lineterminator: The string used to terminate lines produced by the writer.
         :param quoting: Controls when quotes should be generated by the writer and recognised by the reader
+        :param typed: if True, each column is returned as a numpy masked array of int64, float64, bool, datetime64
+                    or str, with empty and missing values masked, or as a pandas Categorical for low cardinality str.
+                    Types are inferred from a sample and each block is converted as it is read. By default a list of
+                    str per column is returned
+        :param block_size: the number of rows tokenized at a time. Default 65,536
+        :param encoding: the encoding of a file path or binary stream. Default 'utf-8'
+        :param sample_size: the number of rows the column types are inferred from when typed. Default 10,000
+        :param category_ratio: str columns with no more distinct values than this fraction of the sample are
+                    dictionary encoded as a Categorical when typed. Default 0.5, 0 disabling it
         :return: dict
         """
-        # params
-        fieldnames = fieldnames if isinstance(fieldnames, str) else None
+        encoding = encoding if isinstance(encoding, str) else 'utf-8'
+        dialect, fmtparams = DelimitedParser._dialect(dialect=dialect, delimiter=delimiter, quotechar=quotechar,
+                                                      escapechar=escapechar, doublequote=doublequote,
+                                                      skipinitialspace=skipinitialspace,
+                                                      lineterminator=lineterminator, quoting=quoting)
+        with dsv_helpers.source_text(file_stream, encoding=encoding) as text:
+            reader = csv.reader(text, dialect, **fmtparams)
+            return DelimitedParser._read_columns(reader, fieldnames=fieldnames, restkey=restkey, restval=restval,
+                                                 typed=typed, block_size=block_size, sample_size=sample_size,
+                                                 category_ratio=category_ratio)
+
+    @staticmethod
+    def read_dsv_chunks(file_stream: Union[StringIO, str, BinaryIO], chunk_size: int=None, as_frame: bool=None,
+                        fieldnames=None, restkey=None, restval=None, dialect=None, delimiter=None, quotechar=None,
+                        escapechar=None, doublequote=None, skipinitialspace=None, lineterminator=None, quoting=None,
+                        typed: bool=None, block_size: int=None, encoding: str=None, sample_size: int=None,
+                        category_ratio: float=None):
+        """ a generator that reads a delimited file chunk_size rows at a time, yielding each chunk as a dictionary
+        as returned by read_dsv, or as a DataFrame, so files of any size are parsed in constant memory.
+
+        :param file_stream: a String IO file stream, a file path or a binary stream
+        :param chunk_size: the number of rows in each chunk. Default 100,000
+        :param as_frame: if True, each chunk is yielded as a pandas DataFrame. Default False
+        (see read_dsv for the other parameters. When typed, the types inferred for the first chunk are kept for all)
+        :return: a generator of dict or DataFrame
+        """
+        chunk_size = chunk_size if isinstance(chunk_size, int) and chunk_size > 0 else 100_000
+        as_frame = as_frame if isinstance(as_frame, bool) else False
+        encoding = encoding if isinstance(encoding, str) else 'utf-8'
+        fieldnames = list(fieldnames) if isinstance(fieldnames, (str, list, tuple)) else None
+        restkey = restkey if isinstance(restkey, str) else None
+        restval = restval if isinstance(restval, str) else None
+        typed = typed if isinstance(typed, bool) else False
+        block_size = min(block_size, chunk_size) if isinstance(block_size, int) and block_size > 0 else chunk_size
+        dialect, fmtparams = DelimitedParser._dialect(dialect=dialect, delimiter=delimiter, quotechar=quotechar,
+                                                      escapechar=escapechar, doublequote=doublequote,
+                                                      skipinitialspace=skipinitialspace,
+                                                      lineterminator=lineterminator, quoting=quoting)
+        fill = '' if typed and restval is None else restval
+        with dsv_helpers.source_text(file_stream, encoding=encoding) as text:
+            reader = csv.reader(text, dialect, **fmtparams)
+            if fieldnames is None:
+                fieldnames = next(reader, None)
+                if fieldnames is None:
+                    return
+            rows = filter(None, reader)
+            kinds = None
+            while True:
+                columns, surplus = dsv_helpers.tokenize_columns(islice(rows, chunk_size), len(fieldnames),
+                                                                restval=fill, block_size=block_size, typed=typed,
+                                                                kinds=kinds, sample_size=sample_size,
+                                                                category_ratio=category_ratio)
+                if typed:
+                    kinds = [column.kind for column in columns]
+                chunk = DelimitedParser._assemble(fieldnames, columns, surplus, restkey=restkey, typed=typed)
+                if len(chunk) == 0:
+                    return
+                yield pd.DataFrame(chunk) if as_frame else chunk
+
+    @staticmethod
+    def read_dsv_parallel(source, processes: int=None, fieldnames=None, restkey=None, restval=None, dialect=None,
+                          delimiter=None, quotechar=None, escapechar=None, doublequote=None, skipinitialspace=None,
+                          lineterminator=None, quoting=None, typed: bool=None, block_size: int=None,
+                          encoding: str=None, min_size: int=None, sample_size: int=None,
+                          category_ratio: float=None) -> dict:
+        """ reads a delimited file across a pool of processes, returning the same dictionary as read_dsv. The file is
+        split into byte ranges at record boundaries, allowing for quoted fields holding newlines, each range is
+        tokenized in a worker process and the columns are joined in order. Files are memory mapped so workers read
+        their own range. When typed, the types are inferred from a sample here and the workers convert their own
+        columns, so only typed arrays are passed back. Files smaller than one range, or using an escapechar or
+        doublequote=False, where record boundaries can't be found by counting quotes, are read in this process.
+
+        :param source: a file path, bytes, or a binary or text stream
+        :param processes: the number of worker processes. Default os.cpu_count()
+        :param encoding: the file encoding, which must be ASCII compatible. Default 'utf-8'
+        :param min_size: the smallest byte range passed to a worker. Default 1MB
+        (see read_dsv for the other parameters)
+        :return: dict
+        """
+        processes = processes if isinstance(processes, int) and processes > 0 else os.cpu_count() or 1
+        encoding = encoding if isinstance(encoding, str) else 'utf-8'
+        fieldnames = list(fieldnames) if isinstance(fieldnames, (str, list, tuple)) else None
         restkey = restkey if isinstance(restkey, str) else None
         restval = restval if isinstance(restval, str) else None
-        dialect = dialect if isinstance(dialect, str) else csv.unix_dialect
-        # dialect
-        if isinstance(delimiter, str):
-            dialect.delimiter = delimiter
-        if isinstance(escapechar, str):
-            dialect.escapechar = escapechar
-        if isinstance(doublequote, str):
-            dialect.doublequote = doublequote
-        if isinstance(skipinitialspace, str):
-            dialect.skipinitialspace = skipinitialspace
-        if isinstance(lineterminator, str):
-            dialect.lineterminator = lineterminator
-        if isinstance(quotechar, str):
-            dialect.quotechar = quotechar
-        if isinstance(quoting, str):
-            dialect.quoting = quoting
-        reader = csv.DictReader(file_stream, fieldnames=fieldnames, restkey=restkey, restval=restval, dialect=dialect)
+        typed = typed if isinstance(typed, bool) else False
+        dialect, fmtparams = DelimitedParser._dialect(dialect=dialect, delimiter=delimiter, quotechar=quotechar,
+                                                      escapechar=escapechar, doublequote=doublequote,
+                                                      skipinitialspace=skipinitialspace,
+                                                      lineterminator=lineterminator, quoting=quoting)
+        resolved = csv.reader([], dialect, **fmtparams).dialect
+        if resolved.quoting == csv.QUOTE_NONE:
+            quote = None
+        elif resolved.escapechar is None and resolved.doublequote:
+            quote = resolved.quotechar
+        else:
+            processes = 1
+            quote = None
+        fill = '' if typed and restval is None else restval
+        with dsv_helpers.source_bytes(source, encoding=encoding) as data:
+            start = 0
+            if fieldnames is None:
+                fieldnames, start = dsv_helpers.read_header(data, encoding, dialect, fmtparams)
+                if fieldnames is None:
+                    return {}
+            ranges = dsv_helpers.record_ranges(data, start, processes, quotechar=quote, min_size=min_size)
+            path = os.fspath(source) if isinstance(source, (str, os.PathLike)) else None
+            width = len(fieldnames)
+            kinds = None
+            if typed:
+                sample_size = sample_size if isinstance(sample_size, int) and sample_size > 0 else None
+                sample, _ = dsv_helpers.read_records(data, start, encoding, dialect, fmtparams,
+                                                     count=sample_size or dsv_helpers.SAMPLE_SIZE)
+                block = next(dsv_helpers.reader_blocks(iter(sample), width, restval=fill), ([[]] * width, None))[0]
+                kinds = [dsv_helpers.infer_kind(values, category_ratio=category_ratio) for values in block]
+            options = dict(restval=fill, block_size=block_size, typed=typed, kinds=kinds,
+                           category_ratio=category_ratio)
+            if len(ranges) == 1:
+                parts = [dsv_helpers.parse_range(data, start, len(data), encoding, dialect, fmtparams, width,
+                                                 **options)]
+            else:
+                with ProcessPoolExecutor(max_workers=min(processes, len(ranges))) as executor:
+                    futures = [executor.submit(dsv_helpers.parse_range, path, begin, end, encoding, dialect,
+                                               fmtparams, width, pack=True, **options) if path else
+                               executor.submit(dsv_helpers.parse_range, bytes(data[begin:end]), 0, end - begin,
+                                               encoding, dialect, fmtparams, width, pack=True, **options)
+                               for begin, end in ranges]
+                    parts = [future.result() for future in futures]
+        with dsv_helpers.paused_gc():
+            columns, surplus = dsv_helpers.merge_columns(parts)
+        return DelimitedParser._assemble(fieldnames, columns, surplus, restkey=restkey, typed=typed)
+
+    @staticmethod
+    def write_dsv(canonical: Union[pd.DataFrame, dict], file_stream: Union[str, BinaryIO], header: bool=None,
+                  index: bool=None, na_rep: str=None, chunk_size: int=None, compression: str=None,
+                  encoding: str=None, dialect=None, delimiter=None, quotechar=None, escapechar=None,
+                  doublequote=None, lineterminator=None, quoting=None) -> int:
+        """ writes a DataFrame, or a dictionary of columns, as a delimited file to a binary stream or file path,
+        formatting and writing chunk_size rows at a time so memory is bounded whatever the size. Numeric, bool and
+        datetime columns are formatted a column at a time, and values are shown as DataFrame.to_csv shows them. A
+        chunk where no value needs quoting or escaping is joined directly rather than through a csv writer.
+
+        :param canonical: a pandas DataFrame or a dictionary of columns
+        :param file_stream: a binary stream or a file path to write to
+        :param header: if the column names are written as the first row. Default True
+        :param index: if the DataFrame index is written as the first column(s). Default False
+        :param na_rep: the representation of nulls. Default ''
+        :param chunk_size: the number of rows formatted and written at a time. Default 100,000
+        :param compression: (optional) 'gzip', 'bz2' or 'xz' to compress the stream
+        :param encoding: the text encoding. Default 'utf-8'
+        (see read_dsv for the dialect parameters. The default dialect quotes every field)
+        :return: the number of rows written
+        """
+        canonical = canonical if isinstance(canonical, pd.DataFrame) else pd.DataFrame(canonical)
+        header = header if isinstance(header, bool) else True
+        index = index if isinstance(index, bool) else False
+        na_rep = na_rep if isinstance(na_rep, str) else ''
+        chunk_size = chunk_size if isinstance(chunk_size, int) and chunk_size > 0 else 100_000
+        encoding = encoding if isinstance(encoding, str) else 'utf-8'
+        dialect, fmtparams = DelimitedParser._dialect(dialect=dialect, delimiter=delimiter, quotechar=quotechar,
+                                                      escapechar=escapechar, doublequote=doublequote,
+                                                      lineterminator=lineterminator, quoting=quoting)
+        columns = [canonical.iloc[:, position] for position in range(canonical.shape[1])]
+        names = [str(name) for name in canonical.columns]
+        if index:
+            levels = canonical.index.to_frame(index=False)
+            columns = [levels.iloc[:, position] for position in range(levels.shape[1])] + columns
+            names = ['' if name is None else str(name) for name in canonical.index.names] + names
+        units = [dsv_helpers.datetime_unit(column.to_numpy()) if column.dtype.kind == 'M' and
+                 isinstance(column.dtype, np.dtype) else None for column in columns]
+        compressors = {'gzip': lambda raw: gzip.GzipFile(fileobj=raw, mode='wb'),
+                       'bz2': lambda raw: bz2.BZ2File(raw, mode='wb'),
+                       'xz': lambda raw: lzma.LZMAFile(raw, mode='wb')}
+        if isinstance(compression, str) and compression.lower() not in compressors.keys():
+            raise ValueError(f"The compression '{compression}' is not one of {list(compressors.keys())}")
+        with ExitStack() as stack:
+            raw = file_stream
+            if isinstance(file_stream, (str, os.PathLike)):
+                raw = stack.enter_context(open(file_stream, 'wb'))
+            if isinstance(compression, str):
+                raw = stack.enter_context(compressors[compression.lower()](raw))
+            text = io.TextIOWrapper(raw, encoding=encoding, newline='')
+            stack.callback(text.detach)
+            stack.callback(text.flush)
+            writer = csv.writer(text, dialect, **fmtparams)
+            numeric = writer.dialect.quoting == csv.QUOTE_NONNUMERIC
+            if header:
+                writer.writerow(names)
+            for start in range(0, canonical.shape[0], chunk_size):
+                with dsv_helpers.paused_gc():
+                    chunk = [dsv_helpers.format_column(column.iloc[start:start + chunk_size], na_rep=na_rep,
+                                                       unit=unit, numeric=numeric)
+                             for column, unit in zip(columns, units)]
+                    lines = dsv_helpers.fast_lines(chunk, writer.dialect)
+                    if lines is None:
+                        writer.writerows(zip(*chunk))
+                    else:
+                        text.write(lines)
+                text.flush()
+        return canonical.shape[0]
+
+    @staticmethod
+    def _read_columns(reader, fieldnames=None, restkey=None, restval=None, typed: bool=None,
+                      block_size: int=None, sample_size: int=None, category_ratio: float=None) -> dict:
+        """ tokenizes the reader in blocks, transposing each block into the columns """
+        fieldnames = list(fieldnames) if isinstance(fieldnames, (str, list, tuple)) else None
+        restkey = restkey if isinstance(restkey, str) else None
+        restval = restval if isinstance(restval, str) else None
+        typed = typed if isinstance(typed, bool) else False
+        if fieldnames is None:
+            fieldnames = next(reader, None)
+            if fieldnames is None:
+                return {}
+        fill = '' if typed and restval is None else restval
+        columns, surplus = dsv_helpers.tokenize_columns(reader, len(fieldnames), restval=fill, block_size=block_size,
+                                                        typed=typed, sample_size=sample_size,
+                                                        category_ratio=category_ratio)
+        return DelimitedParser._assemble(fieldnames, columns, surplus, restkey=restkey, typed=typed)
+
+    @staticmethod
+    def _assemble(fieldnames: list, columns: list, surplus, restkey=None, typed: bool=None) -> dict:
+        """ names the tokenized columns, taking the result of each TypedColumn if typed """
+        if surplus is None and (len(columns) == 0 or len(columns[0]) == 0):
+            return {}
         rtn_dict = {}
-        for line in reader:
-            for k, v in line.items():
-                if k not in rtn_dict:
-                    rtn_dict[k] = []
-                rtn_dict.get(k).append(v)
+        for index, name in enumerate(fieldnames):
+            rtn_dict[name] = columns[index].result() if typed else columns[index]
+            if typed:
+                columns[index] = None
+        if surplus is not None:
+            if typed:
+                rest = np.empty(len(surplus), dtype=object)
+                rest[:] = surplus
+                rtn_dict[restkey] = np.ma.MaskedArray(rest, mask=rest == None)  # noqa: E711
+            else:
+                rtn_dict[restkey] = [value for value in surplus if value is not None]
         return rtn_dict
+
+    @staticmethod
+    def _dialect(dialect=None, delimiter=None, quotechar=None, escapechar=None, doublequote=None,
+                 skipinitialspace=None, lineterminator=None, quoting=None) -> tuple:
+        """ returns the base dialect and the csv format parameters that override it """
+        dialect = dialect if isinstance(dialect, str) or isinstance(dialect, type) else csv.unix_dialect
+        fmtparams = {}
+        for name, value in [('delimiter', delimiter), ('escapechar', escapechar), ('lineterminator', lineterminator),
+                            ('quotechar', quotechar)]:
+            if isinstance(value, str):
+                fmtparams[name] = value
+        for name, value in [('doublequote', doublequote), ('skipinitialspace', skipinitialspace)]:
+            if isinstance(value, (bool, str)):
+                fmtparams[name] = value if isinstance(value, bool) else value.lower() == 'true'
+        if isinstance(quoting, (int, str)):
+            fmtparams['quoting'] = int(quoting)
+        return dialect, fmtparams
@@ -0,0 +1,581 @@
+from contextlib import contextmanager
+from itertools import islice
+from typing import Union
+import csv
+import gc
+import io
+import mmap
+import os
+import stat
+import re
+import numpy as np
+import pandas as pd
+
+__author__ = 'Darryl Oatridge'
+
+BLOCK_SIZE = 65_536
+SAMPLE_SIZE = 10_000
+CATEGORY_RATIO = 0.5
+_SEPARATOR = '\x00'
+_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$')
+_TRUE_VALUES = ['true', 'True', 'TRUE']
+_FALSE_VALUES = ['false', 'False', 'FALSE']
+
+
+@contextmanager
+def paused_gc():
+    """ pauses the cyclic garbage collector while tokenizing. The millions of row lists and column tuples are never
+    cyclic, but allocating them triggers repeated full collections that otherwise double the parse time """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def reader_blocks(reader, width: int, restval=None, block_size: int=None):
+    """ yields blocks of up to block_size non-blank rows from a csv reader as a tuple of the list of column tuples
+    and the surplus of each row beyond width, or None if no row in the block is longer than width. Short rows are
+    padded with restval, matching csv.DictReader
+
+    :param reader: a csv reader
+    :param width: the number of fields expected per row
+    :param restval: the value for missing fields on short rows
+    :param block_size: the number of rows tokenized per block
+    """
+    block_size = block_size if isinstance(block_size, int) and block_size > 0 else BLOCK_SIZE
+    while True:
+        block = list(islice(reader, block_size))
+        if len(block) == 0:
+            return
+        rows = [row for row in block if row]
+        if len(rows) == 0:
+            continue
+        surplus = None
+        if set(map(len, rows)) != {width}:
+            if max(map(len, rows)) > width:
+                surplus = [row[width:] if len(row) > width else None for row in rows]
+            rows = [row if len(row) == width else row[:width] + [restval] * (width - len(row)) for row in rows]
+        columns = list(zip(*rows)) if width > 0 else []
+        yield columns, surplus
+
+
+def tokenize_columns(reader, width: int, restval=None, block_size: int=None, typed: bool=False, kinds: list=None,
+                     sample_size: int=None, category_ratio: float=None) -> tuple:
+    """ tokenizes a csv reader into a list of width columns and the surplus of each row beyond width, aligned
+    with the rows, or None if no row is longer than width. Columns are lists of str or, if typed, TypedColumn that
+    convert each block as it is read, using kinds or, if not given, kinds inferred from the first sample_size rows
+
+    :param reader: a csv reader positioned after any header
+    :param width: the number of fields expected per row
+    :param restval: the value for missing fields on short rows
+    :param block_size: the number of rows tokenized per block
+    :param typed: if the columns should be converted to TypedColumn
+    :param kinds: the TypedColumn kind of each column, None entries being inferred
+    :param sample_size: the number of rows kinds are inferred from. Default 10,000
+    :param category_ratio: the most distinct values, as a fraction of a sample, for a str column to be a category
+    :return: a tuple of the columns and the surplus
+    """
+    sample_size = sample_size if isinstance(sample_size, int) and sample_size > 0 else SAMPLE_SIZE
+    columns = None if typed else [[] for _ in range(width)]
+    surplus = None
+    rows = 0
+    with paused_gc():
+        for block, block_surplus in reader_blocks(reader, width, restval=restval, block_size=block_size):
+            if columns is None:
+                kinds = kinds if isinstance(kinds, list) else [None] * width
+                columns = [TypedColumn(kind or infer_kind(values[:sample_size], category_ratio=category_ratio))
+                           for kind, values in zip(kinds, block)]
+            for column, values in zip(columns, block):
+                if typed:
+                    column.append_block(values)
+                else:
+                    column.extend(values)
+            size = len(block[0]) if width > 0 else len(block_surplus)
+            surplus = _extend_surplus(surplus, rows, block_surplus, size)
+            rows += size
+    if columns is None:
+        columns = [TypedColumn(kind) for kind in (kinds if isinstance(kinds, list) else [None] * width)]
+    return columns, surplus
+
+
+def merge_columns(parts: list) -> tuple:
+    """ concatenates, in order, the (columns, surplus) tuples returned by tokenize_columns """
+    columns, surplus = parts[0]
+    columns = [unpack_column(column) for column in columns]
+    rows = len(columns[0]) if len(columns) > 0 else len(surplus or [])
+    for part_columns, part_surplus in parts[1:]:
+        part_columns = [unpack_column(column) for column in part_columns]
+        for column, values in zip(columns, part_columns):
+            column.extend(values)
+        size = len(part_columns[0]) if len(part_columns) > 0 else len(part_surplus or [])
+        surplus = _extend_surplus(surplus, rows, part_surplus, size)
+        rows += size
+    return columns, surplus
+
+
+def _extend_surplus(surplus, rows: int, block_surplus, size: int):
+    """ extends the aligned surplus with a block, creating it from the row count when a block first has one """
+    if block_surplus is not None and surplus is None:
+        surplus = [None] * rows
+    if surplus is not None:
+        surplus.extend(block_surplus if block_surplus is not None else [None] * size)
+    return surplus
+
+
+class _MappedRaw(io.RawIOBase):
+    """ a raw stream over a mmap, so a TextIOWrapper decodes the file incrementally straight from the page cache """
+
+    def __init__(self, mapped, position: int=0):
+        self._mapped = mapped
+        self._position = position
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), len(self._mapped) - self._position)
+        buffer[:size] = self._mapped[self._position:self._position + size]
+        self._position += size
+        return size
+
+
+@contextmanager
+def source_text(source, encoding: str='utf-8', buffer_size: int=None):
+    """ yields a text stream of newline='' lines over a file path or binary stream, reading regular files through
+    mmap and decoding incrementally so the file is never held in memory as a whole. Text streams and other
+    iterables of lines are yielded unchanged """
+    buffer_size = buffer_size if isinstance(buffer_size, int) and buffer_size > 0 else 1 << 20
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file:
+            with _mapped_text(file, 0, encoding, buffer_size) as text:
+                yield text
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield io.TextIOWrapper(io.BytesIO(source), encoding=encoding, newline='')
+    elif isinstance(source, (io.RawIOBase, io.BufferedIOBase)):
+        if _is_regular_file(source):
+            with _mapped_text(source, source.tell(), encoding, buffer_size) as text:
+                yield text
+        else:
+            text = io.TextIOWrapper(source, encoding=encoding, newline='')
+            try:
+                yield text
+            finally:
+                text.detach()
+    else:
+        yield source
+
+
+@contextmanager
+def _mapped_text(file, position: int, encoding: str, buffer_size: int):
+    if os.fstat(file.fileno()).st_size == 0:
+        yield io.StringIO('')
+        return
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        text = io.TextIOWrapper(io.BufferedReader(_MappedRaw(mapped, position), buffer_size=buffer_size),
+                                encoding=encoding, newline='')
+        try:
+            yield text
+        finally:
+            text.close()
+
+
+def _is_regular_file(stream) -> bool:
+    try:
+        return stat.S_ISREG(os.fstat(stream.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return False
+
+
+@contextmanager
+def source_bytes(source, encoding: str='utf-8'):
+    """ yields the content of a file path as a read only mmap, or of a buffer or stream as bytes """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                yield b''
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+    elif isinstance(source, (bytes, bytearray)):
+        yield source
+    elif isinstance(source, memoryview):
+        yield source.tobytes()
+    elif isinstance(source, io.StringIO):
+        yield source.getvalue().encode(encoding)
+    elif isinstance(source, io.BytesIO):
+        yield source.getvalue()
+    elif hasattr(source, 'read'):
+        content = source.read()
+        yield content.encode(encoding) if isinstance(content, str) else content
+    else:
+        raise ValueError(f"The source must be a file path, buffer or stream, not {type(source)}")
+
+
+def read_records(data, start: int, encoding: str, dialect, fmtparams: dict, count: int=1) -> tuple:
+    """ parses up to count records of data from start, returning the records and the offset after the last """
+    offset = [start]
+
+    def lines():
+        position = start
+        while position < len(data):
+            newline = data.find(b'\n', position)
+            end = len(data) if newline < 0 else newline + 1
+            offset[0] = end
+            yield bytes(data[position:end]).decode(encoding)
+            position = end
+
+    return list(islice(csv.reader(lines(), dialect, **fmtparams), count)), offset[0]
+
+
+def read_header(data, encoding: str, dialect, fmtparams: dict) -> tuple:
+    """ parses the first record of data, returning the record, or None if data is empty, and the offset after it """
+    records, offset = read_records(data, 0, encoding, dialect, fmtparams, count=1)
+    return records[0] if len(records) > 0 else None, offset
+
+
+def record_ranges(data, start: int, parts: int, quotechar: str=None, min_size: int=None) -> list:
+    """ splits data[start:] into up to parts (start, end) byte ranges that each begin at a record boundary. A
+    newline is a record boundary only if an even number of quotechar precede it, so quoted fields holding newlines
+    are never split. This assumes quotechar only appears in quoted fields, with embedded quotes doubled, and that
+    the encoding is ASCII compatible. If the total quote count is odd the assumption is broken and a single range
+    is returned
+
+    :param data: a bytes like object or mmap
+    :param start: the offset of the first record
+    :param parts: the number of ranges wanted
+    :param quotechar: the quote character or None if quotes are not recognised
+    :param min_size: the smallest range worth splitting off. Default 1MB
+    :return: a list of (start, end) tuples
+    """
+    size = len(data)
+    min_size = min_size if isinstance(min_size, int) and min_size > 0 else 1 << 20
+    parts = max(1, min(parts, (size - start) // min_size))
+    if parts == 1:
+        return [(start, size)]
+    quote = quotechar.encode() if isinstance(quotechar, str) and len(quotechar.encode()) == 1 else None
+    step = (size - start) // parts
+    boundaries = [start]
+    position = start
+    quotes = 0
+    for target in [start + step * i for i in range(1, parts)]:
+        if target <= position:
+            continue
+        quotes += _count(data, quote, position, target)
+        position = target
+        while True:
+            newline = data.find(b'\n', position)
+            if newline < 0:
+                position = size
+                break
+            quotes += _count(data, quote, position, newline)
+            position = newline + 1
+            if quotes % 2 == 0:
+                if position < size:
+                    boundaries.append(position)
+                break
+        if position >= size:
+            break
+    quotes += _count(data, quote, position, size)
+    if quotes % 2 != 0:
+        return [(start, size)]
+    return list(zip(boundaries, boundaries[1:] + [size]))
+
+
+def _count(data, quote, start: int, end: int, window: int=1 << 26) -> int:
+    """ counts the quote bytes in data[start:end] in bounded windows, as mmap has no count """
+    if quote is None:
+        return 0
+    return sum(data[offset:min(offset + window, end)].count(quote) for offset in range(start, end, window))
+
+
+def parse_range(source, start: int, end: int, encoding: str, dialect, fmtparams: dict, width: int,
+                restval=None, block_size: int=None, typed: bool=False, kinds: list=None, category_ratio: float=None,
+                pack: bool=False) -> tuple:
+    """ a process pool worker that tokenizes the records in source[start:end], where source is a file path, or the
+    bytes of the range with start and end relative to them. If pack, str columns are packed for the return trip """
+    if isinstance(source, str):
+        with open(source, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            content = mapped[start:end]
+    else:
+        content = bytes(source[start:end])
+    # line iteration through a TextIOWrapper is markedly faster than over one large StringIO
+    reader = csv.reader(io.TextIOWrapper(io.BytesIO(content), encoding=encoding, newline=''), dialect, **fmtparams)
+    columns, surplus = tokenize_columns(reader, width, restval=restval, block_size=block_size, typed=typed,
+                                        kinds=kinds, category_ratio=category_ratio)
+    return [pack_column(column) for column in columns] if pack and not typed else columns, surplus
+
+
+def pack_column(values: list):
+    """ joins a column of str into a tuple of one separated str and the count, which pickles between processes
+    several times faster than the list. Columns holding None or the separator are returned unchanged """
+    try:
+        joined = _SEPARATOR.join(values)
+    except TypeError:
+        return values
+    if joined.count(_SEPARATOR) != max(len(values) - 1, 0):
+        return values
+    return joined, len(values)
+
+
+def unpack_column(packed) -> list:
+    """ reverses pack_column """
+    if isinstance(packed, tuple):
+        joined, size = packed
+        return joined.split(_SEPARATOR) if size > 0 else []
+    return packed
+
+
+def infer_kind(values, category_ratio: float=None):
+    """ returns the TypedColumn kind of a sample of str values, or None if every value is null. A str sample is a
+    category if its distinct values are no more than category_ratio of the values. Default 0.5, 0 disabling it """
+    category_ratio = category_ratio if isinstance(category_ratio, (int, float)) else CATEGORY_RATIO
+    data = np.empty(len(values), dtype=object)
+    data[:] = values
+    valid = data[~((data == '') | (data == None))]  # noqa: E711 elementwise comparison
+    if len(valid) == 0:
+        return None
+    for kind, convert in _CONVERTERS.items():
+        if convert(valid) is not None:
+            return kind
+    if len(pd.unique(valid)) <= category_ratio * len(valid):
+        return 'category'
+    return 'str'
+
+
+class TypedColumn(object):
+    """ builds a typed column from blocks of str, converting each block as it arrives so the str values are only
+    ever held a block at a time. Kinds are 'int', 'float', 'bool', 'datetime', 'category', 'str' and 'object', or
+    None until a block with a value is seen. Empty strings and None are null. An int column that meets a float is
+    promoted to float, and any other value that doesn't convert turns the column to 'object', where earlier blocks
+    keep their converted python values, as pandas does with mixed type chunks. Categories are dictionary encoded,
+    with codes assigned in order of first appearance """
+
+    def __init__(self, kind: str=None):
+        self.kind = kind
+        self._blocks = []
+        self._index = {}
+
+    def __len__(self):
+        return sum(len(mask) for _, mask in self._blocks)
+
+    def append_block(self, values):
+        """ converts and appends a block of str values """
+        data = np.empty(len(values), dtype=object)
+        data[:] = values
+        mask = (data == '') | (data == None)  # noqa: E711 elementwise comparison
+        if mask.all():
+            self._blocks.append((None, mask))
+            return
+        if self.kind is None:
+            self.kind = infer_kind(data, category_ratio=0)
+        if self.kind == 'category':
+            self._blocks.append((self._encode(data, mask), mask))
+            return
+        if self.kind in _CONVERTERS.keys():
+            valid = data[~mask]
+            converted = _CONVERTERS[self.kind](valid)
+            if converted is None and self.kind == 'int':
+                converted = _to_float(valid)
+                if converted is not None:
+                    self._coerce('float')
+            if converted is not None:
+                block = np.zeros(len(data), dtype=_DTYPES[self.kind])
+                block[~mask] = converted
+                self._blocks.append((block, mask))
+                return
+            self._coerce('object')
+        data[mask] = ''
+        self._blocks.append((data, mask))
+
+    def extend(self, other):
+        """ appends the blocks of another TypedColumn, reconciling the kinds """
+        if other.kind is not None and self.kind is None:
+            self.kind = other.kind
+            self._index = other._index
+        elif other.kind is not None and other.kind != self.kind:
+            kinds = {self.kind, other.kind}
+            target = 'float' if kinds == {'int', 'float'} else 'str' if kinds == {'str', 'category'} else 'object'
+            self._coerce(target)
+            other._coerce(target)
+        if self.kind == 'category' and other._index is not self._index:
+            lookup = np.array([self._index.setdefault(value, len(self._index)) for value in other._index],
+                              dtype=np.int32)
+            self._blocks.extend([(None if data is None or len(lookup) == 0 else
+                                  np.where(data < 0, -1, lookup[data]).astype(np.int32), mask)
+                                 for data, mask in other._blocks])
+        else:
+            self._blocks.extend(other._blocks)
+
+    def result(self):
+        """ returns the column as a numpy masked array or, for a category, a pandas Categorical """
+        kind = self.kind or 'str'
+        parts = []
+        for data, mask in self._blocks:
+            if data is None:
+                data = np.full(len(mask), -1 if kind == 'category' else '' if _DTYPES[kind] is object else 0,
+                               dtype=_DTYPES[kind])
+            parts.append(data)
+        data = np.concatenate(parts) if len(parts) > 0 else np.empty(0, dtype=_DTYPES[kind])
+        if kind == 'category':
+            return pd.Categorical.from_codes(data, categories=list(self._index.keys()))
+        mask = np.concatenate([mask for _, mask in self._blocks]) if len(parts) > 0 else np.empty(0, dtype=bool)
+        return np.ma.MaskedArray(data, mask=mask)
+
+    def _encode(self, data: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        data[mask] = None
+        codes, uniques = pd.factorize(data)
+        lookup = np.array([self._index.setdefault(value, len(self._index)) for value in uniques], dtype=np.int32)
+        return np.where(codes < 0, -1, lookup[codes]).astype(np.int32)
+
+    def _coerce(self, kind: str):
+        """ converts the blocks already held to kind, which is 'float' from 'int', or 'str' or 'object' """
+        if self.kind == kind:
+            return
+        categories = np.array(list(self._index.keys()) + [''], dtype=object)
+        blocks = []
+        for data, mask in self._blocks:
+            if data is not None:
+                if kind == 'float':
+                    data = data.astype(np.float64)
+                elif self.kind == 'category':
+                    data = categories[data]
+                else:
+                    data = data.astype('datetime64[us]' if self.kind == 'datetime' else data.dtype).astype(object)
+                    data[mask] = ''
+            blocks.append((data, mask))
+        self._blocks = blocks
+        self._index = {}
+        self.kind = kind
+
+
+def datetime_unit(values: np.ndarray) -> str:
+    """ the coarsest of 'D', 's', 'ms', 'us' or 'ns' that shows every datetime64 value in full, as to_csv chooses """
+    ticks = values.astype('datetime64[ns]').view(np.int64)[~np.isnat(values)]
+    for unit, size in [('D', _NANOS['D']), ('s', _NANOS['s']), ('ms', _NANOS['ms']), ('us', _NANOS['us'])]:
+        if (ticks % size == 0).all():
+            return unit
+    return 'ns'
+
+
+def format_column(series: pd.Series, na_rep: str='', unit: str=None, numeric: bool=False) -> list:
+    """ formats a column, or a chunk of one, as a list of str the way DataFrame.to_csv does. Nulls become na_rep
+
+    :param series: the column values
+    :param na_rep: the representation of nulls
+    :param unit: for datetime64 columns, the datetime_unit of the whole column so all chunks agree
+    :param numeric: if True, int and float values are left as python numbers for csv QUOTE_NONNUMERIC
+    :return: a list of str
+    """
+    kind = series.dtype.kind if isinstance(series.dtype, np.dtype) else None
+    if kind in ('i', 'u', 'f', 'b') and numeric:
+        values = series.to_numpy(dtype=object, copy=True)
+        values[pd.isna(values)] = na_rep
+        return values.tolist()
+    if kind in ('i', 'u'):
+        return list(map(str, series.to_numpy().tolist()))
+    if kind == 'b':
+        return list(map(str, series.to_numpy().tolist()))
+    if kind == 'f':
+        values = series.to_numpy()
+        if values.dtype == np.float64:
+            formatted = list(map(repr, values.tolist()))
+        else:
+            # tolist widens float32 and float16 to python floats, whose repr shows the float64 digits
+            formatted = list(map(str, values))
+        for position in np.flatnonzero(np.isnan(values)).tolist():
+            formatted[position] = na_rep
+        return formatted
+    if kind == 'M':
+        return _format_datetimes(series.to_numpy(), na_rep, unit or datetime_unit(series.to_numpy()))
+    values = series.to_numpy(dtype=object, copy=True)
+    nulls = pd.isna(values)
+    if nulls.any():
+        values[nulls] = na_rep
+    return values.tolist()
+
+
+def _format_datetimes(values: np.ndarray, na_rep: str, unit: str) -> list:
+    """ formats the distinct days and times of day apart, as a column has far fewer of each than it has values """
+    nanos = values.astype('datetime64[ns]').view(np.int64)
+    nulls = np.isnat(values)
+    days = nanos // _NANOS['D']
+    day_codes, day_values = pd.factorize(days)
+    day_text = np.datetime_as_string(day_values.astype('datetime64[D]')).astype(object)
+    formatted = day_text[day_codes]
+    if unit != 'D':
+        times = (nanos - days * _NANOS['D']) // _NANOS[unit]
+        time_codes, time_values = pd.factorize(times)
+        digits = {'ms': 3, 'us': 6, 'ns': 9}.get(unit, 0)
+        time_text = np.array([_format_time(value, unit, digits) for value in time_values.tolist()], dtype=object)
+        formatted = formatted + time_text[time_codes]
+    formatted[nulls] = na_rep
+    return formatted.tolist()
+
+
+def _format_time(value: int, unit: str, digits: int) -> str:
+    seconds, fraction = divmod(value, _NANOS['s'] // _NANOS[unit])
+    text = f" {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return f"{text}.{fraction:0{digits}d}" if digits > 0 else text
+
+
+def fast_lines(chunk: list, dialect) -> Union[str, None]:
+    """ joins a chunk of formatted columns into delimited lines directly when no value needs the quoting or
+    escaping of a csv writer, otherwise returns None. Values are checked by searching each column joined as one
+    str for the special characters, so the check runs at C speed """
+    if len(chunk) < 2 or dialect.skipinitialspace or dialect.quoting not in (csv.QUOTE_MINIMAL, csv.QUOTE_ALL,
+                                                                               csv.QUOTE_NONE):
+        return None
+    specials = {dialect.delimiter, '\r', '\n'}.union(dialect.lineterminator)
+    specials.update(char for char in (dialect.quotechar, dialect.escapechar) if char)
+    pattern = re.compile('|'.join(re.escape(char) for char in specials))
+    for values in chunk:
+        try:
+            if pattern.search(''.join(values)):
+                return None
+        except TypeError:
+            return None
+    if dialect.quoting == csv.QUOTE_ALL:
+        quote = dialect.quotechar
+        joiner = (quote + dialect.delimiter + quote).join
+        lines = [quote + line + quote for line in map(joiner, zip(*chunk))]
+    else:
+        lines = list(map(dialect.delimiter.join, zip(*chunk)))
+    return dialect.lineterminator.join(lines) + dialect.lineterminator if len(lines) > 0 else ''
+
+
+def _to_int(valid: np.ndarray):
+    try:
+        return valid.astype(np.int64)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def _to_float(valid: np.ndarray):
+    try:
+        return valid.astype(np.float64)
+    except (ValueError, TypeError):
+        return None
+
+
+def _to_bool(valid: np.ndarray):
+    if len(valid) == 0 or not np.isin(valid, _TRUE_VALUES + _FALSE_VALUES).all():
+        return None
+    return np.isin(valid, _TRUE_VALUES)
+
+
+def _to_datetime(valid: np.ndarray):
+    if len(valid) == 0 or not isinstance(valid[0], str) or not _DATE_PATTERN.match(valid[0]):
+        return None
+    try:
+        return valid.astype('datetime64[ns]')
+    except (ValueError, TypeError):
+        return None
+
+
+_CONVERTERS = {'int': _to_int, 'float': _to_float, 'bool': _to_bool, 'datetime': _to_datetime}
+_NANOS = {'D': 86_400_000_000_000, 's': 1_000_000_000, 'ms': 1_000_000, 'us': 1_000, 'ns': 1}
+_DTYPES = {'int': np.int64, 'float': np.float64, 'bool': np.bool_, 'datetime': 'datetime64[ns]', 'category': np.int32,
+           'str': object, 'object': object}
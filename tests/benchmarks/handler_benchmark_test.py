@@ -0,0 +1,53 @@
+import unittest
+from tests.benchmarks.handler_benchmark import CASES, run_case, run_benchmarks, compare_reports, sample_frame
+
+
+class HandlerBenchmarkTest(unittest.TestCase):
+
+    def test_sample_frame(self):
+        df = sample_frame(100)
+        self.assertEqual((100, 6), df.shape)
+        self.assertTrue(df.equals(sample_frame(100)))
+
+    def test_run_case(self):
+        for name in ['redis', 'redis_columnar', 'mongodb']:
+            results = run_case(name, size=200, repeat=2)
+            self.assertEqual(list(CASES[name].operations), [r['operation'] for r in results])
+            for result in results:
+                if 'skipped' in result:
+                    continue
+                self.assertEqual(200, result['rows'])
+                self.assertGreater(result['rows_per_s'], 0)
+                self.assertGreater(result['peak_rss_mb'], 0)
+                self.assertLessEqual(result['min'], result['p50'])
+                self.assertLessEqual(result['p50'], result['max'])
+
+    def test_skipped(self):
+        result = run_case('postgres', size=10, repeat=1)
+        self.assertEqual(1, len(result))
+        self.assertIn('--uri postgres=', result[0]['skipped'])
+
+    def test_isolated(self):
+        report = run_benchmarks(cases=['redis_columnar'], sizes=[100], repeat=1)
+        self.assertEqual(2, len(report['results']))
+        self.assertIn('python', report)
+
+    def test_compare(self):
+        baseline = {'results': [{'case': 'redis', 'operation': 'load', 'size': 10, 'p50': 1.0, 'peak_rss_mb': 100},
+                                {'case': 'redis', 'operation': 'persist', 'size': 10, 'p50': 1.0,
+                                 'peak_rss_mb': 100},
+                                {'case': 'mysql', 'operation': 'load', 'size': 10, 'skipped': 'no pymysql'}]}
+        current = {'results': [{'case': 'redis', 'operation': 'load', 'size': 10, 'p50': 1.25, 'peak_rss_mb': 90},
+                               {'case': 'redis', 'operation': 'persist', 'size': 10, 'p50': 1.05,
+                                'peak_rss_mb': 100},
+                               {'case': 'mysql', 'operation': 'load', 'size': 10, 'p50': 1.0, 'peak_rss_mb': 1}]}
+        result = {(c['case'], c['operation']): c for c in compare_reports(current, baseline, threshold=0.1)}
+        self.assertEqual([('redis', 'load'), ('redis', 'persist')], list(result.keys()))
+        self.assertTrue(result[('redis', 'load')]['regression'])
+        self.assertAlmostEqual(0.25, result[('redis', 'load')]['change'])
+        self.assertEqual(-10, result[('redis', 'load')]['rss_change_mb'])
+        self.assertFalse(result[('redis', 'persist')]['regression'])
+
+
+if __name__ == '__main__':
+    unittest.main()
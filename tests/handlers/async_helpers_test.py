@@ -0,0 +1,283 @@
+import unittest
+import asyncio
+import importlib.util
+import threading
+import time
+from unittest import mock
+from aistac.handlers.abstract_handlers import ConnectorContract
+from ds_connectors.handlers.async_helpers import AsyncHandlerMixin, loop_client, close_loop_clients
+from ds_connectors.handlers.instrument_helpers import Instrumentation, MemoryCollector
+from ds_connectors.handlers.registry_helpers import ConnectionRegistry
+
+
+class _BlockingHandler(AsyncHandlerMixin):
+
+    def __init__(self, delay: float=0.0):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self.persisted = []
+        self._lock = threading.Lock()
+
+    def load_canonical(self, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        return {'a': [1, 2, 3], **kwargs}
+
+    def persist_canonical(self, canonical, **kwargs) -> bool:
+        self.persisted.append(canonical)
+        return True
+
+
+class _SourceOnlyHandler(AsyncHandlerMixin):
+
+    def load_canonical(self, **kwargs):
+        return {}
+
+
+class _NativeHandler(_BlockingHandler):
+
+    async def _load_canonical_native(self, **kwargs):
+        with Instrumentation.operation(self, 'load_canonical', mode='async') as op:
+            await asyncio.sleep(0.01)
+            op.add(rows=kwargs.get('rows', 0))
+        return {'native': [True]}
+
+
+class AsyncHandlerMixinTest(unittest.TestCase):
+
+    def tearDown(self):
+        AsyncHandlerMixin.configure()
+        Instrumentation.clear_sinks()
+
+    def test_executor_fallback(self):
+        handler = _BlockingHandler()
+        result = asyncio.run(handler.load_canonical_async(b=[4]))
+        self.assertEqual({'a': [1, 2, 3], 'b': [4]}, result)
+        self.assertTrue(asyncio.run(handler.persist_canonical_async({'a': [1]})))
+        self.assertEqual([{'a': [1]}], handler.persisted)
+
+    def test_native(self):
+        handler = _NativeHandler()
+        self.assertEqual({'native': [True]}, asyncio.run(handler.load_canonical_async()))
+
+    def test_bounded_workers(self):
+        AsyncHandlerMixin.configure(max_workers=2)
+        handler = _BlockingHandler(delay=0.02)
+
+        async def fan_out():
+            return await asyncio.gather(*[handler.load_canonical_async() for _ in range(8)])
+
+        self.assertEqual(8, len(asyncio.run(fan_out())))
+        self.assertEqual(2, handler.peak)
+
+    def test_source_only(self):
+        with self.assertRaises(NotImplementedError):
+            asyncio.run(_SourceOnlyHandler().persist_canonical_async({}))
+
+    def test_driver_available(self):
+        self.assertTrue(AsyncHandlerMixin.driver_available('asyncio'))
+        self.assertFalse(AsyncHandlerMixin.driver_available('no_such_driver_module'))
+        self.assertFalse(AsyncHandlerMixin.driver_available('no_such_package.sub'))
+
+    def test_instrumentation_tasks(self):
+        collector = MemoryCollector()
+        Instrumentation.add_sink(collector)
+        handler = _NativeHandler()
+
+        async def fan_out():
+            await asyncio.gather(*[handler.load_canonical_async(rows=i) for i in range(5)])
+
+        asyncio.run(fan_out())
+        self.assertEqual([0, 1, 2, 3, 4], sorted(e['rows'] for e in collector.events))
+        self.assertIs(Instrumentation.current(), Instrumentation.current())
+
+
+class LoopClientTest(unittest.TestCase):
+
+    def test_loop_client(self):
+        created, closed = [], []
+
+        async def factory():
+            await asyncio.sleep(0)
+            created.append(object())
+            return created[-1]
+
+        async def close(client):
+            closed.append(client)
+
+        async def run():
+            clients = await asyncio.gather(*[loop_client(('test', 'a'), factory, close) for _ in range(4)])
+            other = await loop_client(('test', 'b'), factory, close)
+            await close_loop_clients()
+            return clients, other
+
+        clients, other = asyncio.run(run())
+        self.assertEqual(1, len({id(c) for c in clients}))
+        self.assertIsNot(clients[0], other)
+        self.assertEqual(2, len(created))
+        self.assertEqual(2, len(closed))
+        # a new loop creates its own client
+        second, _ = asyncio.run(run())
+        self.assertIsNot(clients[0], second[0])
+
+    def test_failed_factory(self):
+        calls = []
+
+        def factory():
+            calls.append(1)
+            if len(calls) == 1:
+                raise ConnectionError("refused")
+            return 'client'
+
+        async def run():
+            with self.assertRaises(ConnectionError):
+                await loop_client(('test', 'fail'), factory)
+            return await loop_client(('test', 'fail'), factory)
+
+        self.assertEqual('client', asyncio.run(run()))
+
+
+class _AsyncCursor(object):
+    # an async cursor over a mongomock cursor, as the native Mongo load uses it
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def to_list(self, length=None):
+        return list(self._cursor)
+
+
+class _AsyncCollection(object):
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return _AsyncCursor(self._collection.find(*args, **kwargs))
+
+    async def aggregate(self, pipeline, **kwargs):
+        return _AsyncCursor(self._collection.aggregate(pipeline))
+
+
+class _AsyncMongoClient(object):
+    # pymongo's AsyncMongoClient over the mongomock client the synchronous loads use
+
+    client = None
+    created = []
+
+    def __init__(self, address):
+        self._client = _AsyncMongoClient.client
+        _AsyncMongoClient.created.append(self)
+
+    def __getitem__(self, database):
+        return _AsyncDatabase(self._client[database])
+
+    def close(self):
+        pass
+
+
+class _AsyncDatabase(object):
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, collection):
+        return _AsyncCollection(self._database[collection])
+
+
+@unittest.skipUnless(importlib.util.find_spec('fakeredis') and importlib.util.find_spec('redis'),
+                     'requires redis and fakeredis')
+class RedisNativeLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        import fakeredis
+        self.server = fakeredis.FakeServer()
+        self.conn = fakeredis.FakeRedis(server=self.server)
+        for idx in range(1_500):
+            self.conn.hset(f'hadron.{idx}', mapping={'a': idx, 'b': 'x' if idx % 2 else ''})
+        self.conn.set('hadron:version', 'token')
+        self.clients = []
+
+        def from_url(uri, **kwargs):
+            self.clients.append(fakeredis.FakeAsyncRedis(server=self.server, **kwargs))
+            return self.clients[-1]
+
+        patcher = mock.patch('redis.asyncio.from_url', from_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        ConnectionRegistry.close_all()
+
+    def test_native_load(self):
+        from ds_connectors.handlers.redis_handlers import RedisSourceHandler
+        cc = ConnectorContract(uri='redis://localhost:6379/0', module_name='', handler='', keys=['a', 'b'])
+        handler = RedisSourceHandler(cc)
+
+        async def fan_out():
+            results = await asyncio.gather(*[handler.load_canonical_async(pipeline_depth=400, scan_type=scan_type)
+                                             for scan_type in ['HASH', '']])
+            await close_loop_clients()
+            return results
+
+        for result in asyncio.run(fan_out()):
+            self.assertEqual(['id', 'a', 'b'], list(result.keys()))
+            self.assertEqual(list(range(1_500)), sorted(int(x) for x in result['a']))
+            self.assertEqual(750, result['b'].count(None))
+        # one client per loop, and the call kwargs are not written back to the contract
+        self.assertEqual(1, len(self.clients))
+        self.assertNotIn('pipeline_depth', handler.connector_contract.kwargs)
+        # the blocking async_scan path closes its loop's client
+        self.assertEqual(1_500, len(handler.load_canonical(async_scan=True)['id']))
+        self.assertEqual(2, len(self.clients))
+
+
+@unittest.skipUnless(importlib.util.find_spec('mongomock') and importlib.util.find_spec('pymongo.asynchronous'),
+                     'requires mongomock and pymongo 4.9 or later')
+class MongodbNativeLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        import mongomock
+        import pymongo
+        _AsyncMongoClient.client = mongomock.MongoClient()
+        _AsyncMongoClient.created = []
+        patchers = [mock.patch.object(pymongo, 'MongoClient', lambda address: _AsyncMongoClient.client),
+                    mock.patch.object(pymongo, 'AsyncMongoClient', _AsyncMongoClient)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        ConnectionRegistry.close_all()
+
+    def test_native_load(self):
+        from ds_connectors.handlers.mongodb_handlers import MongodbSourceHandler
+        uri = "mongodb://localhost:27017/test?collection=hadron_native&&find={'val': {'$lt': 50}}"
+        handler = MongodbSourceHandler(ConnectorContract(uri=uri, module_name='', handler=''))
+        handler._mongo_collection.drop()
+        handler._mongo_collection.insert_many([{'_id': i, 'val': i} for i in range(100)])
+
+        async def fan_out():
+            results = await asyncio.gather(*[handler.load_canonical_async() for _ in range(3)])
+            await close_loop_clients()
+            return results
+
+        for result in asyncio.run(fan_out()):
+            self.assertEqual(list(range(50)), sorted(result['val'].to_list()))
+        self.assertEqual(1, len(_AsyncMongoClient.created))
+        self.assertTrue(handler.load_canonical().equals(asyncio.run(handler.load_canonical_async())))
+        uri = "mongodb://localhost:27017/test?collection=hadron_native&&aggregate=[{'$match': {'val': {'$gte': 90}}}]"
+        handler = MongodbSourceHandler(ConnectorContract(uri=uri, module_name='', handler=''))
+        self.assertEqual(10, asyncio.run(handler.load_canonical_async()).shape[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
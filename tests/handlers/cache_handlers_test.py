@@ -0,0 +1,145 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+import pandas as pd
+from aistac.handlers.abstract_handlers import AbstractSourceHandler, ConnectorContract
+from ds_connectors.handlers.cache_handlers import CachedSourceHandler
+
+
+class _CountingHandler(AbstractSourceHandler):
+
+    def __init__(self, connector_contract: ConnectorContract, canonical=None):
+        super().__init__(connector_contract)
+        self.canonical = canonical if canonical is not None else pd.DataFrame({'a': [1, 2, 3], 'b': list('xyz')})
+        self.loads = 0
+        self.version = 0
+        self._seen = None
+        self._changed_flag = True
+
+    def supported_types(self) -> list:
+        return ['test']
+
+    def exists(self) -> bool:
+        return True
+
+    def has_changed(self) -> bool:
+        if self.version != self._seen:
+            self._changed_flag = True
+            self._seen = self.version
+        return self._changed_flag
+
+    def reset_changed(self, changed: bool = False):
+        self._changed_flag = changed
+
+    def load_canonical(self, **kwargs):
+        self.loads += 1
+        return self.canonical
+
+
+class CachedSourceHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cc = ConnectorContract('test://localhost/db?query=select', module_name='', handler='', table='t')
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_hit(self):
+        source = _CountingHandler(self.cc)
+        handler = CachedSourceHandler.wrap(source, cache_path=self.path)
+        first = handler.load_canonical()
+        second = handler.load_canonical()
+        self.assertEqual(1, source.loads)
+        self.assertTrue(first.equals(second))
+        # a second handler on the same contract shares the result
+        CachedSourceHandler.wrap(_CountingHandler(self.cc), cache_path=self.path).load_canonical()
+        self.assertEqual(1, len(os.listdir(self.path)))
+        # different load kwargs are a different result
+        handler.load_canonical(limit=1)
+        self.assertEqual(2, source.loads)
+        self.assertTrue(handler.invalidate())
+        handler.load_canonical()
+        self.assertEqual(3, source.loads)
+
+    def test_dict_canonical(self):
+        canonical = {'id': ['k1', 'k2'], 'value': [1.5, None]}
+        source = _CountingHandler(self.cc, canonical=canonical)
+        handler = CachedSourceHandler.wrap(source, cache_path=self.path)
+        handler.load_canonical()
+        self.assertEqual(canonical, handler.load_canonical())
+        self.assertEqual(1, source.loads)
+
+    def test_uncacheable(self):
+        source = _CountingHandler(self.cc, canonical=pd.DataFrame({'a': [1, 'x', 2.5]}))
+        handler = CachedSourceHandler.wrap(source, cache_path=self.path)
+        handler.load_canonical()
+        handler.load_canonical()
+        self.assertEqual(2, source.loads)
+
+    def test_ttl(self):
+        source = _CountingHandler(self.cc)
+        handler = CachedSourceHandler.wrap(source, ttl=0.05, cache_path=self.path)
+        handler.load_canonical()
+        time.sleep(0.1)
+        handler.load_canonical()
+        self.assertEqual(2, source.loads)
+
+    def test_lru(self):
+        source = _CountingHandler(self.cc)
+        handler = CachedSourceHandler.wrap(source, cache_path=self.path)
+        handler.load_canonical(part=0)
+        size = os.path.getsize(handler.cache_file(part=0))
+        handler = CachedSourceHandler.wrap(source, max_bytes=size * 2, cache_path=self.path)
+        handler.load_canonical(part=1)
+        os.utime(handler.cache_file(part=0), (time.time() - 60, time.time() - 60))
+        handler.load_canonical(part=2)
+        self.assertFalse(os.path.exists(handler.cache_file(part=0)))
+        self.assertTrue(os.path.exists(handler.cache_file(part=1)))
+        self.assertTrue(os.path.exists(handler.cache_file(part=2)))
+
+    def test_revalidate(self):
+        source = _CountingHandler(self.cc)
+        handler = CachedSourceHandler.wrap(source, revalidate=True, cache_path=self.path)
+        handler.load_canonical()
+        handler.load_canonical()
+        self.assertEqual(1, source.loads)
+        source.version += 1
+        handler.load_canonical()
+        self.assertEqual(2, source.loads)
+        handler.load_canonical()
+        self.assertEqual(2, source.loads)
+
+    @unittest.skipIf(os.name == 'nt', 'requires POSIX permissions')
+    def test_secure_dir(self):
+        self.assertIn(str(os.getuid()), CachedSourceHandler.default_cache_path())
+        path = os.path.join(self.path, 'cache')
+        source = _CountingHandler(self.cc)
+        handler = CachedSourceHandler.wrap(source, cache_path=path)
+        handler.load_canonical()
+        self.assertEqual(0o700, os.stat(path).st_mode & 0o777)
+        # a directory others can write to is bypassed
+        os.chmod(path, 0o777)
+        handler.load_canonical()
+        handler.load_canonical()
+        self.assertEqual(3, source.loads)
+
+    def test_from_contract(self):
+        cc = ConnectorContract('test://localhost/db', module_name='ds_connectors.handlers.cache_handlers',
+                               handler='CachedSourceHandler', cache_module=__name__,
+                               cache_handler='_CountingHandler', cache_path=self.path, table='t')
+        handler = CachedSourceHandler(cc)
+        self.assertIsInstance(handler.handler, _CountingHandler)
+        self.assertNotIn('cache_path', handler.handler.connector_contract.kwargs)
+        self.assertEqual(['test'], handler.supported_types())
+        handler.load_canonical()
+        handler.load_canonical()
+        self.assertEqual(1, handler.handler.loads)
+        with self.assertRaises(ValueError):
+            CachedSourceHandler(ConnectorContract('test://localhost/db', module_name='', handler=''))
+
+
+if __name__ == '__main__':
+    unittest.main()
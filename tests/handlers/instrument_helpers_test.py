@@ -0,0 +1,88 @@
+import unittest
+import json
+import logging
+from ds_connectors.handlers.instrument_helpers import Instrumentation, MemoryCollector, LoggingSink
+
+
+class _Contract(object):
+    schema = 'mysql'
+    hostname = 'localhost'
+
+
+class _Handler(object):
+    connector_contract = _Contract()
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        Instrumentation.clear_sinks()
+        self.handler = _Handler()
+
+    def tearDown(self):
+        Instrumentation.clear_sinks()
+
+    def test_disabled(self):
+        self.assertFalse(Instrumentation.enabled())
+        op = Instrumentation.operation(self.handler, 'load_canonical')
+        self.assertIs(op, Instrumentation.current())
+        with op as recorder, recorder.phase('query'):
+            recorder.add(rows=10)
+        self.assertFalse(hasattr(op, 'event'))
+
+    def test_operation(self):
+        collector = MemoryCollector()
+        Instrumentation.add_sink(collector)
+        with Instrumentation.operation(self.handler, 'load_canonical', table='t') as op:
+            with op.phase('connect', counter='pool_wait'):
+                pass
+            with op.phase('query'):
+                Instrumentation.current().add(retries=1)
+            op.add(rows=100, bytes=2048)
+            op.add(rows=50)
+        self.assertEqual(1, len(collector.events))
+        event = collector.events[0]
+        self.assertEqual('_Handler', event['handler'])
+        self.assertEqual('load_canonical', event['operation'])
+        self.assertEqual(('mysql', 'localhost', 't'), (event['schema'], event['host'], event['table']))
+        self.assertEqual((150, 2048, 1), (event['rows'], event['bytes'], event['retries']))
+        self.assertEqual(['connect', 'query'], list(event['phases'].keys()))
+        self.assertEqual(event['phases']['connect'], event['pool_wait'])
+        self.assertGreaterEqual(event['duration'], sum(event['phases'].values()))
+        self.assertIsNone(event['error'])
+        self.assertFalse(hasattr(Instrumentation.current(), 'event'))
+
+    def test_error(self):
+        collector = MemoryCollector()
+        Instrumentation.add_sink(collector)
+        Instrumentation.add_sink(lambda event: 1 / 0)
+        with self.assertRaises(ValueError):
+            with Instrumentation.operation(self.handler, 'persist_canonical'):
+                raise ValueError('bad table')
+        self.assertEqual('ValueError: bad table', collector.events[0]['error'])
+
+    def test_summary(self):
+        collector = MemoryCollector(max_events=3)
+        Instrumentation.add_sink(collector)
+        for rows in range(5):
+            with Instrumentation.operation(self.handler, 'load_canonical') as op, op.phase('query'):
+                op.add(rows=rows)
+        self.assertEqual(3, len(collector.events))
+        result = collector.summary()
+        self.assertEqual(3, result.loc[('_Handler', 'load_canonical'), 'count'])
+        self.assertEqual(9, result.loc[('_Handler', 'load_canonical'), 'rows'])
+        self.assertIn('phase.query', result.columns)
+        collector.clear()
+        self.assertEqual(0, collector.summary().shape[0])
+
+    def test_logging_sink(self):
+        logger = logging.getLogger('instrument_helpers_test')
+        Instrumentation.add_sink(LoggingSink(logger=logger))
+        with self.assertLogs(logger, level='INFO') as context:
+            with Instrumentation.operation(self.handler, 'load_canonical') as op:
+                op.add(rows=1)
+        self.assertEqual(1, json.loads(context.records[0].getMessage())['rows'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,10 +2,12 @@ import unittest
 import os
 from pathlib import Path
 import shutil
+from unittest import mock
 import pandas as pd
 from aistac.handlers.abstract_handlers import ConnectorContract
 from ds_discovery import SyntheticBuilder
 from aistac.properties.property_manager import PropertyManager
+from ds_connectors.handlers.mongodb_handlers import MongodbPersistHandler
 
 
 class MongodbHandlerTest(unittest.TestCase):
@@ -98,6 +100,131 @@ class MongodbHandlerTest(unittest.TestCase):
         self.assertEqual(1000, result['count'].iloc[0])
         sb.remove_canonical(sb.CONNECTOR_PERSIST)
 
+    def test_handler_columnar(self):
+        sb = SyntheticBuilder.from_memory()
+        df = self.data(size=1_000)
+        os.environ['collection'] = 'hadron_table'
+        uri = "mongodb://localhost:27017/test?collection=${collection}&&find={}&&project={'cat':1, 'num':1, 'int':1, '_id':0}&&decode=columnar"
+        sb.set_persist_uri(uri=uri)
+        sb.remove_canonical(sb.CONNECTOR_PERSIST)
+        sb.save_persist_canonical(df)
+        result = sb.load_persist_canonical()
+        self.assertEqual((1000, 3), result.shape)
+        self.assertEqual(['cat', 'num', 'int'], result.columns.to_list())
+        self.assertEqual('float64', result['num'].dtype.name)
+        uri = "mongodb://localhost:27017/test?collection=${collection}&&find={}&&decode=columnar&&schema={'cat': 'str', 'num': 'float'}"
+        sb.set_persist_uri(uri=uri)
+        result = sb.load_persist_canonical()
+        self.assertEqual(['cat', 'num'], result.columns.to_list())
+        sb.remove_canonical(sb.CONNECTOR_PERSIST)
+
+    def test_handler_chunks(self):
+        sb = SyntheticBuilder.from_memory()
+        df = self.data(size=1_000)
+        os.environ['collection'] = 'hadron_table'
+        uri = "mongodb://localhost:27017/test?collection=${collection}&&find={}&&batch_size=300"
+        sb.set_persist_uri(uri=uri)
+        sb.remove_canonical(sb.CONNECTOR_PERSIST)
+        sb.save_persist_canonical(df)
+        handler = sb.pm.get_connector_handler(sb.CONNECTOR_PERSIST)
+        result = [chunk.shape[0] for chunk in handler.load_canonical_chunks()]
+        self.assertEqual([300, 300, 300, 100], result)
+        result = [chunk.shape[0] for chunk in handler.load_canonical_chunks(chunk_size=600)]
+        self.assertEqual([600, 400], result)
+        sb.remove_canonical(sb.CONNECTOR_PERSIST)
+
+    def test_incremental_int_watermark(self):
+        uri = "mongodb://localhost:27017/test?collection=hadron_incremental&&incremental=delta&&watermark_field=seq"
+        handler = MongodbPersistHandler(ConnectorContract(uri=uri, module_name='', handler=''))
+        handler.persist_canonical(pd.DataFrame({'seq': [1, 2, 3], 'val': list('abc')}), if_exists='replace')
+        self.assertEqual([1, 2, 3], handler.load_canonical()['seq'].to_list())
+        handler.persist_canonical(pd.DataFrame({'seq': [4, 5], 'val': list('de')}), if_exists='append')
+        self.assertEqual([4, 5], handler.load_canonical()['seq'].to_list())
+        self.assertEqual(0, handler.load_canonical().shape[0])
+        # the chunked load moves the watermark too
+        handler.reset_watermark()
+        self.assertEqual([3, 2], [chunk.shape[0] for chunk in handler.load_canonical_chunks(chunk_size=3)])
+        handler.persist_canonical(pd.DataFrame({'seq': [6], 'val': ['f']}), if_exists='append')
+        self.assertEqual([6], handler.load_canonical()['seq'].to_list())
+        handler.remove_canonical()
+        with self.assertRaises(ValueError):
+            MongodbPersistHandler(ConnectorContract(uri=uri + "&&aggregate=[{'$match':{}}]", module_name='',
+                                                    handler=''))
+
+    def test_incremental_chunks_out_of_order(self):
+        uri = "mongodb://localhost:27017/test?collection=hadron_incremental&&incremental=delta&&watermark_field=seq"
+        handler = MongodbPersistHandler(ConnectorContract(uri=uri, module_name='', handler=''))
+        handler.persist_canonical(pd.DataFrame({'seq': [5, 6, 1, 2, 3], 'val': list('abcde')}), if_exists='replace')
+        # the chunks arrive in insertion order, so the last holds neither the largest value nor the watermark
+        chunks = [chunk['seq'].to_list() for chunk in handler.load_canonical_chunks(chunk_size=2)]
+        self.assertEqual([[5, 6], [1, 2], [3]], chunks)
+        handler.persist_canonical(pd.DataFrame({'seq': [7], 'val': ['f']}), if_exists='append')
+        self.assertEqual([7], handler.load_canonical()['seq'].to_list())
+        # a snapshot is built from the chunks
+        handler = MongodbPersistHandler(ConnectorContract(uri=uri.replace('delta', 'snapshot'), module_name='',
+                                                          handler=''))
+        self.assertEqual(3, len(list(handler.load_canonical_chunks(chunk_size=2))))
+        handler.persist_canonical(pd.DataFrame({'seq': [8], 'val': ['g']}), if_exists='append')
+        self.assertEqual([5, 6, 1, 2, 3, 7, 8], handler.load_canonical()['seq'].to_list())
+        handler.remove_canonical()
+
+    def test_parallel_ranges(self):
+        uri = "mongodb://localhost:27017/test?collection=hadron_parallel&&find={'val': {'$lt': 900}}&&parallel=3"
+        handler = MongodbPersistHandler(ConnectorContract(uri=uri, module_name='', handler=''))
+        handler.remove_canonical()
+        handler._mongo_collection.insert_many([{'_id': i, 'val': i} for i in range(1_000)] + [{'_id': 'key', 'val': 1}])
+        collection_class = type(handler._mongo_collection)
+        aggregate, pipelines = collection_class.aggregate, []
+
+        def recording(collection, pipeline, *args, **kwargs):
+            pipelines.append(pipeline)
+            return aggregate(collection, pipeline, *args, **kwargs)
+
+        with mock.patch.object(collection_class, 'aggregate', recording):
+            result = handler.load_canonical()
+            self.assertEqual(901, result.shape[0])
+            self.assertIn('key', result['_id'].to_list())
+            self.assertEqual(901, result['_id'].nunique())
+            # an unindexed filter is applied by the ranges, leaving the $sample to the random cursor
+            self.assertIn('$sample', pipelines[-1][0])
+            handler._mongo_collection.create_index('val')
+            selective = MongodbPersistHandler(ConnectorContract(uri=uri.replace("900", "5"), module_name='', handler=''))
+            result = selective.load_canonical()
+            self.assertEqual([0, 1, 1, 2, 3, 4], sorted(result['val'].to_list()))
+            self.assertEqual({'$match': {'val': {'$lt': 5}}}, pipelines[-1][0])
+            # an indexed filter matching more than the sample is not matched first
+            handler = MongodbPersistHandler(ConnectorContract(uri=uri + '&&split_sample=100', module_name='',
+                                                              handler=''))
+            self.assertEqual(901, handler.load_canonical().shape[0])
+            self.assertIn('$sample', pipelines[-1][0])
+        handler.remove_canonical()
+
+    def test_replace_keeps_indexes(self):
+        uri = "mongodb://localhost:27017/test?collection=hadron_replace"
+        handler = MongodbPersistHandler(ConnectorContract(uri=uri, module_name='', handler=''))
+        handler.persist_canonical(pd.DataFrame({'seq': [1, 2], 'val': list('ab')}))
+        handler._mongo_collection.create_index('seq', unique=True, name='seq_unique')
+        handler.persist_canonical(pd.DataFrame({'seq': [3, 4, 5], 'val': list('cde')}), if_exists='replace')
+        self.assertEqual([3, 4, 5], handler.load_canonical()['seq'].to_list())
+        self.assertTrue(handler._mongo_collection.index_information()['seq_unique'].get('unique'))
+        # the default appends
+        handler.persist_canonical(pd.DataFrame({'seq': [6], 'val': ['f']}))
+        self.assertEqual(4, handler.load_canonical().shape[0])
+        handler.persist_canonical(pd.DataFrame({'seq': [], 'val': []}), if_exists='replace')
+        self.assertEqual(0, handler.load_canonical().shape[0])
+        self.assertIn('seq_unique', handler._mongo_collection.index_information())
+        handler.remove_canonical()
+
+    def test_change_stream_filter(self):
+        uri = "mongodb://localhost:27017/test?collection=hadron_table&&find={'cat': 'ACTIVE', '$or': [{'int': {'$gt': 0}}, {'num': 1}]}"
+        handler = MongodbPersistHandler(ConnectorContract(uri=uri, module_name='', handler=''))
+        match = handler._change_pipeline()[0]['$match']['$or']
+        self.assertEqual({'operationType': {'$nin': ['insert', 'update', 'replace']}}, match[0])
+        self.assertEqual({'fullDocument.cat': 'ACTIVE', '$or': [{'fullDocument.int': {'$gt': 0}},
+                                                                {'fullDocument.num': 1}]}, match[1])
+        uri = "mongodb://localhost:27017/test?collection=hadron_table&&find={'$expr': {'$gt': ['$int', 0]}}"
+        self.assertEqual([], MongodbPersistHandler(ConnectorContract(uri=uri, module_name='', handler=''))._change_pipeline())
+
     def test_connector_contract(self):
         os.environ['HADRON_ADDITION'] = 'myAddition'
         os.environ['collection'] = 'hadron_table'
@@ -0,0 +1,99 @@
+import unittest
+import csv
+import gzip
+import os
+import shutil
+import tempfile
+from io import StringIO, BytesIO
+import numpy as np
+import pandas as pd
+
+from ds_connectors.parsers.dsv import DelimitedParser
+
+
+class DelimitedParserTest(unittest.TestCase):
+
+    def test_read_dsv_compatible(self):
+        text = 'a,b,c\n1,"x,\ny",\n\n2,z\n3,"q""r",4,5,6\n'
+        expected = {}
+        for line in csv.DictReader(StringIO(text), restkey='rest', restval='-', dialect=csv.unix_dialect):
+            for k, v in line.items():
+                expected.setdefault(k, []).append(v)
+        result = DelimitedParser.read_dsv(StringIO(text), restkey='rest', restval='-', block_size=2)
+        self.assertEqual(expected, result)
+        self.assertEqual(['a', 'b', 'c', 'rest'], list(result.keys()))
+        self.assertEqual({}, DelimitedParser.read_dsv(StringIO('')))
+
+    def test_read_dsv_typed(self):
+        text = 'i|f|b|d|s\n1|1.5|true|2023-01-01|a\n|2|False|2023-01-02 10:00:00|\n3||TRUE||c\n'
+        result = DelimitedParser.read_dsv(StringIO(text), delimiter='|', typed=True)
+        self.assertEqual(['int64', 'float64', 'bool', 'datetime64[ns]', 'object'],
+                         [result[k].dtype.name for k in 'ifbds'])
+        self.assertEqual([1, None, 3], result['i'].tolist())
+        self.assertEqual([1.5, 2.0, None], result['f'].tolist())
+        self.assertEqual([True, False, True], result['b'].tolist())
+        self.assertEqual(np.datetime64('2023-01-02T10:00'), result['d'][1])
+        self.assertEqual([False, False, True], result['d'].mask.tolist())
+        self.assertEqual(['a', None, 'c'], result['s'].tolist())
+
+    def test_read_dsv_categories(self):
+        text = 'cc,amount\n' + ''.join(f'{"GB" if i % 3 else ""},{i}\n' for i in range(3_000)) + 'US,1.5\n'
+        result = DelimitedParser.read_dsv(StringIO(text), typed=True, block_size=1_000, sample_size=500)
+        self.assertIsInstance(result['cc'], pd.Categorical)
+        self.assertEqual(['GB', 'US'], result['cc'].categories.to_list())
+        self.assertEqual(1_000, result['cc'].isna().sum())
+        self.assertEqual('float64', result['amount'].dtype.name)
+        self.assertEqual(1.5, result['amount'][-1])
+        result = DelimitedParser.read_dsv(StringIO(text), typed=True, category_ratio=0)
+        self.assertEqual('object', result['cc'].dtype.name)
+
+    def test_read_dsv_parallel(self):
+        text = 'a,b\n' + ''.join(f'{i},"line\n{i}, ""q"""\n' for i in range(20_000))
+        expected = DelimitedParser.read_dsv(StringIO(text, newline=''))
+        result = DelimitedParser.read_dsv_parallel(text.encode(), processes=4, min_size=1_000)
+        self.assertEqual(expected, result)
+        result = DelimitedParser.read_dsv_parallel(text.encode(), processes=4, min_size=1_000, typed=True)
+        self.assertEqual(list(range(20_000)), result['a'].tolist())
+
+    def test_read_dsv_chunks(self):
+        path = os.path.join(tempfile.mkdtemp(), 'chunks.csv')
+        with open(path, 'w', newline='') as file:
+            file.write('a,b\n' + ''.join(f'{i},"x\n{i}"\n\n' for i in range(2_500)))
+        expected = DelimitedParser.read_dsv(open(path, newline=''))
+        self.assertEqual(expected, DelimitedParser.read_dsv(path))
+        with open(path, 'rb') as file:
+            self.assertEqual(expected, DelimitedParser.read_dsv(file))
+        chunks = list(DelimitedParser.read_dsv_chunks(path, chunk_size=1_000))
+        self.assertEqual([1_000, 1_000, 500], [len(chunk['a']) for chunk in chunks])
+        self.assertEqual(expected['b'], [value for chunk in chunks for value in chunk['b']])
+        frames = list(DelimitedParser.read_dsv_chunks(path, chunk_size=1_000, as_frame=True, typed=True))
+        self.assertEqual(list(range(2_000, 2_500)), frames[-1]['a'].to_list())
+        shutil.rmtree(os.path.dirname(path))
+
+    def test_write_dsv(self):
+        df = pd.DataFrame({'num': [1.5, np.nan, 0.1], 'int': [1, 2, 3], 'flag': [True, False, True],
+                           'text': ['a,"b"', None, 'c'], 'date': pd.to_datetime(['2023-01-01', None, '2023-01-03']),
+                           'cat': pd.Categorical(['x', 'y', 'x'])})
+        for quoting in [csv.QUOTE_MINIMAL, csv.QUOTE_ALL]:
+            stream = BytesIO()
+            self.assertEqual(3, DelimitedParser.write_dsv(df, stream, index=True, quoting=quoting, chunk_size=2))
+            self.assertEqual(df.to_csv(quoting=quoting), stream.getvalue().decode())
+        stream = BytesIO()
+        DelimitedParser.write_dsv(df.drop(columns='text'), stream, compression='gzip', delimiter='|')
+        self.assertFalse(stream.closed)
+        result = DelimitedParser.read_dsv(BytesIO(gzip.decompress(stream.getvalue())), delimiter='|', typed=True)
+        self.assertEqual([1.5, None, 0.1], result['num'].tolist())
+        self.assertEqual(['x', 'y', 'x'], result['cat'].tolist())
+
+    def test_write_dsv_narrow_floats(self):
+        df = pd.DataFrame({'f32': np.array([0.1, np.nan, 123456.7, 1e-7], dtype=np.float32),
+                           'f16': np.array([0.1, 1.5, np.nan, 2], dtype=np.float16)})
+        stream = BytesIO()
+        DelimitedParser.write_dsv(df, stream, quoting=csv.QUOTE_MINIMAL)
+        self.assertEqual(df.to_csv(index=False), stream.getvalue().decode())
+        result = DelimitedParser.read_dsv(BytesIO(stream.getvalue()), typed=True)
+        self.assertEqual([0.1, None, 123456.7, 1e-07], result['f32'].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+import pandas as pd
+import redis
+
+from ds_connectors.handlers.redis_handlers import RedisSourceHandler, RedisPersistHandler
+from aistac.handlers.abstract_handlers import ConnectorContract
+
+
+class RedisHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = redis.from_url('redis://localhost:6379/0')
+        self.conn.flushdb()
+
+    def tearDown(self):
+        self.conn.flushdb()
+        self.conn.close()
+
+    def test_load_pipelined(self):
+        for idx in range(2_500):
+            self.conn.hset(f'hadron.{idx}', mapping={'a': idx, 'b': 'x' if idx % 2 else ''})
+        self.conn.set('hadron:other', 'not a hash')
+        cc = ConnectorContract(uri='redis://localhost:6379/0', module_name='', handler='', keys=['a', 'b', 'c'])
+        handler = RedisSourceHandler(cc)
+        result = handler.load_canonical(pipeline_depth=1_000)
+        self.assertEqual(['id', 'a', 'b', 'c'], list(result.keys()))
+        self.assertEqual(2_500, len(result['id']))
+        self.assertEqual(list(range(2_500)), sorted(int(x) for x in result['a']))
+        self.assertEqual(1_250, result['b'].count(None))
+        self.assertEqual([None] * 2_500, result['c'])
+
+    def test_load_async(self):
+        for idx in range(5_000):
+            self.conn.hset(f'hadron.{idx}', mapping={'a': idx})
+        cc = ConnectorContract(uri='redis://localhost:6379/0', module_name='', handler='', keys=['a', 'b'])
+        handler = RedisSourceHandler(cc)
+        result = handler.load_canonical(async_scan=True, concurrency=3, pipeline_depth=700, count=300)
+        self.assertEqual(['id', 'a', 'b'], list(result.keys()))
+        self.assertEqual(5_000, len(set(result['id'])))
+        self.assertEqual(list(range(5_000)), sorted(int(x) for x in result['a']))
+        self.assertEqual([None] * 5_000, result['b'])
+
+    def test_load_async_failed_fetch(self):
+        # without the SCAN TYPE filter HMGET on a string key fails, and the scan must not wait on the dead fetcher
+        for idx in range(300):
+            self.conn.set(f'hadron.{idx}', 'not a hash')
+        cc = ConnectorContract(uri='redis://localhost:6379/0', module_name='', handler='', keys=['a'])
+        handler = RedisSourceHandler(cc)
+        with self.assertRaises(redis.RedisError):
+            handler.load_canonical(scan_type='', async_scan=True, concurrency=1, pipeline_depth=10, count=10)
+        with self.assertRaises(redis.RedisError):
+            handler.load_canonical(scan_type='')
+
+    def test_persist_pipelined(self):
+        cc = ConnectorContract(uri='redis://localhost:6379/0?prefix=hadron', module_name='', handler='',
+                               keys=['num', 'cat'])
+        handler = RedisPersistHandler(cc)
+        df = pd.DataFrame({'uid': range(10_000), 'num': [1.5, None] * 5_000, 'cat': list('ab') * 5_000})
+        self.assertTrue(handler.persist_canonical(df, idFieldName='uid', batch_size=3_000, ttl=60))
+        self.assertEqual({b'uid': b'0', b'num': b'1.5', b'cat': b'a'}, self.conn.hgetall('hadron.0'))
+        self.assertEqual({b'uid': b'1', b'cat': b'b'}, self.conn.hgetall('hadron.1'))
+        self.assertTrue(0 < self.conn.ttl('hadron.9999') <= 60)
+        result = handler.load_canonical()
+        self.assertEqual(10_000, len(result['id']))
+        # without the SCAN TYPE filter the version key is skipped rather than read as a hash
+        self.assertEqual(10_000, len(handler.load_canonical(scan_type='')['id']))
+        self.assertEqual(10_000, len(handler.load_canonical(scan_type='', async_scan=True)['id']))
+
+    def test_remove_canonical(self):
+        cc = ConnectorContract(uri='redis://localhost:6379/0?prefix=hadron', module_name='', handler='', keys=['num'])
+        handler = RedisPersistHandler(cc)
+        handler.persist_canonical(pd.DataFrame({'num': range(25_000)}))
+        self.conn.set('other.0', 1)
+        self.assertEqual(25_000, handler.remove_prefix('hadron', batch_size=700, pipeline_depth=3))
+        self.assertEqual(0, handler.remove_prefix('hadron'))
+        handler.persist_canonical(pd.DataFrame({'num': range(100)}))
+        self.assertTrue(handler.remove_canonical())
+        self.assertEqual([b'other.0'], self.conn.keys('*'))
+
+    def test_columnar_layout(self):
+        cc = ConnectorContract(uri='redis://localhost:6379/0?prefix=features&layout=columnar', module_name='',
+                               handler='')
+        handler = RedisPersistHandler(cc)
+        df = pd.DataFrame({'num': range(250_000), 'cat': list('ab') * 125_000})
+        self.assertTrue(handler.persist_canonical(df, row_group_size=100_000, compression='zstd'))
+        # three row groups, the manifest and the version
+        self.assertEqual(5, len(self.conn.keys('features:*')))
+        result = handler.load_canonical()
+        self.assertTrue(df.equals(result))
+        # a re-persist swaps the manifest and removes the previous generation
+        handler.persist_canonical(df.head(5))
+        self.assertEqual(3, len(self.conn.keys('features:*')))
+        self.assertEqual((5, 1), handler.load_canonical(keys=['cat']).shape)
+        self.assertTrue(handler.remove_canonical())
+        self.assertEqual([], self.conn.keys('features:*'))
+
+    def test_has_changed(self):
+        cc = ConnectorContract(uri='redis://localhost:6379/0?prefix=hadron', module_name='', handler='', keys=['num'])
+        persist = RedisPersistHandler(cc)
+        source = RedisSourceHandler(cc)
+        self.assertTrue(source.has_changed())
+        source.reset_changed()
+        self.assertFalse(source.has_changed())
+        persist.persist_canonical(pd.DataFrame({'num': range(10)}))
+        self.assertTrue(source.has_changed())
+        source.reset_changed()
+        self.assertFalse(source.has_changed())
+        persist.remove_canonical()
+        self.assertTrue(source.has_changed())
+
+
+if __name__ == '__main__':
+    unittest.main()